@@ -70,6 +70,7 @@ from models_pods import Pod, Password
 from models_volumes import Volume
 from models_snapshots import Snapshot
 from models_admin import Template
+from models_permissions import ObjectPermission
 
 target_metadata = SQLModel.metadata
 
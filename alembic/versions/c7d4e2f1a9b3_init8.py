@@ -0,0 +1,50 @@
+"""init8
+
+Revision ID: c7d4e2f1a9b3
+Revises: b3c1d2e4f5a6
+Create Date: 2026-10-19 14:03:12.118406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel              ##### Required when using sqlmodel and not use sqlalchemy
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'c7d4e2f1a9b3'
+down_revision = 'b3c1d2e4f5a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade(engine_name):
+    globals()["upgrade_alltenants"]()
+
+
+def downgrade(engine_name):
+    globals()["downgrade_alltenants"]()
+
+
+
+
+def upgrade_alltenants():
+    # NOTIFY pods_template_changed (payload is the schema) on any template change.
+    # models_admin.TemplateAllowList listens to invalidate its cache.
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_template_changed() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('pods_template_changed', TG_TABLE_SCHEMA);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+        CREATE TRIGGER template_changed
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON template
+        FOR EACH STATEMENT EXECUTE PROCEDURE notify_template_changed();
+    """)
+
+
+def downgrade_alltenants():
+    op.execute("DROP TRIGGER IF EXISTS template_changed ON template;")
+    op.execute("DROP FUNCTION IF EXISTS notify_template_changed();")
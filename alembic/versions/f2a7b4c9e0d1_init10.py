@@ -0,0 +1,89 @@
+"""init10
+
+Revision ID: f2a7b4c9e0d1
+Revises: e1f6a9c3d8b2
+Create Date: 2026-10-19 18:12:36.904215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel              ##### Required when using sqlmodel and not use sqlalchemy
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'f2a7b4c9e0d1'
+down_revision = 'e1f6a9c3d8b2'
+branch_labels = None
+depends_on = None
+
+# {table: primary key column} for tables with permissions arrays.
+PERMISSION_TABLES = {'pod': 'pod_id', 'volume': 'volume_id', 'snapshot': 'snapshot_id'}
+
+# sync_object_permission from init9 with a rule for users listed more than once, e.g. ["a:READ", "a:ADMIN"].
+# The last entry wins, same as get_permissions(). An INSERT can't touch the same row twice, so duplicates
+# are dropped with DISTINCT ON before the ON CONFLICT DO UPDATE.
+SYNC_FUNCTION = """
+    CREATE OR REPLACE FUNCTION sync_object_permission() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            EXECUTE format('DELETE FROM %I.object_permission WHERE object_type = $1 AND object_id = $2', TG_TABLE_SCHEMA)
+            USING TG_TABLE_NAME, to_jsonb(OLD) ->> TG_ARGV[0];
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            EXECUTE format('INSERT INTO %I.object_permission (object_type, object_id, username, level)
+                            SELECT DISTINCT ON (split_part(perm, '':'', 1)) $1, $2, split_part(perm, '':'', 1), split_part(perm, '':'', 2)
+                            FROM unnest($3) WITH ORDINALITY AS perms(perm, idx)
+                            ORDER BY split_part(perm, '':'', 1), idx DESC
+                            ON CONFLICT (object_type, object_id, username) DO UPDATE SET level = EXCLUDED.level', TG_TABLE_SCHEMA)
+            USING TG_TABLE_NAME, to_jsonb(NEW) ->> TG_ARGV[0], NEW.permissions;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+# init9's version, restored on downgrade.
+SYNC_FUNCTION_INIT9 = """
+    CREATE OR REPLACE FUNCTION sync_object_permission() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            EXECUTE format('DELETE FROM %I.object_permission WHERE object_type = $1 AND object_id = $2', TG_TABLE_SCHEMA)
+            USING TG_TABLE_NAME, to_jsonb(OLD) ->> TG_ARGV[0];
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            EXECUTE format('INSERT INTO %I.object_permission (object_type, object_id, username, level)
+                            SELECT $1, $2, split_part(perm, '':'', 1), split_part(perm, '':'', 2) FROM unnest($3) AS perm
+                            ON CONFLICT (object_type, object_id, username) DO NOTHING', TG_TABLE_SCHEMA)
+            USING TG_TABLE_NAME, to_jsonb(NEW) ->> TG_ARGV[0], NEW.permissions;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade(engine_name):
+    globals()["upgrade_alltenants"]()
+
+
+def downgrade(engine_name):
+    globals()["downgrade_alltenants"]()
+
+
+
+
+def upgrade_alltenants():
+    op.execute(SYNC_FUNCTION)
+    # Rebuild rows the init9 backfill and trigger took from the first of a user's duplicate entries.
+    for table, pk in PERMISSION_TABLES.items():
+        op.execute(f"""
+            INSERT INTO object_permission (object_type, object_id, username, level)
+            SELECT DISTINCT ON ({pk}, split_part(perm, ':', 1)) '{table}', {pk}, split_part(perm, ':', 1), split_part(perm, ':', 2)
+            FROM {table}, unnest(permissions) WITH ORDINALITY AS perms(perm, idx)
+            ORDER BY {pk}, split_part(perm, ':', 1), idx DESC
+            ON CONFLICT (object_type, object_id, username) DO UPDATE SET level = EXCLUDED.level;
+        """)
+
+
+def downgrade_alltenants():
+    op.execute(SYNC_FUNCTION_INIT9)
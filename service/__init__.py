@@ -1,3 +1,4 @@
+import time
 from tapisservice.tenants import TenantCache
 from tapisservice.auth import get_service_tapis_client
 from tapisservice.logs import get_logger
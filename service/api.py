@@ -1,4 +1,8 @@
-from utils import error_handler, HttpUrlRedirectMiddleware
+import threading
+
+from utils import error_handler, HttpUrlRedirectMiddleware, ReadReplicaMiddleware, RequestObjectsMiddleware
+from stores import start_warmup
+from tapisservice.config import conf
 from tapisservice.tapisfastapi.utils import GlobalsMiddleware
 from tapisservice.tapisfastapi.auth import TapisMiddleware
 
@@ -6,6 +10,8 @@ from __init__ import Tenants
 from fastapi import FastAPI
 from fastapi.middleware import Middleware
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.exceptions import RequestValidationError
 
 from auth import authorization, authentication
@@ -77,6 +83,7 @@ api = FastAPI(
         "url": "https://github.com/tapis-project/pods_service",
     },
     debug=False,
+    default_response_class=ORJSONResponse,
     exception_handlers={
         Exception: error_handler,
         RequestValidationError: error_handler,
@@ -84,6 +91,10 @@ api = FastAPI(
     },
     middleware=[
         Middleware(HttpUrlRedirectMiddleware),
+        # Compresses responses larger than response_gzip_minimum_size for clients sending Accept-Encoding: gzip.
+        *([Middleware(GZipMiddleware, minimum_size=conf.get('response_gzip_minimum_size', 4096))] if conf.get('response_gzip', True) else []),
+        Middleware(ReadReplicaMiddleware),
+        Middleware(RequestObjectsMiddleware),
         Middleware(GlobalsMiddleware),
         Middleware(
             CORSMiddleware,
@@ -114,3 +125,23 @@ api.include_router(router_pods_podsid)
 api.include_router(router_pods_podsid_func)
 # misc
 api.include_router(router_misc)
+
+
+@api.on_event("startup")
+def start_store_warmup():
+    start_warmup()
+
+
+@api.on_event("startup")
+def start_in_process_components():
+    """
+    Single-node deployments can run the spawner and health in the api process with
+    conf.in_process_components. Required with queue_backend "inprocess" since commands don't leave the process.
+    """
+    components = conf.get('in_process_components') or []
+    if "spawner" in components:
+        from spawner import main as spawner_main
+        threading.Thread(target=spawner_main, name="in-process-spawner", daemon=True).start()
+    if "health" in components:
+        from health import main as health_main
+        threading.Thread(target=health_main, name="in-process-health", daemon=True).start()
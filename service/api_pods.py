@@ -1,8 +1,11 @@
-from fastapi import APIRouter
-from models_pods import Pod, NewPod, Password, PodsResponse, PodResponse
+from datetime import datetime
+from fastapi import APIRouter, Query
+from models_pods import Pod, NewPod, Password, PodResponseModel, PodsResponse, PodResponse, BulkPodAction, BulkPodsResponse
+from models_permissions import ObjectPermission
 from channels import CommandChannel
 from tapisservice.tapisfastapi.utils import g, ok
-from codes import REQUESTED, ON
+from codes import REQUESTED, ON, OFF, RESTART, STOPPED, ADMIN, ADMIN_ROLE, PRIORITY_CREATE, PRIORITY_START
+from utils import check_permission_level, list_where_params, list_columns, display_rows, list_response
 from tapisservice.logs import get_logger
 logger = get_logger(__name__)
 
@@ -17,24 +20,52 @@ router = APIRouter()
     tags=["Pods"],
     summary="get_pods",
     operation_id="get_pods",
-    response_model=PodsResponse)
-async def get_pods():
+    response_model=PodsResponse,
+    response_model_exclude_unset=True)
+async def get_pods(status: str | None = None,
+                   status_requested: str | None = None,
+                   template: str | None = None,
+                   created_after: datetime | None = None,
+                   created_before: datetime | None = None,
+                   sort: str | None = None,
+                   fields: str | None = None,
+                   limit: int | None = Query(None, ge=1, le=1000),
+                   cursor: str | None = None):
     """
     Get all pods in your respective tenant and site that you have READ or higher access to.
 
+    Query parameters, all applied in the database:
+    - status, status_requested, template: exact match, comma separated to match any.
+    - created_after, created_before: creation_ts window (UTC).
+    - sort: field to sort by, prefix with '-' for descending. Defaults to pod_id.
+    - fields: comma separated fields to return, required fields like pod_id are always returned.
+    - limit and cursor: keyset pagination. With a limit, metadata.next_cursor is the cursor for the next page, null on the last page.
+
     Returns a list of pods.
     """
     logger.info("GET /pods - Top of get_pods.")
 
-    # TODO search
-    pods =  Pod.db_get_all_with_permission(user=g.username, level='READ', tenant=g.request_tenant_id, site=g.site_id)
-
-    pods_to_show = []
-    for pod in pods:
-        pods_to_show.append(pod.display())
+    where_params = list_where_params(status=status,
+                                     status_requested=status_requested,
+                                     pod_template=template,
+                                     created_after=created_after,
+                                     created_before=created_before)
+    columns = list_columns(fields, Pod, PodResponseModel)
+    pods, next_cursor = await Pod.adb_list_with_permission(user=g.username,
+                                                           level='READ',
+                                                           tenant=g.request_tenant_id,
+                                                           site=g.site_id,
+                                                           where_params=where_params,
+                                                           sort=sort,
+                                                           limit=limit,
+                                                           cursor=cursor,
+                                                           columns=columns)
+
+    # Rows only hold the projected columns, no full Pod objects are built for listings.
+    pods_to_show = display_rows(pods, columns)
 
     logger.info("Pods retrieved.")
-    return ok(result=pods_to_show, msg="Pods retrieved successfully.")
+    return list_response(result=pods_to_show, msg="Pods retrieved successfully.", metadata={"count": len(pods_to_show), "limit": limit, "next_cursor": next_cursor})
 
 
 @router.post(
@@ -60,25 +91,106 @@ async def create_pod(new_pod: NewPod):
 
     # Create pod password db entry. If it's successful, we continue.
     password = Password(pod_id=pod.pod_id)
-    password.db_create()
+    await password.adb_create()
     logger.debug(f"Created password entry for {pod.pod_id}")
 
     # Create pod database entry
-    pod.db_create()
+    await pod.adb_create()
     logger.debug(f"New pod saved in db. pod_id: {pod.pod_id}; pod_template: {pod.pod_template}; tenant: {g.request_tenant_id}.")
 
     # If status_requested = On, then we request pod and put a command. Else leave in default STOPPED state. 
     if pod.status_requested == ON:
         pod.status = REQUESTED
-        pod.db_update()
+        pod.start_trace()
+        await pod.adb_update()
 
         # Send command to start new pod
-        ch = CommandChannel(name=pod.site_id)
+        ch = CommandChannel.for_object(site_id=pod.site_id, object_type="pod")
         ch.put_cmd(object_id=pod.pod_id,
                    object_type="pod",
                    tenant_id=pod.tenant_id,
-                   site_id=pod.site_id)
+                   site_id=pod.site_id,
+                   priority=PRIORITY_CREATE,
+                   trace_id=pod.trace_id)
         ch.close()
         logger.debug(f"Command Channel - Added msg for pod_id: {pod.pod_id}.")
 
     return ok(result=pod.display(), msg="Pod created successfully.")
+
+
+#### /pods/bulk
+
+@router.post(
+    "/pods/bulk",
+    tags=["Pods"],
+    summary="bulk_pod_action",
+    operation_id="bulk_pod_action",
+    response_model=BulkPodsResponse)
+async def bulk_pod_action(bulk_action: BulkPodAction):
+    """
+    Start, stop, or restart many pods in one call.
+
+    Notes:
+    - Requires ADMIN on each pod, same as start_pod, stop_pod, and restart_pod.
+    - Pods are fetched in one query, updated in one transaction, and start commands are published in one batch.
+    - start only applies to pods in STOPPED status.
+
+    Returns result for each pod_id, with success and message.
+    """
+    logger.info(f"POST /pods/bulk - Top of bulk_pod_action. action: {bulk_action.action}; pod count: {len(bulk_action.pod_ids)}")
+
+    action = bulk_action.action
+    pod_ids = list(dict.fromkeys(bulk_action.pod_ids))
+    pods = await Pod.adb_get_many_with_pk(pod_ids, tenant=g.request_tenant_id, site=g.site_id)
+    # Every pod's ADMIN check from one object_permission query, admins by role don't need it.
+    is_admin = bool(g.roles) and ADMIN_ROLE in g.roles
+    levels = {} if is_admin else await ObjectPermission.adb_get_levels("pod", list(pods), g.username, tenant=g.request_tenant_id, site=g.site_id)
+
+    results = {}
+    pods_to_update = []
+    for pod_id in pod_ids:
+        pod = pods.get(pod_id)
+        if not pod:
+            results[pod_id] = {"pod_id": pod_id, "success": False, "message": f"Pod with identifier '{pod_id}' not found"}
+            continue
+        if not is_admin and not check_permission_level(g.username, ADMIN, levels.get(pod_id), "pod", pod_id):
+            results[pod_id] = {"pod_id": pod_id, "success": False, "message": "Permission denied. ADMIN required."}
+            continue
+
+        match action:
+            case "start":
+                # Only run start from status=STOPPED, same as start_pod.
+                if not pod.status in [STOPPED]:
+                    results[pod_id] = {"pod_id": pod_id, "success": False, "message": f"Pod must be in 'STOPPED' status to start, got '{pod.status}'."}
+                    continue
+                pod.status_requested = ON
+                pod.status = REQUESTED
+                pod.start_trace()
+                message = "Updated pod's status_requested to ON and requested pod."
+            case "stop":
+                pod.status_requested = OFF
+                message = "Updated pod's status_requested to OFF."
+            case "restart":
+                pod.status_requested = RESTART
+                message = "Updated pod's status_requested to RESTART."
+        pods_to_update.append(pod)
+        results[pod_id] = {"pod_id": pod_id, "success": True, "message": message}
+
+    if pods_to_update:
+        # Send start commands first, like start_pod. If the update then fails the spawner finds the pods
+        # not REQUESTED and ignores the commands.
+        if action == "start":
+            ch = CommandChannel.for_object(site_id=g.site_id, object_type="pod")
+            ch.put_cmds([{"object_id": pod.pod_id,
+                          "object_type": "pod",
+                          "tenant_id": pod.tenant_id,
+                          "site_id": pod.site_id,
+                          "trace_id": pod.trace_id} for pod in pods_to_update],
+                        priority=PRIORITY_START)
+            ch.close()
+            logger.debug(f"Command Channel - Added {len(pods_to_update)} msgs for bulk start.")
+
+        await Pod.adb_update_many(pods_to_update, f"'{g.username}' ran bulk {action}")
+
+    succeeded = len(pods_to_update)
+    return ok(result=list(results.values()), msg=f"Bulk {action} applied to {succeeded} of {len(pod_ids)} pods.")
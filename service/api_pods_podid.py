@@ -28,7 +28,7 @@ async def update_pod(pod_id, update_pod: UpdatePod):
     """
     logger.info(f"UPDATE /pods/{pod_id} - Top of update_pod.")
 
-    pod = Pod.db_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
+    pod = await Pod.adb_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
     
     pre_update_pod = pod.dict().copy()
 
@@ -42,7 +42,7 @@ async def update_pod(pod_id, update_pod: UpdatePod):
     # Only update if there's a change
     if pod != pre_update_pod:
         updated_fields = {key: post_update_pod[key] for key in post_update_pod if key in pre_update_pod and post_update_pod[key] != pre_update_pod[key]}
-        pod.db_update(f"'{g.username}' updated pod, updated_fields: {updated_fields}")
+        await pod.adb_update(f"'{g.username}' updated pod, updated_fields: {updated_fields}")
     else:
         return error(result=pod.display(), msg="Incoming data made no changes to pod. Is incoming data equal to current data?")
         
@@ -68,11 +68,11 @@ async def delete_pod(pod_id):
     logger.info(f"DELETE /pods/{pod_id} - Top of delete_pod.")
 
     # Needs to delete pod, service, db_pod, db_password
-    pod = Pod.db_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
-    password = Password.db_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
+    pod = await Pod.adb_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
+    password = await Password.adb_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
 
-    pod.db_delete()
-    password.db_delete()
+    await pod.adb_delete()
+    await password.adb_delete()
 
     return ok(result="", msg="Pod successfully deleted.")
 
@@ -93,6 +93,6 @@ async def get_pod(pod_id):
 
     # TODO .display(), search, permissions
 
-    pod = Pod.db_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
+    pod = await Pod.adb_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
 
     return ok(result=pod.display(), msg="Pod retrieved successfully.")
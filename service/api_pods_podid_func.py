@@ -1,8 +1,8 @@
 from fastapi import APIRouter
-from models_pods import Pod, Password, PodResponse, PodPermissionsResponse, PodCredentialsResponse, PodLogsResponse
+from models_pods import Pod, Password, PodResponse, PodPermissionsResponse, PodCredentialsResponse, PodLogsResponse, PodTimelineResponse
 from models_misc import SetPermission
 from channels import CommandChannel
-from codes import OFF, ON, RESTART, REQUESTED, STOPPED
+from codes import OFF, ON, RESTART, REQUESTED, STOPPED, PRIORITY_START
 from tapisservice.tapisfastapi.utils import g, ok
 
 from tapisservice.logs import get_logger
@@ -31,7 +31,7 @@ async def get_pod_credentials(pod_id):
     logger.info(f"GET /pods/{pod_id}/credentials - Top of get_pod_credentials.")
 
     # Do more update things.
-    password = Password.db_get_with_pk(pod_id, g.request_tenant_id, g.site_id)
+    password = await Password.adb_get_with_pk(pod_id, g.request_tenant_id, g.site_id)
     user_cred = {"user_username": password.user_username,
                  "user_password": password.user_password}
 
@@ -57,11 +57,35 @@ async def get_pod_logs(pod_id):
     """
     logger.info(f"GET /pods/{pod_id}/logs - Top of get_pod_logs.")
 
-    pod = Pod.db_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
+    pod = await Pod.adb_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
 
     return ok(result={"logs": pod.logs, "action_logs": pod.action_logs}, msg = "Pod logs retrieved successfully.")
 
 
+@router.get(
+    "/pods/{pod_id}/timeline",
+    tags=["Logs"],
+    summary="get_pod_timeline",
+    operation_id="get_pod_timeline",
+    response_model=PodTimelineResponse)
+async def get_pod_timeline(pod_id):
+    """
+    Get a pods lifecycle timeline.
+
+    Note:
+    - Each status transition has a timestamp, the component that made it (api, spawner, health), and trace ids.
+    - duration is the seconds the pod spent in that status, the current status counts up to now.
+    - Each time the pod is requested it starts a new trace. The last 50 transitions are kept.
+
+    Returns pod trace_id and timeline.
+    """
+    logger.info(f"GET /pods/{pod_id}/timeline - Top of get_pod_timeline.")
+
+    pod = await Pod.adb_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
+
+    return ok(result={"trace_id": pod.trace_id, "timeline": pod.get_timeline()}, msg = "Pod timeline retrieved successfully.")
+
+
 @router.get(
     "/pods/{pod_id}/permissions",
     tags=["Permissions"],
@@ -80,7 +104,7 @@ async def get_pod_permissions(pod_id):
     """
     logger.info(f"GET /pods/{pod_id}/permissions - Top of get_pod_permissions.")
 
-    pod = Pod.db_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
+    pod = await Pod.adb_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
 
     return ok(result={"permissions": pod.permissions}, msg = "Pod permissions retrieved successfully.")
 
@@ -102,7 +126,7 @@ async def set_pod_permission(pod_id, set_permission: SetPermission):
     inp_user = set_permission.user
     inp_level = set_permission.level
 
-    pod = Pod.db_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
+    pod = await Pod.adb_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
 
     # Get formatted perms
     curr_perms = pod.get_permissions()
@@ -121,7 +145,7 @@ async def set_pod_permission(pod_id, set_permission: SetPermission):
 
     # Update pod object and commit
     pod.permissions = perm_list
-    pod.db_update(f"'{g.username}' set permission for '{inp_user}' to {inp_level}")
+    await pod.adb_update(f"'{g.username}' set permission for '{inp_user}' to {inp_level}")
 
     return ok(result={"permissions": pod.permissions}, msg = "Pod permissions updated successfully.")
 
@@ -140,7 +164,7 @@ async def delete_pod_permission(pod_id, user):
     """
     logger.info(f"DELETE /pods/{pod_id}/permissions/{user} - Top of delete_pod_permission.")
 
-    pod = Pod.db_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
+    pod = await Pod.adb_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
 
     # Get formatted perms
     curr_perms = pod.get_permissions()
@@ -162,7 +186,7 @@ async def delete_pod_permission(pod_id, user):
     
     # Update pod object and commit
     pod.permissions = perm_list
-    pod.db_update(f"'{g.username}' deleted permission for '{user}'")
+    await pod.adb_update(f"'{g.username}' deleted permission for '{user}'")
 
     return ok(result={"permissions": pod.permissions}, msg = "Pod permission deleted successfully.")
 
@@ -184,9 +208,9 @@ async def stop_pod(pod_id):
     """
     logger.info(f"GET /pods/{pod_id}/stop - Top of stop_pod.")
 
-    pod = Pod.db_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
+    pod = await Pod.adb_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
     pod.status_requested = OFF
-    pod.db_update(f"'{g.username}' ran stop_pod, set to OFF")
+    await pod.adb_update(f"'{g.username}' ran stop_pod, set to OFF")
                   
     return ok(result=pod.display(), msg = "Updated pod's status_requested to OFF.")
 
@@ -208,7 +232,7 @@ async def start_pod(pod_id):
     """
     logger.info(f"GET /pods/{pod_id}/start - Top of start_pod.")
 
-    pod = Pod.db_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
+    pod = await Pod.adb_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
 
     # Only run start_pod from status=STOPPED
     if not pod.status in [STOPPED]:
@@ -216,17 +240,20 @@ async def start_pod(pod_id):
     else:
         pod.status_requested = ON
         pod.status = REQUESTED
+        pod.start_trace()
 
         # Send command to start new pod
-        ch = CommandChannel(name=pod.site_id)
+        ch = CommandChannel.for_object(site_id=pod.site_id, object_type="pod")
         ch.put_cmd(object_id=pod.pod_id,
                    object_type="pod",
                    tenant_id=pod.tenant_id,
-                   site_id=pod.site_id)
+                   site_id=pod.site_id,
+                   priority=PRIORITY_START,
+                   trace_id=pod.trace_id)
         ch.close()
         logger.debug(f"Command Channel - Added msg for pod_id: {pod.pod_id}.")
 
-        pod.db_update(f"'{g.username}' ran start_pod, set to ON and REQUESTED")
+        await pod.adb_update(f"'{g.username}' ran start_pod, set to ON and REQUESTED")
 
     return ok(result=pod.display(), msg = "Updated pod's status_requested to ON and requested pod.")
 
@@ -248,9 +275,9 @@ async def restart_pod(pod_id):
     """
     logger.info(f"GET /pods/{pod_id}/restart - Top of restart_pod.")
 
-    pod = Pod.db_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
+    pod = await Pod.adb_get_with_pk(pod_id, tenant=g.request_tenant_id, site=g.site_id)
     pod.status_requested = RESTART
 
-    pod.db_update(f"'{g.username}' ran restart_pod, set to RESTART")
+    await pod.adb_update(f"'{g.username}' ran restart_pod, set to RESTART")
                   
     return ok(result=pod.display(), msg = "Updated pod's status_requested to RESTART.")
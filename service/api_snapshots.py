@@ -1,7 +1,9 @@
-from fastapi import APIRouter
-from models_snapshots import Snapshot, NewSnapshot, SnapshotsResponse, SnapshotResponse
+from datetime import datetime
+from fastapi import APIRouter, Query
+from models_snapshots import Snapshot, NewSnapshot, SnapshotResponseModel, SnapshotsResponse, SnapshotResponse
 from channels import CommandChannel
 from tapisservice.tapisfastapi.utils import g, ok
+from utils import list_where_params, list_columns, display_rows, list_response
 from codes import AVAILABLE, CREATING
 from volume_utils import files_copy
 from tapisservice.config import conf
@@ -19,24 +21,48 @@ router = APIRouter()
     tags=["Snapshots"],
     summary="get_snapshots",
     operation_id="get_snapshots",
-    response_model=SnapshotsResponse)
-async def get_snapshots():
+    response_model=SnapshotsResponse,
+    response_model_exclude_unset=True)
+async def get_snapshots(status: str | None = None,
+                        created_after: datetime | None = None,
+                        created_before: datetime | None = None,
+                        sort: str | None = None,
+                        fields: str | None = None,
+                        limit: int | None = Query(None, ge=1, le=1000),
+                        cursor: str | None = None):
     """
     Get all snapshots in your respective tenant and site that you have READ or higher access to.
 
+    Query parameters, all applied in the database:
+    - status: exact match, comma separated to match any.
+    - created_after, created_before: creation_ts window (UTC).
+    - sort: field to sort by, prefix with '-' for descending. Defaults to snapshot_id.
+    - fields: comma separated fields to return, required fields like snapshot_id are always returned.
+    - limit and cursor: keyset pagination. With a limit, metadata.next_cursor is the cursor for the next page, null on the last page.
+
     Returns a list of snapshots.
     """
     logger.info("GET /pod/snapshots - Top of get_snapshots.")
 
-    # TODO search
-    snapshots =  Snapshot.db_get_all_with_permission(user=g.username, level='READ', tenant=g.request_tenant_id, site=g.site_id)
-
-    snapshots_to_show = []
-    for snapshot in snapshots:
-        snapshots_to_show.append(snapshot.display())
+    where_params = list_where_params(status=status,
+                                     created_after=created_after,
+                                     created_before=created_before)
+    columns = list_columns(fields, Snapshot, SnapshotResponseModel)
+    snapshots, next_cursor = await Snapshot.adb_list_with_permission(user=g.username,
+                                                                     level='READ',
+                                                                     tenant=g.request_tenant_id,
+                                                                     site=g.site_id,
+                                                                     where_params=where_params,
+                                                                     sort=sort,
+                                                                     limit=limit,
+                                                                     cursor=cursor,
+                                                                     columns=columns)
+
+    # Rows only hold the projected columns, no full Snapshot objects are built for listings.
+    snapshots_to_show = display_rows(snapshots, columns)
 
     logger.info("Snapshots retrieved.")
-    return ok(result=snapshots_to_show, msg="Snapshots retrieved successfully.")
+    return list_response(result=snapshots_to_show, msg="Snapshots retrieved successfully.", metadata={"count": len(snapshots_to_show), "limit": limit, "next_cursor": next_cursor})
 
 
 @router.post(
@@ -60,11 +86,11 @@ async def create_snapshot(new_snapshot: NewSnapshot):
     snapshot = Snapshot(**new_snapshot.dict())
 
     # Create snapshot database entry
-    snapshot.db_create()
+    await snapshot.adb_create()
     logger.debug(f"New snapshot saved in db. snapshot_id: {snapshot.snapshot_id}; tenant: {g.request_tenant_id}.")
 
     snapshot.status = CREATING
-    snapshot.db_update()
+    await snapshot.adb_update()
     logger.debug(f"API has updated snapshot status to CREATING")
 
     # Move requested files from original folder to snapshot folder
@@ -74,7 +100,7 @@ async def create_snapshot(new_snapshot: NewSnapshot):
 
     # If we get to this point we can update snapshot status
     snapshot.status = AVAILABLE
-    snapshot.db_update()
+    await snapshot.adb_update()
     logger.debug(f"API has updated snapshot status to AVAILABLE")
 
     return ok(result=snapshot.display(), msg="Snapshot created successfully.")
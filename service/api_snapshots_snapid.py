@@ -30,9 +30,9 @@ async def update_snapshot(snapshot_id, update_snapshot: UpdateSnapshot):
     """
     logger.info(f"UPDATE /pods/snapshots/{snapshot_id} - Top of update_snapshot.")
 
-    snapshot = Snapshot.db_get_with_pk(snapshot_id, tenant=g.request_tenant_id, site=g.site_id)
+    snapshot = await Snapshot.adb_get_with_pk(snapshot_id, tenant=g.request_tenant_id, site=g.site_id)
 
-    pre_update_snapshot = snapshot.copy()
+    pre_update_snapshot = Snapshot.from_trusted(**snapshot.dict())
 
     # Snapshot existence is already checked above. Now we validate update and update with values that are set.
     input_data = update_snapshot.dict(exclude_unset=True)
@@ -41,7 +41,7 @@ async def update_snapshot(snapshot_id, update_snapshot: UpdateSnapshot):
 
     # Only update if there's a change
     if snapshot != pre_update_snapshot:
-        snapshot.db_update()
+        await snapshot.adb_update()
     else:
         return error(result=snapshot.display(), msg="Incoming data made no changes to snapshot. Is incoming data equal to current data?")
 
@@ -63,13 +63,13 @@ async def delete_snapshot(snapshot_id):
     logger.info(f"DELETE /pods/snapshots/{snapshot_id} - Top of delete_snapshot.")
 
     # Needs to delete snapshot, nfs folder
-    snapshot = Snapshot.db_get_with_pk(snapshot_id, tenant=g.request_tenant_id, site=g.site_id)
+    snapshot = await Snapshot.adb_get_with_pk(snapshot_id, tenant=g.request_tenant_id, site=g.site_id)
 
     # Delete folder
     res = files_delete(
         path = f"/snapshots/{snapshot.snapshot_id}")
 
-    snapshot.db_delete()
+    await snapshot.adb_delete()
 
     return ok(result="", msg="Snapshot successfully deleted.")
 
@@ -90,6 +90,6 @@ async def get_snapshot(snapshot_id):
 
     # TODO search
 
-    snapshot = Snapshot.db_get_with_pk(snapshot_id, tenant=g.request_tenant_id, site=g.site_id)
+    snapshot = await Snapshot.adb_get_with_pk(snapshot_id, tenant=g.request_tenant_id, site=g.site_id)
 
     return ok(result=snapshot.display(), msg="Snapshot retrieved successfully.")
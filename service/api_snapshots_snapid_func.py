@@ -25,7 +25,7 @@ async def list_snapshot_files(snapshot_id):
     """
     logger.info(f"GET /pods/snapshots/{snapshot_id}/list - Top of list_snapshot_files.")
 
-    snapshot = Snapshot.db_get_with_pk(snapshot_id, tenant=g.request_tenant_id, site=g.site_id)
+    snapshot = await Snapshot.adb_get_with_pk(snapshot_id, tenant=g.request_tenant_id, site=g.site_id)
 
     list_of_files = files_listfiles(
         path = f"/snapshots/{snapshot.snapshot_id}/")
@@ -57,7 +57,7 @@ async def get_snapshot_permissions(snapshot_id):
     """
     logger.info(f"GET /pods/snapshots/{snapshot_id}/permissions - Top of get_snapshot_permissions.")
 
-    snapshot = Snapshot.db_get_with_pk(snapshot_id, tenant=g.request_tenant_id, site=g.site_id)
+    snapshot = await Snapshot.adb_get_with_pk(snapshot_id, tenant=g.request_tenant_id, site=g.site_id)
 
     return ok(result={"permissions": snapshot.permissions}, msg = "Snapshot permissions retrieved successfully.")
 
@@ -79,7 +79,7 @@ async def set_snapshot_permission(snapshot_id, set_permission: SetPermission):
     inp_user = set_permission.user
     inp_level = set_permission.level
 
-    snapshot = Snapshot.db_get_with_pk(snapshot_id, tenant=g.request_tenant_id, site=g.site_id)
+    snapshot = await Snapshot.adb_get_with_pk(snapshot_id, tenant=g.request_tenant_id, site=g.site_id)
 
     # Get formatted perms
     curr_perms = snapshot.get_permissions()
@@ -98,7 +98,7 @@ async def set_snapshot_permission(snapshot_id, set_permission: SetPermission):
 
     # Update snapshot object and commit
     snapshot.permissions = perm_list
-    snapshot.db_update()
+    await snapshot.adb_update()
 
     return ok(result={"permissions": snapshot.permissions}, msg = "Snapshot permissions updated successfully.")
 
@@ -117,7 +117,7 @@ async def delete_snapshot_permission(snapshot_id, user):
     """
     logger.info(f"DELETE /pods/snapshots/{snapshot_id}/permissions/{user} - Top of delete_snapshot_permission.")
 
-    snapshot = Snapshot.db_get_with_pk(snapshot_id, tenant=g.request_tenant_id, site=g.site_id)
+    snapshot = await Snapshot.adb_get_with_pk(snapshot_id, tenant=g.request_tenant_id, site=g.site_id)
 
     # Get formatted perms
     curr_perms = snapshot.get_permissions()
@@ -139,6 +139,6 @@ async def delete_snapshot_permission(snapshot_id, user):
     
     # Update snapshot object and commit
     snapshot.permissions = perm_list
-    snapshot.db_update()
+    await snapshot.adb_update()
 
     return ok(result={"permissions": snapshot.permissions}, msg = "Snapshot permission deleted successfully.")
@@ -1,8 +1,10 @@
-from fastapi import APIRouter
+from datetime import datetime
+from fastapi import APIRouter, Query
 from models_pods import Pod, NewPod, Password, PodsResponse, PodResponse
-from models_volumes import Volume, NewVolume, VolumesResponse, VolumeResponse
+from models_volumes import Volume, NewVolume, VolumeResponseModel, VolumesResponse, VolumeResponse
 from channels import CommandChannel
 from tapisservice.tapisfastapi.utils import g, ok
+from utils import list_where_params, list_columns, display_rows, list_response
 from codes import AVAILABLE, CREATING
 from volume_utils import files_mkdir
 from tapisservice.config import conf
@@ -20,24 +22,48 @@ router = APIRouter()
     tags=["Volumes"],
     summary="get_volumes",
     operation_id="get_volumes",
-    response_model=VolumesResponse)
-async def get_volumes():
+    response_model=VolumesResponse,
+    response_model_exclude_unset=True)
+async def get_volumes(status: str | None = None,
+                      created_after: datetime | None = None,
+                      created_before: datetime | None = None,
+                      sort: str | None = None,
+                      fields: str | None = None,
+                      limit: int | None = Query(None, ge=1, le=1000),
+                      cursor: str | None = None):
     """
     Get all volumes in your respective tenant and site that you have READ or higher access to.
 
+    Query parameters, all applied in the database:
+    - status: exact match, comma separated to match any.
+    - created_after, created_before: creation_ts window (UTC).
+    - sort: field to sort by, prefix with '-' for descending. Defaults to volume_id.
+    - fields: comma separated fields to return, required fields like volume_id are always returned.
+    - limit and cursor: keyset pagination. With a limit, metadata.next_cursor is the cursor for the next page, null on the last page.
+
     Returns a list of volumes.
     """
     logger.info("GET /pod/volumes - Top of get_volumes.")
 
-    # TODO search
-    volumes =  Volume.db_get_all_with_permission(user=g.username, level='READ', tenant=g.request_tenant_id, site=g.site_id)
-
-    volumes_to_show = []
-    for volume in volumes:
-        volumes_to_show.append(volume.display())
+    where_params = list_where_params(status=status,
+                                     created_after=created_after,
+                                     created_before=created_before)
+    columns = list_columns(fields, Volume, VolumeResponseModel)
+    volumes, next_cursor = await Volume.adb_list_with_permission(user=g.username,
+                                                                 level='READ',
+                                                                 tenant=g.request_tenant_id,
+                                                                 site=g.site_id,
+                                                                 where_params=where_params,
+                                                                 sort=sort,
+                                                                 limit=limit,
+                                                                 cursor=cursor,
+                                                                 columns=columns)
+
+    # Rows only hold the projected columns, no full Volume objects are built for listings.
+    volumes_to_show = display_rows(volumes, columns)
 
     logger.info("Volumes retrieved.")
-    return ok(result=volumes_to_show, msg="Volumes retrieved successfully.")
+    return list_response(result=volumes_to_show, msg="Volumes retrieved successfully.", metadata={"count": len(volumes_to_show), "limit": limit, "next_cursor": next_cursor})
 
 
 @router.post(
@@ -62,11 +88,11 @@ async def create_volume(new_volume: NewVolume):
     volume = Volume(**new_volume.dict())
 
     # Create volume database entry
-    volume.db_create()
+    await volume.adb_create()
     logger.debug(f"New volume saved in db. volume_id: {volume.volume_id}; tenant: {g.request_tenant_id}.")
 
     volume.status = CREATING
-    volume.db_update()
+    await volume.adb_update()
     logger.debug(f"API has updated volume status to CREATING")
 
     # Create folder
@@ -74,7 +100,7 @@ async def create_volume(new_volume: NewVolume):
 
     # If we get to this point we can update pod status
     volume.status = AVAILABLE
-    volume.db_update()
+    await volume.adb_update()
     logger.debug(f"API has updated volume status to AVAILABLE")
 
     return ok(result=volume.display(), msg="Volume created successfully.")
@@ -30,9 +30,9 @@ async def update_volume(volume_id, update_volume: UpdateVolume):
     """
     logger.info(f"UPDATE /pods/volumes/{volume_id} - Top of update_volume.")
 
-    volume = Volume.db_get_with_pk(volume_id, tenant=g.request_tenant_id, site=g.site_id)
+    volume = await Volume.adb_get_with_pk(volume_id, tenant=g.request_tenant_id, site=g.site_id)
 
-    pre_update_volume = volume.copy()
+    pre_update_volume = Volume.from_trusted(**volume.dict())
 
     # Volume existence is already checked above. Now we validate update and update with values that are set.
     input_data = update_volume.dict(exclude_unset=True)
@@ -41,7 +41,7 @@ async def update_volume(volume_id, update_volume: UpdateVolume):
 
     # Only update if there's a change
     if volume != pre_update_volume:
-        volume.db_update()
+        await volume.adb_update()
     else:
         return error(result=volume.display(), msg="Incoming data made no changes to volume. Is incoming data equal to current data?")
 
@@ -63,13 +63,13 @@ async def delete_volume(volume_id):
     logger.info(f"DELETE /pods/volumes/{volume_id} - Top of delete_volume.")
 
     # Needs to delete volume, nfs folder
-    volume = Volume.db_get_with_pk(volume_id, tenant=g.request_tenant_id, site=g.site_id)
+    volume = await Volume.adb_get_with_pk(volume_id, tenant=g.request_tenant_id, site=g.site_id)
 
     # Delete folder
     res = files_delete(
         path = f"/volumes/{volume.volume_id}")
 
-    volume.db_delete()
+    await volume.adb_delete()
 
     return ok(result="", msg="Volume successfully deleted.")
 
@@ -90,6 +90,6 @@ async def get_volume(volume_id):
 
     # TODO search
 
-    volume = Volume.db_get_with_pk(volume_id, tenant=g.request_tenant_id, site=g.site_id)
+    volume = await Volume.adb_get_with_pk(volume_id, tenant=g.request_tenant_id, site=g.site_id)
 
     return ok(result=volume.display(), msg="Volume retrieved successfully.")
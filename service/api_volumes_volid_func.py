@@ -25,7 +25,7 @@ async def list_volume_files(volume_id):
     """
     logger.info(f"GET /pods/volumes/{volume_id}/list - Top of list_volume_files.")
 
-    volume = Volume.db_get_with_pk(volume_id, tenant=g.request_tenant_id, site=g.site_id)
+    volume = await Volume.adb_get_with_pk(volume_id, tenant=g.request_tenant_id, site=g.site_id)
 
     list_of_files = files_listfiles(
         path = f"/volumes/{volume.volume_id}")
@@ -51,7 +51,7 @@ async def upload_to_volume(volume_id, path, file: UploadFile):
     """
     logger.info(f"POST /pods/volumes/{volume_id}/upload/{path} - Top of upload_to_volume.")
 
-    volume = Volume.db_get_with_pk(volume_id, tenant=g.request_tenant_id, site=g.site_id)
+    volume = await Volume.adb_get_with_pk(volume_id, tenant=g.request_tenant_id, site=g.site_id)
 
     insert_res = files_insert(
         file = file.file,
@@ -78,7 +78,7 @@ async def get_volume_permissions(volume_id):
     """
     logger.info(f"GET /pods/volumes/{volume_id}/permissions - Top of get_volume_permissions.")
 
-    volume = Volume.db_get_with_pk(volume_id, tenant=g.request_tenant_id, site=g.site_id)
+    volume = await Volume.adb_get_with_pk(volume_id, tenant=g.request_tenant_id, site=g.site_id)
 
     return ok(result={"permissions": volume.permissions}, msg = "Volume permissions retrieved successfully.")
 
@@ -100,7 +100,7 @@ async def set_volume_permission(volume_id, set_permission: SetPermission):
     inp_user = set_permission.user
     inp_level = set_permission.level
 
-    volume = Volume.db_get_with_pk(volume_id, tenant=g.request_tenant_id, site=g.site_id)
+    volume = await Volume.adb_get_with_pk(volume_id, tenant=g.request_tenant_id, site=g.site_id)
 
     # Get formatted perms
     curr_perms = volume.get_permissions()
@@ -119,7 +119,7 @@ async def set_volume_permission(volume_id, set_permission: SetPermission):
 
     # Update volume object and commit
     volume.permissions = perm_list
-    volume.db_update()
+    await volume.adb_update()
 
     return ok(result={"permissions": volume.permissions}, msg = "Volume permissions updated successfully.")
 
@@ -138,7 +138,7 @@ async def delete_volume_permission(volume_id, user):
     """
     logger.info(f"DELETE /pods/volumes/{volume_id}/permissions/{user} - Top of delete_volume_permission.")
 
-    volume = Volume.db_get_with_pk(volume_id, tenant=g.request_tenant_id, site=g.site_id)
+    volume = await Volume.adb_get_with_pk(volume_id, tenant=g.request_tenant_id, site=g.site_id)
 
     # Get formatted perms
     curr_perms = volume.get_permissions()
@@ -160,6 +160,6 @@ async def delete_volume_permission(volume_id, user):
     
     # Update volume object and commit
     volume.permissions = perm_list
-    volume.db_update()
+    await volume.adb_update()
 
     return ok(result={"permissions": volume.permissions}, msg = "Volume permission deleted successfully.")
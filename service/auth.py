@@ -2,7 +2,10 @@
 import base64
 import os
 import re
+import threading
+import time
 import timeit
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import jwt
 import requests
@@ -19,33 +22,124 @@ from models_pods import Pod
 from models_volumes import Volume
 from models_snapshots import Snapshot
 from utils import check_permissions
+from metrics import metrics
 
 TOKEN_RE = re.compile('Bearer (.+)')
 
 WORLD_USER = 'ABACO_WORLD'
 
 
-def get_user_sk_roles():
+def fetch_sk_roles(tenant, user):
     """
-    Using values from the g object. Gets roles for a user with g.username and g.request_tenant_id
+    Gets roles for user in tenant from SK. Use sk_role_cache.get() instead, this is its loader.
     """
-    logger.debug(f"Getting SK roles on tenant {g.request_tenant_id} and user {g.username}")
+    logger.debug(f"Getting SK roles on tenant {tenant} and user {user}")
     start_timer = timeit.default_timer()
     try:
-        roles_obj = t.sk.getUserRoles(tenant=g.request_tenant_id, user=g.username, _tapis_set_x_headers_from_service=True)
-    except Exception as e:
+        roles_obj = t.sk.getUserRoles(tenant=tenant, user=user, _tapis_set_x_headers_from_service=True)
+    finally:
         end_timer = timeit.default_timer()
+        metrics.histogram("sk_get_user_roles_seconds").observe(end_timer - start_timer)
         total = (end_timer - start_timer) * 1000
         if total > 4000:
-            logger.critical(f"t.sk.getUserRoles took {total} to run for user {g.username}, tenant: {g.request_tenant_id}")
-        raise e
-    end_timer = timeit.default_timer()
-    total = (end_timer - start_timer) * 1000
-    if total > 4000:
-        logger.critical(f"t.sk.getUserRoles took {total} to run for user {g.username}, tenant: {g.request_tenant_id}")
+            logger.critical(f"t.sk.getUserRoles took {total} to run for user {user}, tenant: {tenant}")
     roles_list = roles_obj.names
     logger.debug(f"Roles received: {roles_list}")
-    g.roles = roles_list
+    return roles_list
+
+
+class SKRoleCache(object):
+    """
+    Per-process cache of SK roles, {(tenant, user): roles}, so SK latency isn't part of every request.
+    - Roles are fresh for conf.sk_roles_cache_ttl seconds.
+    - For conf.sk_roles_cache_stale seconds after that the cached roles are still returned while
+      they're refreshed in the background. Roles with codes.ADMIN_ROLE only get
+      conf.sk_roles_cache_admin_stale seconds, so a revoked admin role stops working soon after the ttl.
+    - Failed lookups are cached and re-raised for conf.sk_roles_cache_negative_ttl seconds.
+    - Concurrent misses for the same user share one SK call.
+    Lookups are counted in `sk_roles_cache{result}`, SK latency in `sk_get_user_roles_seconds`.
+    """
+    def __init__(self, fetch):
+        self._fetch = fetch
+        self._lock = threading.Lock()
+        self._entries = {} # {(tenant, user): (fetched_at, roles, error)}
+        self._in_flight = {} # {(tenant, user): Future}
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="sk-roles-refresh")
+
+    def invalidate(self, tenant=None, user=None):
+        with self._lock:
+            for key in list(self._entries):
+                if tenant in (None, key[0]) and user in (None, key[1]):
+                    self._entries.pop(key)
+
+    def _load(self, key):
+        """Calls SK for key, or waits on the call already in flight for it."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+        if not owner:
+            metrics.counter("sk_roles_cache", result="shared").inc()
+            return future.result()
+
+        roles, error = None, None
+        try:
+            roles = self._fetch(*key)
+        except Exception as e:
+            error = e
+        with self._lock:
+            self._entries[key] = (time.monotonic(), roles, error)
+            self._in_flight.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+            raise error
+        future.set_result(roles)
+        return roles
+
+    def _refresh(self, key):
+        try:
+            self._load(key)
+        except Exception as e:
+            logger.warning(f"Background SK roles refresh failed for tenant: {key[0]}, user: {key[1]}. e: {repr(e)}")
+
+    @staticmethod
+    def _stale_seconds(roles):
+        """Stale window for successful lookups, short when the roles grant admin."""
+        if codes.ADMIN_ROLE in roles:
+            return conf.get('sk_roles_cache_admin_stale', 5)
+        return conf.get('sk_roles_cache_stale', 300)
+
+    def get(self, tenant, user):
+        key = (tenant, user)
+        entry = self._entries.get(key)
+        if entry:
+            fetched_at, roles, error = entry
+            age = time.monotonic() - fetched_at
+            if error is not None:
+                if age < conf.get('sk_roles_cache_negative_ttl', 5):
+                    metrics.counter("sk_roles_cache", result="negative").inc()
+                    raise error
+            elif age < conf.get('sk_roles_cache_ttl', 30):
+                metrics.counter("sk_roles_cache", result="hit").inc()
+                return roles
+            elif age < conf.get('sk_roles_cache_ttl', 30) + self._stale_seconds(roles):
+                metrics.counter("sk_roles_cache", result="stale").inc()
+                if key not in self._in_flight:
+                    self._refresher.submit(self._refresh, key)
+                return roles
+        metrics.counter("sk_roles_cache", result="miss").inc()
+        return self._load(key)
+
+
+sk_role_cache = SKRoleCache(fetch_sk_roles)
+
+
+def get_user_sk_roles():
+    """
+    Using values from the g object. Gets roles for a user with g.username and g.request_tenant_id
+    """
+    g.roles = sk_role_cache.get(g.request_tenant_id, g.username)
 
 
 def get_user_site_id():
@@ -171,6 +265,7 @@ def authorization(request):
         logger.debug(f"Spec, Docs, Traefik conf doesn't need auth. Skipping. url.path: {request.url.path}")
         return
     elif (request.url.path == '/pods' or 
+          (request.url.path == '/pods/bulk' and request.method == 'POST') or
           request.url.path == '/pods/volumes' or
           request.url.path == '/pods/snapshots' or
           request.url.path == '/docs'):
@@ -210,6 +305,10 @@ def authorization(request):
 
     #### Do checks for pods read/user/admin roles. Add in "required_roles" attr when neccessary in api.
     # there are special rules on the pods root collection:
+    if '/pods/bulk' == request.url.path and request.method == 'POST':
+        # Bulk actions check ADMIN on each pod themselves, giving per-pod results instead of failing the whole request.
+        logger.debug("Bulk pod action, permissions are checked per pod in the endpoint.")
+        return True
     if '/pods' == request.url.path or '/pods/volumes' == request.url.path or '/pods/snapshots' == request.url.path:
         logger.debug("Checking permissions on root collection.")
         # Only ADMIN can set privileged and some attrs. Check for that here.
@@ -246,6 +345,7 @@ def check_pod_permission(pod, request):
             if request.method == 'GET':
 
 # GET logs requires READ
+# GET timeline requires READ
 # GET pod require READ
 
 # GET permissions requires USER
@@ -272,6 +372,11 @@ def check_pod_permission(pod, request):
             if request.method == 'GET':
                 # GET logs requires READ
                 has_pem = check_permissions(user=g.username, object=pod, object_type="pod", level=codes.READ, roles=g.roles)
+        # Check for func = timeline
+        if path_split[3] == "timeline":
+            if request.method == 'GET':
+                # GET timeline requires READ
+                has_pem = check_permissions(user=g.username, object=pod, object_type="pod", level=codes.READ, roles=g.roles)
         # Check for func = credentials
         if path_split[3] == "credentials":
             if request.method == 'GET':
@@ -1,33 +1,208 @@
 
 
+import json
+import threading
+import time
+
+import cloudpickle
 from tapisservice.config import conf
-from stores import get_site_rabbitmq_uri
-from queues import BinaryTaskQueue
+from tapisservice.logs import get_logger
+from queues import TaskQueue, ChannelClosedException
+from stores import SITE_TENANT_DICT
+from codes import MAX_COMMAND_PRIORITY, PRIORITY_CREATE
+from tracing import make_traceparent
 from tapisservice.tapisfastapi.utils import g
+logger = get_logger(__name__)
+
+# Command messages are compact JSON with short keys and a schema version, "v".
+# Bump COMMAND_SCHEMA_VERSION when the fields change and keep decoding older versions until drained.
+COMMAND_SCHEMA_VERSION = 1
+COMMAND_CONTENT_TYPE = "application/vnd.tapis.pods.command+json"
+# message key -> compact key. object_id, object_type, tenant_id, and site_id are required.
+COMMAND_FIELDS = {'object_id': 'o',
+                  'object_type': 'ot',
+                  'tenant_id': 't',
+                  'site_id': 's',
+                  'priority': 'p',
+                  'enqueue_ts': 'ts',
+                  'traceparent': 'tp',
+                  'attempt': 'a',
+                  'error': 'e'}
+REQUIRED_COMMAND_FIELDS = ['object_id', 'object_type', 'tenant_id', 'site_id']
+
+
+class CommandDecodeError(Exception):
+    pass
+
+
+def encode_cmd(cmd: dict) -> bytes:
+    """Encode a command dict to the compact versioned JSON format."""
+    body = {'v': COMMAND_SCHEMA_VERSION}
+    for key, short_key in COMMAND_FIELDS.items():
+        if cmd.get(key) is not None:
+            body[short_key] = cmd[key]
+    return json.dumps(body, separators=(',', ':')).encode('utf-8')
+
+
+def decode_cmd(body: bytes) -> dict:
+    """Decode a compact versioned JSON command back to the full command dict."""
+    try:
+        data = json.loads(body)
+    except ValueError as e:
+        raise CommandDecodeError(f"Command is not valid JSON. e: {e}")
+    if not isinstance(data, dict) or not data.get('v') == COMMAND_SCHEMA_VERSION:
+        raise CommandDecodeError(f"Unsupported command schema version: {data.get('v') if isinstance(data, dict) else None}")
+    cmd = {key: data[short_key] for key, short_key in COMMAND_FIELDS.items() if short_key in data}
+    missing = [key for key in REQUIRED_COMMAND_FIELDS if not isinstance(cmd.get(key), str)]
+    if missing:
+        raise CommandDecodeError(f"Command missing required fields: {missing}")
+    return cmd
 
 def site():
     site_id = g.site_id or conf.get('site_id')
     return site_id
 
-RABBIT_URI = get_site_rabbitmq_uri(site())
 
-class CommandChannel(BinaryTaskQueue):
-    """Work with commands on the command channel."""
+def get_host_queues():
+    """
+    Command channel queues this deployment knows about, from conf.spawner_host_queues.
+    Queue names are `<site_id>` for a site's default queue or `<site_id>-<role>` for queues
+    dedicated to part of the work (see conf.spawner_queue_routes). Defaults to [conf.site_id].
+    """
+    return conf.get('spawner_host_queues') or [conf.get('site_id')]
+
+
+def queue_site(name: str):
+    """
+    The site a command channel queue belongs to, `tacc-volumes` -> `tacc`. Site ids can have hyphens,
+    so only a known role (a value of conf.spawner_queue_routes) is taken off the end.
+    """
+    if name in SITE_TENANT_DICT:
+        return name
+    for role in (conf.get('spawner_queue_routes') or {}).values():
+        if name.endswith(f"-{role}"):
+            return name[:-len(role) - 1]
+    return name
+
+
+def get_queue_name(site_id: str, object_type: str = "pod"):
+    """
+    Route a command to a queue. If conf.spawner_queue_routes maps object_type to a role and
+    `<site_id>-<role>` is a configured queue, use it. Otherwise use the site's default queue.
+    """
+    role = (conf.get('spawner_queue_routes') or {}).get(object_type)
+    if role and f"{site_id}-{role}" in get_host_queues():
+        return f"{site_id}-{role}"
+    return site_id
+
+
+class CommandChannel(TaskQueue):
+    """
+    Work with commands on the command channel.
+
+    Commands are published as compact versioned JSON (encode_cmd). Commands from before that were
+    cloudpickled, set conf.command_encoding to "pickle" to keep publishing them while old spawners
+    are still running. Pickled commands are only decoded while conf.command_accept_pickle is true,
+    turn it off once queues have drained since unpickling runs whatever the broker hands us.
+    """
 
     def __init__(self, name: str = "tacc"):
-        self.uri = RABBIT_URI
-        queues_list = ["tacc"]
-        #queues_list = conf.get('spawner_host_queues')
+        queues_list = get_host_queues()
         if name not in queues_list:
-            raise Exception('Invalid Queue name.')
+            raise Exception(f'Invalid Queue name: {name}. Must be in spawner_host_queues: {queues_list}.')
+
+        # Queues live in their site's vhost, set up by stores.rabbitmq_init.
+        super().__init__(name=f'command_channel_{name}', max_priority=MAX_COMMAND_PRIORITY, site_id=queue_site(name))
+
+    # Delay and dead-letter queues already declared by this process, by backend.
+    _declared = set()
+    _declared_lock = threading.Lock()
+
+    @staticmethod
+    def _pre_process(msg):
+        if conf.get('command_encoding', 'json') == 'pickle':
+            return cloudpickle.dumps(msg)
+        return encode_cmd(msg)
+
+    @staticmethod
+    def _post_process(msg):
+        if msg.properties.get('content_type') == COMMAND_CONTENT_TYPE:
+            return decode_cmd(msg.body)
+        if conf.get('command_accept_pickle', True):
+            return cloudpickle.loads(msg.body)
+        raise CommandDecodeError(f"Got command without content_type {COMMAND_CONTENT_TYPE} and command_accept_pickle is off.")
+
+    def get_one(self):
+        """Blocking method to get a single command. Commands that can't be decoded are logged and dropped."""
+        while True:
+            if self._closed:
+                raise ChannelClosedException()
+            msg = self.backend.get(self.name)
+            try:
+                return self._post_process(msg), msg
+            except Exception as e:
+                logger.error(f"Dropping command on {self.name} that could not be decoded. e: {e}")
+                msg.ack()
+
+    def _declare_once(self, name, arguments=None):
+        with self._declared_lock:
+            key = (type(self.backend).__name__, name)
+            if key in self._declared:
+                return
+            self.declare(name, arguments)
+            self._declared.add(key)
+
+    def put_retry(self, cmd: dict, delay: int):
+        """
+        Put a command on this channel's delay queue for `delay` seconds. Each delay has its own queue
+        with a message ttl that dead-letters back onto this channel, so nothing waits behind a longer delay.
+        enqueue_ts becomes the time the command is back on this channel, the backoff isn't queue wait.
+        """
+        name = f"{self.name}_retry_{delay}s"
+        self._declare_once(name, {'x-message-ttl': delay * 1000,
+                                  'x-dead-letter-exchange': '',
+                                  'x-dead-letter-routing-key': self.name})
+        cmd = {**cmd, 'enqueue_ts': time.time() + delay}
+        self.put(cmd, priority=cmd.get('priority'), content_type=self._content_type(), routing_key=name)
+
+    def put_dead(self, cmd: dict, error: str):
+        """Put a command that failed permanently on this channel's dead-letter queue, with its error."""
+        name = f"{self.name}_dead"
+        self._declare_once(name)
+        self.put({**cmd, 'error': error}, content_type=self._content_type(), routing_key=name)
+
+    @classmethod
+    def for_object(cls, site_id: str, object_type: str = "pod"):
+        """Get the command channel that commands for object_type in site_id are routed to."""
+        return cls(name=get_queue_name(site_id, object_type))
+
+    def put_cmd(self, object_id, object_type, tenant_id, site_id, priority=PRIORITY_CREATE, trace_id=None):
+        """Put a new command on the command channel.
+        priority: codes.PRIORITY_X, restarts and interactive starts should go ahead of creates.
+        trace_id: the object's lifecycle trace (Pod.trace_id), sent as a W3C traceparent.
+        """
+        msg = self._build_cmd(object_id, object_type, tenant_id, site_id, priority, trace_id)
+        self.put(msg, priority=priority, content_type=self._content_type())
 
-        super().__init__(name=f'command_channel_{name}')
+    def put_cmds(self, cmds: list, priority=PRIORITY_CREATE):
+        """Put many commands on the command channel in one batched publish.
+        cmds: list of dicts with put_cmd's object_id, object_type, tenant_id, site_id, and optionally trace_id.
+        """
+        msgs = [self._build_cmd(priority=priority, **cmd) for cmd in cmds]
+        self.put_many(msgs, priority=priority, content_type=self._content_type())
 
-    def put_cmd(self, object_id, object_type, tenant_id, site_id):
-        """Put a new command on the command channel."""
+    @staticmethod
+    def _build_cmd(object_id, object_type, tenant_id, site_id, priority=PRIORITY_CREATE, trace_id=None):
         msg = {'object_id': object_id,
                'object_type': object_type,
                'tenant_id': tenant_id,
-               'site_id': site_id}
+               'site_id': site_id,
+               'priority': priority,
+               'enqueue_ts': time.time()}
+        if trace_id:
+            msg['traceparent'] = make_traceparent(trace_id)
+        return msg
 
-        self.put(msg)
+    @staticmethod
+    def _content_type():
+        return None if conf.get('command_encoding', 'json') == 'pickle' else COMMAND_CONTENT_TYPE
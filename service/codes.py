@@ -14,6 +14,13 @@ DELETING = 'DELETING'
 STOPPED = 'STOPPED'
 ERROR = 'ERROR'
 
+# Command channel priorities. Higher priority commands are consumed first, so restarts and
+# interactive starts don't wait behind a tenant's bulk creates.
+MAX_COMMAND_PRIORITY = 10
+PRIORITY_RESTART = 9
+PRIORITY_START = 6
+PRIORITY_CREATE = 3
+
 class PermissionLevel(object):
 
     def __init__(self, name, level=None):
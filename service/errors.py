@@ -7,3 +7,6 @@ class ResourceError(BaseTapisError):
 
 class PermissionsException(BaseTapisError):
     pass
+
+class QueryParameterError(BaseTapisError):
+    pass
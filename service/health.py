@@ -39,7 +39,8 @@ from channels import CommandChannel
 from kubernetes import client, config
 from kubernetes_utils import get_current_k8_services, get_current_k8_pods, rm_container, rm_pvc, \
      get_current_k8_pods, rm_service, KubernetesError, get_k8_logs, list_all_containers, run_k8_exec
-from codes import AVAILABLE, DELETING, STOPPED, ERROR, REQUESTED, COMPLETE, RESTART, ON, OFF
+from codes import AVAILABLE, DELETING, STOPPED, ERROR, REQUESTED, COMPLETE, RESTART, ON, OFF, \
+    PRIORITY_RESTART, PRIORITY_START
 from stores import pg_store, SITE_TENANT_DICT
 from models_pods import Pod
 from models_volumes import Volume
@@ -140,7 +141,7 @@ def check_k8_pods(k8_pods):
             rm_pod(k8_pod['k8_name'])
             continue
         
-        pre_health_pod = pod.copy()
+        pre_health_pod = Pod.from_trusted(**pod.dict())
 
         # Found pod in db.
         # Add last_health_check attr.
@@ -175,6 +176,7 @@ def check_k8_pods(k8_pods):
                 pod.db_update(f"health found pod in succeeded, set status to COMPLETE")
             continue
         elif k8_pod_phase in ["Running", "Pending", "Failed"]:
+            # Note: the spawner usually marks new pods AVAILABLE itself (see spawner.track_readiness), this is the backstop.
             # Check if container running or in error state
             # Container can be in waiting state due to ContainerCreating ofc
             if c_state:
@@ -215,17 +217,9 @@ def check_k8_pods(k8_pods):
                         pod.start_instance_ts = datetime.utcnow()
                         pod.status = AVAILABLE
 
-                    if pod.start_instance_ts:
-                        # This will set time_to_stop_ts the first time pod is available and if
-                        # time_to_stop_instance or time_to_stop_default is updated. 
-                        if isinstance(pod.time_to_stop_instance, int):
-                            # If set to -1, we don't do ttl.
-                            if not pod.time_to_stop_instance == -1:
-                                pod.time_to_stop_ts = pod.start_instance_ts + timedelta(seconds=pod.time_to_stop_instance)
-                        else:
-                            # If set to -1, we don't do ttl.
-                            if not pod.time_to_stop_default == -1:
-                                pod.time_to_stop_ts = pod.start_instance_ts + timedelta(seconds=pod.time_to_stop_default)
+                    # This will set time_to_stop_ts the first time pod is available and if
+                    # time_to_stop_instance or time_to_stop_default is updated. 
+                    pod.set_time_to_stop_ts()
                     # We update if there's been a change.
                     if pod != pre_health_pod:
                         pod.db_update(f"health set status to AVAILABLE")
@@ -258,15 +252,35 @@ def check_k8_services():
             rm_pod(k8_service['k8_name'])
             continue
 
+# Columns health needs to decide if a pod needs attention. The full pod is only loaded for those that do.
+POD_HEALTH_COLUMNS = ["pod_id", "tenant_id", "site_id", "status", "status_requested", "time_to_stop_ts"]
+
+
+def pod_needs_attention(pod, k8_pods):
+    """Whether any check in check_db_pods would act on this pod. pod only needs POD_HEALTH_COLUMNS.
+    """
+    if pod.status_requested in [OFF, RESTART] and pod.status != STOPPED:
+        return True
+    if pod.status_requested in ['ON'] and pod.status in [AVAILABLE, DELETING, REQUESTED]:
+        if not any(pod.pod_id in k8_pod['pod_id'] for k8_pod in k8_pods):
+            return True
+    if pod.status_requested in ['ON'] and pod.time_to_stop_ts and pod.time_to_stop_ts < datetime.utcnow():
+        return True
+    if pod.status_requested in ['ON', RESTART] and pod.status == STOPPED:
+        return True
+    return False
+
+
 def check_db_pods(k8_pods):
     """Go through database for all tenants in this site. Delete/Create whatever is needed.
+    Only a light snapshot of each pod is read, full pods are loaded for the few that need attention.
     """
     all_pods = []
-    stmt = select(Pod)
+    stmt = select(*Pod.project(POD_HEALTH_COLUMNS))
     failed_tenants = []
     for tenant in SITE_TENANT_DICT[conf.site_id]:
         try:
-            all_pods += pg_store[conf.site_id][tenant].run("execute", stmt, scalars=True, all=True)
+            all_pods += pg_store[conf.site_id][tenant].run("execute", stmt, all=True)
         except ProgrammingError as e:
             logger.warning(f"Tenant: {tenant} not found in database. Skipping.")
             failed_tenants.append(tenant)
@@ -280,7 +294,14 @@ def check_db_pods(k8_pods):
 
 
     ### Go through all pod entries in the database
-    for pod in all_pods:
+    for pod_snapshot in all_pods:
+        if not pod_needs_attention(pod_snapshot, k8_pods):
+            continue
+        pod = Pod.db_get_with_pk(pod_snapshot.pod_id, tenant=pod_snapshot.tenant_id, site=conf.site_id)
+        if not pod:
+            # Deleted since the snapshot was read.
+            continue
+
         ### Delete pods with status_requested = OFF or RESTART
         if pod.status_requested in [OFF, RESTART] and pod.status != STOPPED:
             logger.info(f"pod_id: {pod.pod_id} found with status_requested: {pod.status_requested} and not STOPPED. Gracefully shutting pod down.")
@@ -362,14 +383,17 @@ def check_db_pods(k8_pods):
                 pod.status_requested = ON
 
             pod.status = REQUESTED
+            pod.start_trace()
             pod.db_update(f"health found {original_pod_status} pod set to STOPPED, set status to REQUESTED")
 
-            # Send command to start new pod
-            ch = CommandChannel(name=pod.site_id)
+            # Send command to start new pod. Restarts jump ahead of queued creates.
+            ch = CommandChannel.for_object(site_id=pod.site_id, object_type="pod")
             ch.put_cmd(object_id=pod.pod_id,
                        object_type="pod",
                        tenant_id=pod.tenant_id,
-                       site_id=pod.site_id)
+                       site_id=pod.site_id,
+                       priority=PRIORITY_RESTART if original_pod_status == RESTART else PRIORITY_START,
+                       trace_id=pod.trace_id)
             ch.close()
             logger.debug(f"Command Channel - Added msg for pod_id: {pod.pod_id}.")
 
@@ -68,7 +68,7 @@ def check_nfs_files():
         logger.info(f"Top of check_nfs_files for tenant: {tenant}.\n")
         ### Volumes
         # Go through database for tenant. Get all volumes
-        tenant_volume_list = Volume.db_get_all(tenant=tenant, site=conf.site_id)
+        tenant_volume_list = Volume.db_get_all(tenant=tenant, site=conf.site_id, columns=["volume_id"])
         tenant_volume_dict = {}
         for volume in tenant_volume_list:
             # {volume_id: volume, ...}
@@ -89,7 +89,7 @@ def check_nfs_files():
 
         ### Snapshots
         # Go through database for tenant. Get all snapshots
-        tenant_snapshot_list = Snapshot.db_get_all(tenant=tenant, site=conf.site_id)
+        tenant_snapshot_list = Snapshot.db_get_all(tenant=tenant, site=conf.site_id, columns=["snapshot_id"])
         tenant_snapshot_dict = {}
         for snapshot in tenant_snapshot_list:
             # {snapshot_id: snapshot, ...}
@@ -191,9 +191,10 @@ def nfs_folder_init(tenant):
 
 def set_traefik_proxy():
     all_pods = []
-    stmt = select(Pod)
+    # Only what the proxy config needs, not full pods with their logs.
+    stmt = select(*Pod.project(["k8_name", "networking"]))
     for tenant in SITE_TENANT_DICT[conf.site_id]:
-        all_pods += pg_store[conf.site_id][tenant].run("execute", stmt, scalars=True, all=True)
+        all_pods += pg_store[conf.site_id][tenant].run("execute", stmt, all=True)
 
     ### Proxy ports and config changes
     # For proxy config later. proxy_info_x = {pod.k8_name: {routing_port, url}, ...} 
@@ -8,7 +8,7 @@ import random
 from typing import Literal, Dict, List
 
 from jinja2 import Environment, FileSystemLoader
-from kubernetes import client, config, stream
+from kubernetes import client, config, stream, watch
 from requests.exceptions import ReadTimeout, ConnectionError
 
 from tapisservice.logs import get_logger
@@ -261,6 +261,45 @@ def container_running(name: str):
         logger.error(msg)
         raise KubernetesError(msg)
     
+def wait_for_container_ready(name: str, timeout: int = 180):
+    """
+    Watch a single k8 pod (field selected on its name) until its container is running or it fails.
+
+    Args:
+        name (str): Name of k8 pod to watch, pods-<site>-<tenant>-<pod_id> format.
+        timeout (int): Seconds to watch before giving up.
+
+    Returns:
+        (str, k8pod | None): ("running", pod) when the container is running, ("failed", pod) when the
+            pod can't get there (waiting for a reason other than ContainerCreating, terminated, or
+            pod phase Succeeded/Failed), ("timeout", None) otherwise.
+    """
+    logger.debug(f"top of kubernetes_utils.wait_for_container_ready() for name: {name}.")
+    w = watch.Watch()
+    try:
+        for event in w.stream(k8.list_namespaced_pod,
+                              namespace=NAMESPACE,
+                              field_selector=f"metadata.name={name}",
+                              timeout_seconds=timeout):
+            k8_pod = event['object']
+            if event['type'] == 'DELETED':
+                return "failed", k8_pod
+            phase = k8_pod.status.phase
+            if phase in ["Succeeded", "Failed"]:
+                return "failed", k8_pod
+            try:
+                c_state = k8_pod.status.container_statuses[0].state
+            except (TypeError, IndexError):
+                # container_statuses is None while pending.
+                continue
+            if c_state.running and phase == "Running":
+                return "running", k8_pod
+            if c_state.terminated or (c_state.waiting and c_state.waiting.reason not in ["ContainerCreating", "PodInitializing"]):
+                return "failed", k8_pod
+    finally:
+        w.stop()
+    return "timeout", None
+
 def stop_container(name: str):
     """
     Attempt to stop running pod, with retry logic. Should only be called with a running pod.
@@ -483,7 +522,7 @@ def create_pod(name: str,
     except Exception as e:
         msg = f"Got exception trying to create pod with image: {image}. {repr(e)}. e: {e}"
         logger.info(msg)
-        raise KubernetesError(msg)
+        raise KubernetesError(msg) from e
     logger.info(f"Pod created successfully.")
     return k8_pod
 
@@ -530,7 +569,7 @@ def create_service(name, ports_dict={}):
     except Exception as e:
         msg = f"Got exception trying to start service with name: {name}. {e}"
         logger.info(msg)
-        raise KubernetesError(msg)
+        raise KubernetesError(msg) from e
     logger.info(f"Pod service started successfully.")
     return k8_service
 
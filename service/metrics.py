@@ -0,0 +1,118 @@
+"""
+In-process metrics for the Pods Service components (api, spawner, health).
+
+We don't run a metrics server, so counters and latency histograms are kept per process and
+written to the logs periodically with `metrics.log_summary()`. Each metric is keyed by name
+plus optional labels, e.g. `metrics.histogram("spawner_queue_wait_seconds", tenant="dev")`.
+"""
+import bisect
+import threading
+import time
+
+from tapisservice.logs import get_logger
+logger = get_logger(__name__)
+
+
+class Counter(object):
+    """Thread-safe monotonically increasing counter."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def summary(self):
+        return self.value
+
+
+class LatencyHistogram(object):
+    """
+    Thread-safe histogram of durations in seconds. Buckets are upper bounds, anything above the
+    last bucket lands in the overflow bucket.
+    """
+    BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(buckets or self.BUCKETS)
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        idx = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.sum += seconds
+            self.max = max(self.max, seconds)
+
+    def percentile(self, pct):
+        """Upper bound of the bucket containing the given percentile. Overflow returns max."""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            target = self.count * pct / 100
+            running = 0
+            for idx, bucket_count in enumerate(self.counts):
+                running += bucket_count
+                if running >= target:
+                    return self.buckets[idx] if idx < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self):
+        return {"count": self.count,
+                "avg": round(self.sum / self.count, 4) if self.count else 0.0,
+                "max": round(self.max, 4),
+                "p50": self.percentile(50),
+                "p95": self.percentile(95),
+                "p99": self.percentile(99)}
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._last_log = time.time()
+
+    @staticmethod
+    def _key(name, labels):
+        if not labels:
+            return name
+        label_str = ",".join(f"{key}={val}" for key, val in sorted(labels.items()))
+        return f"{name}{{{label_str}}}"
+
+    def _get_or_create(self, metric_cls, name, labels):
+        key = self._key(name, labels)
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(key, metric_cls())
+        return metric
+
+    def counter(self, name, **labels) -> Counter:
+        return self._get_or_create(Counter, name, labels)
+
+    def histogram(self, name, **labels) -> LatencyHistogram:
+        return self._get_or_create(LatencyHistogram, name, labels)
+
+    def snapshot(self):
+        """Returns {metric_key: value or histogram summary} for every metric recorded so far."""
+        with self._lock:
+            items = list(self._metrics.items())
+        return {key: metric.summary() for key, metric in items}
+
+    def log_summary(self, every: int = 60):
+        """Log a snapshot of all metrics, at most once every `every` seconds."""
+        now = time.time()
+        if now - self._last_log < every:
+            return
+        self._last_log = now
+        for key, value in sorted(self.snapshot().items()):
+            logger.info(f"metrics: {key} = {value}")
+
+
+metrics = MetricsRegistry()
@@ -1,6 +1,9 @@
 from asyncio import protocols
 import http
 import re
+import select as select_io
+import threading
+import time
 from sre_constants import ANY
 from string import ascii_letters, digits
 from secrets import choice
@@ -9,7 +12,10 @@ from typing import List, Dict, Literal, Any, Set
 from wsgiref import validate
 from pydantic import BaseModel, Field, validator, root_validator, conint
 from codes import PERMISSION_LEVELS
+from metrics import metrics
 
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from stores import pg_store
 from tapisservice.tapisfastapi.utils import g
 from tapisservice.config import conf
@@ -35,4 +41,105 @@ class Template(TapisModel, table=True, validate=True):
     # Provided
     creation_time: datetime = Field(..., description = "Time image was added to allow list.")
     added_by: str = Field(..., description = "User who added image to allow list.")
-    #__table_args__ = ({"schema": "siteadmintables"},)
\ No newline at end of file
+    #__table_args__ = ({"schema": "siteadmintables"},)
+
+
+# Postgres NOTIFY channel the template table's trigger sends to on any change, see migration init8.
+TEMPLATE_CHANNEL = "pods_template_changed"
+
+
+class TemplateAllowList(object):
+    """
+    In-memory index of each site's siteadmintable Template rows, {tenant: images}, "*" tenant applies
+    to all tenants and object_names ending in "*" match as image prefixes. Used by Pod.check_pod_template
+    so validation doesn't scan the Template table. Reloaded after conf.template_allowlist_ttl seconds
+    or as soon as a Template row changes (LISTEN on TEMPLATE_CHANNEL).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sites = {} # {site: (loaded_at, {tenant: set(images)}, {tenant: tuple(prefixes)})}
+        self._generations = {} # {site: int}, bumped on invalidate so in-flight loads aren't cached.
+        self._listeners = set()
+
+    def invalidate(self, site=None):
+        with self._lock:
+            for site_id in ([site] if site else list(self._sites)):
+                self._sites.pop(site_id, None)
+                self._generations[site_id] = self._generations.get(site_id, 0) + 1
+
+    @staticmethod
+    def _load(site):
+        exact = {}
+        prefixes = {}
+        for template in Template.db_get_all(tenant="siteadmintable", site=site):
+            for tenant in template.tenants:
+                if template.object_name.endswith("*"):
+                    prefixes.setdefault(tenant, []).append(template.object_name[:-1])
+                else:
+                    exact.setdefault(tenant, set()).add(template.object_name)
+        return exact, {tenant: tuple(tenant_prefixes) for tenant, tenant_prefixes in prefixes.items()}
+
+    def _index(self, site):
+        entry = self._sites.get(site)
+        if entry and time.monotonic() - entry[0] < conf.get('template_allowlist_ttl', 60):
+            metrics.counter("template_allowlist_hits", site=site).inc()
+            return entry[1], entry[2]
+
+        metrics.counter("template_allowlist_misses", site=site).inc()
+        self._start_listener(site)
+        generation = self._generations.get(site, 0)
+        loaded_at = time.monotonic()
+        exact, prefixes = self._load(site)
+        with self._lock:
+            if self._generations.get(site, 0) == generation:
+                self._sites[site] = (loaded_at, exact, prefixes)
+        return exact, prefixes
+
+    def is_allowed(self, image, tenant, site):
+        """True if a Template row allows tenant (or "*") to use image."""
+        exact, prefixes = self._index(site)
+        for key in [tenant, "*"]:
+            if image in exact.get(key, ()) or image.startswith(prefixes.get(key, ())):
+                return True
+        return False
+
+    def _start_listener(self, site):
+        if not conf.get('template_allowlist_listen', True):
+            return
+        with self._lock:
+            if site in self._listeners:
+                return
+            self._listeners.add(site)
+        threading.Thread(target=self._listen, args=(site,), name=f"template-listener-{site}", daemon=True).start()
+
+    def _listen(self, site):
+        """Invalidates site's index on every NOTIFY from the template trigger. Reconnects forever."""
+        dsn = pg_store[site]["siteadmintable"].engine.url.render_as_string(hide_password=False)
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(dsn)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {TEMPLATE_CHANNEL};")
+                # Rows could have changed while we weren't listening.
+                self.invalidate(site)
+                logger.info(f"Listening for template changes on site: {site}.")
+                while True:
+                    if select_io.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        schemas = {notify.payload for notify in conn.notifies}
+                        conn.notifies.clear()
+                        logger.info(f"Template rows changed in site: {site}; schemas: {schemas}. Invalidating allowlist.")
+                        self.invalidate(site)
+            except Exception as e:
+                logger.warning(f"Template listener for site: {site} disconnected, relying on ttl until reconnect. e: {repr(e)}")
+                time.sleep(5)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+template_allowlist = TemplateAllowList()
@@ -1,19 +1,49 @@
 import re
+import json
+import base64
+import operator
+from functools import lru_cache
 from string import ascii_letters, digits
 from secrets import choice
 from datetime import datetime
 from typing import List, Dict, Literal, Any, Set
 from pydantic import BaseModel, Field, validator, root_validator
 
-from stores import pg_store
+from stores import pg_store, apg_store
+from store import request_objects
+from codes import PermissionLevel
+from errors import QueryParameterError
+from tracing import component, new_span_id
 from tapisservice.logs import get_logger
 logger = get_logger(__name__)
 
-from sqlalchemy import UniqueConstraint
+# Status transitions kept in Pod.timeline.
+POD_TIMELINE_LENGTH = 50
+
+from sqlalchemy import UniqueConstraint, bindparam, func, literal, tuple_
+from sqlalchemy import select as select_columns
 from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.orm.attributes import set_attribute
+from sqlalchemy.orm.instrumentation import manager_of_class
 from sqlmodel import Field, Session, SQLModel, select, JSON, Column
 
 
+# where_params opers to column expression builders. Values are bound as parameters, never rendered into SQL.
+WHERE_OPERATORS = {'.neq': operator.ne,
+                   '.eq': operator.eq,
+                   '.lte': operator.le,
+                   '.lt': operator.lt,
+                   '.gte': operator.ge,
+                   '.gt': operator.gt,
+                   '.nin': lambda column, val: column.not_in(val),
+                   '.in': lambda column, val: column.in_(val)}
+
+
+# Stand in for null datetimes when sorting so keyset comparisons never see NULL.
+NULL_SORT_TS = datetime(1970, 1, 1)
+
+
 class TapisApiModel(BaseModel):
     class Config:
         validate_assignment = True
@@ -36,6 +66,15 @@ class TapisModel(SQLModel):
         logger.debug(f"Using site: {site_id}; tenant: {tenant_id}; Session: {Session}.")
         return site_id, tenant_id, store
 
+    @staticmethod
+    def get_site_tenant_async_session(obj={}, tenant=None, site=None):
+        # Same as get_site_tenant_session, but returns the tenant's AsyncPostgresStore.
+        tenant_id = tenant or getattr(obj, 'tenant_id', None) or 'tacc'
+        site_id = site or getattr(obj, 'site_id', None) or 'tacc'
+        logger.info(f"Using site: {site_id}; tenant: {tenant_id}. Getting tenant async pg obj.")
+        store = apg_store[site_id][tenant_id]
+        return site_id, tenant_id, store
+
     def db_create(self):
         """
         Creates a new row in the given table. Returns the primary key ID of the new row.
@@ -46,6 +85,7 @@ class TapisModel(SQLModel):
 
         # Run command
         store.run("add", self)
+        self.remember_for_request(tenant, site)
 
         logger.info(f"Row successfully created in table {tenant}.{table_name}.")
         return self
@@ -58,6 +98,93 @@ class TapisModel(SQLModel):
         table_name = self.table_name()
         logger.info(f'Top of {table_name}.db_update() for tenant.site: {tenant}.{site}')
 
+        self._record_update(log)
+
+        # Run command
+        store.run("merge", self)
+        self.remember_for_request(tenant, site)
+        
+        logger.info(f"Row successfully updated in table {tenant}.{table_name}.")
+        return self
+
+    async def adb_create(self):
+        """
+        Async db_create for the API's async handlers.
+        """
+        site, tenant, store = self.get_site_tenant_async_session(obj=self)
+        table_name = self.table_name()
+        logger.info(f'Top of {table_name}.adb_create() for site: {site}; tenant: {tenant}.')
+
+        # Run command
+        await store.run("add", self)
+        self.remember_for_request(tenant, site)
+
+        logger.info(f"Row successfully created in table {tenant}.{table_name}.")
+        return self
+
+    async def adb_update(self, log = None):
+        """
+        Async db_update for the API's async handlers.
+        """
+        site, tenant, store = self.get_site_tenant_async_session(obj=self)
+        table_name = self.table_name()
+        logger.info(f'Top of {table_name}.adb_update() for tenant.site: {tenant}.{site}')
+
+        self._record_update(log)
+
+        # Run command
+        await store.run("merge", self)
+        self.remember_for_request(tenant, site)
+
+        logger.info(f"Row successfully updated in table {tenant}.{table_name}.")
+        return self
+
+    @classmethod
+    def db_update_many(cls, objs: List, log = None):
+        """
+        Updates every instance in objs in one transaction. All objs must be in the same tenant and site.
+        """
+        if not objs:
+            return objs
+        site, tenant, store = cls.get_site_tenant_session(obj=objs[0])
+        table_name = cls.table_name()
+        logger.info(f'Top of {table_name}.db_update_many() for {len(objs)} rows for tenant.site: {tenant}.{site}')
+
+        for obj in objs:
+            obj._record_update(log)
+
+        # Run command
+        store.run_many("merge", objs)
+
+        logger.info(f"{len(objs)} rows successfully updated in table {tenant}.{table_name}.")
+        return objs
+
+    @classmethod
+    async def adb_update_many(cls, objs: List, log = None):
+        """
+        Async db_update_many for the API's async handlers.
+        """
+        if not objs:
+            return objs
+        site, tenant, store = cls.get_site_tenant_async_session(obj=objs[0])
+        table_name = cls.table_name()
+        logger.info(f'Top of {table_name}.adb_update_many() for {len(objs)} rows for tenant.site: {tenant}.{site}')
+
+        for obj in objs:
+            obj._record_update(log)
+
+        # Run command
+        await store.run_many("merge", objs)
+
+        logger.info(f"{len(objs)} rows successfully updated in table {tenant}.{table_name}.")
+        return objs
+
+    def _record_update(self, log = None):
+        """
+        Pod bookkeeping done on every update, action_logs and timeline.
+        """
+        table_name = self.table_name()
+
         # We write logs when:
         # 1. log is given
         # 2. it's a pod
@@ -66,11 +193,14 @@ class TapisModel(SQLModel):
         if table_name == 'pod' and log and (not self.action_logs or log not in self.action_logs[-1]):
             self.action_logs.append(f"{datetime.utcnow().strftime('%y/%m/%d %H:%M')}: {log}")
 
-        # Run command
-        store.run("merge", self)
-        
-        logger.info(f"Row successfully updated in table {tenant}.{table_name}.")
-        return self
+        # Pods also record each status transition on their timeline, see /pods/{pod_id}/timeline.
+        if table_name == 'pod' and (not self.timeline or self.timeline[-1].get('status') != self.status):
+            transition = {"status": self.status,
+                          "ts": datetime.utcnow().isoformat(),
+                          "component": component(),
+                          "trace_id": self.trace_id,
+                          "span_id": new_span_id()}
+            self.timeline = (self.timeline + [transition])[-POD_TIMELINE_LENGTH:]
 
     def db_delete(self):
         """
@@ -82,10 +212,46 @@ class TapisModel(SQLModel):
 
         # Run command
         store.run("delete", self)
+        self.forget_for_request(tenant, site)
         
         logger.info(f"Row successfully deleted from table {tenant}.{table_name}.")
         return self
 
+    async def adb_delete(self):
+        """
+        Async db_delete for the API's async handlers.
+        """
+        site, tenant, store = self.get_site_tenant_async_session(obj=self)
+        table_name = self.table_name()
+        logger.info(f'Top of {table_name}.adb_delete() for tenant.site: {tenant}.{site}')
+
+        # Run command
+        await store.run("delete", self)
+        self.forget_for_request(tenant, site)
+
+        logger.info(f"Row successfully deleted from table {tenant}.{table_name}.")
+        return self
+
+    @classmethod
+    def request_object(cls, pk_id, tenant, site):
+        """
+        Object with pk_id already loaded during this api request (see store.request_objects), or None.
+        """
+        objects = request_objects.get()
+        if objects is None:
+            return None
+        return objects.get((cls.table_name(), tenant, site, pk_id))
+
+    def remember_for_request(self, tenant, site):
+        objects = request_objects.get()
+        if objects is not None:
+            objects[(self.table_name(), tenant, site, getattr(self, self.primary_key_name()))] = self
+
+    def forget_for_request(self, tenant, site):
+        objects = request_objects.get()
+        if objects is not None:
+            objects.pop((self.table_name(), tenant, site, getattr(self, self.primary_key_name())), None)
+
     def get_permissions(self):
         # create permissions dict {"username": [roles], ...} with current permissions.
         perm_dict = {}
@@ -101,7 +267,86 @@ class TapisModel(SQLModel):
     @classmethod
     def from_db(cls, db_dict):
         """Construct a DAO from a db dict."""
-        return cls(**db_dict)
+        return cls.from_trusted(**db_dict)
+
+    @classmethod
+    def from_trusted(cls, **data):
+        """
+        Builds an instance from already validated data (db rows, other instances, exports) without running
+        validators, so no db, allowlist, or tenant cache lookups. Missing fields get their defaults.
+        User input must go through cls(**data).
+        """
+        if not getattr(cls.__config__, "table", False):
+            return cls.construct(**data)
+        # Table models need SQLAlchemy's instance state, set up the same way the ORM does for loaded rows.
+        # Values go in without setattr, validate_assignment would run every validator for each field otherwise.
+        configure_mappers()
+        obj = manager_of_class(cls).new_instance()
+        columns = inspect(cls).attrs.keys()
+        values = {name: field.get_default() for name, field in cls.__fields__.items() if name not in data}
+        values.update(data)
+        for key, value in values.items():
+            if key in columns:
+                set_attribute(obj, key, value)
+            else:
+                obj.__dict__[key] = value
+        object.__setattr__(obj, "__fields_set__", set(data))
+        return obj
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def primary_key_name(cls):
+        return inspect(cls).primary_key[0].name
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def pk_statement(cls):
+        """
+        `SELECT ... WHERE <pk> = :pk_id`, built once per model. Run with params={"pk_id": pk_id}.
+        """
+        return select(cls).where(getattr(cls, cls.primary_key_name()) == bindparam("pk_id"))
+
+    @classmethod
+    def compile_where(cls, where_params: List[List]):
+        """
+        [[key, oper, val], ...] to column expressions, e.g. [["status", ".eq", "ON"]] -> [cls.status == :status_1].
+        """
+        expressions = []
+        for key, oper, val in where_params:
+            if key not in cls.__fields__:
+                raise KeyError(f"key: {key} not found in model attrs: {cls.__fields__.keys()}")
+            if oper not in WHERE_OPERATORS:
+                raise KeyError(f"oper: {oper} not found in oper aliases: {list(WHERE_OPERATORS)}")
+            expressions.append(WHERE_OPERATORS[oper](getattr(cls, key), val))
+        return expressions
+
+    @classmethod
+    def column_expression(cls, name):
+        """
+        What to select for field name in projections. Models override this to trim large columns in SQL.
+        """
+        return getattr(cls, name)
+
+    @classmethod
+    def project(cls, columns: List[str]):
+        """
+        Field names to labeled column expressions, for selecting lightweight records instead of full rows.
+        """
+        for column in columns:
+            if column not in cls.__fields__:
+                raise KeyError(f"column: {column} not found in model attrs: {cls.__fields__.keys()}")
+        return [cls.column_expression(column).label(column) for column in dict.fromkeys(columns)]
+
+    @classmethod
+    def permission_filter(cls, user, level):
+        """
+        Where clause for rows user has level (or above) on. An index lookup on object_permission by user.
+        """
+        from models_permissions import ObjectPermission
+        visible_ids = select(ObjectPermission.object_id).where(ObjectPermission.object_type == cls.table_name(),
+                                                              ObjectPermission.username == user,
+                                                              ObjectPermission.level.in_(PermissionLevel(level).authorized_levels()))
+        return getattr(cls, cls.primary_key_name()).in_(visible_ids)
 
     @classmethod
     def db_get_where(cls, where_params: List[List], tenant, site):
@@ -117,33 +362,8 @@ class TapisModel(SQLModel):
         if not where_params:
             raise ValueError(f"where_dict must be specfied for db_get_where. Got empty")
 
-        oper_aliases = {'.neq': '!=',
-                        '.eq': '==',
-                        '.lte': '<=',
-                        '.lt': '<',
-                        '.gte': '>=',
-                        '.gt': '>',
-                        '.nin': 'laterprocessing',
-                        '.in': 'laterprocessing'}
-
-        # Create base statement
-        stmt = select(cls)
-        for key, oper, val in where_params:
-            if key not in cls.__fields__.keys():
-                raise KeyError(f"key: {key} not found in model attrs: {cls.__fields__.keys()}")
-            if oper not in oper_aliases:
-                raise KeyError(f"oper: {oper} not found in oper aliases: {oper_aliases}")
-            
-            # Create where statement and add to stmt
-            if oper == '.in':
-                stmt = stmt.where(eval(f"cls.{key}.in_({val})")) # User.key.in_([123,456])
-            elif oper == '.nin':
-                stmt = stmt.where(eval(f"cls.{key}.not_in({val})")) # User.key.in_([123,456])
-            else:
-                if isinstance(val, str):
-                    stmt = stmt.where(eval(f"cls.{key} {oper_aliases[oper]} '{val}'"))
-                else:
-                    stmt = stmt.where(eval(f"cls.{key} {oper_aliases[oper]} {val}"))
+        # Create statement
+        stmt = select(cls).where(*cls.compile_where(where_params))
 
         # Run command
         results = store.run("execute", stmt, scalars=True, all=True)
@@ -160,30 +380,210 @@ class TapisModel(SQLModel):
         table_name = cls.table_name()
         logger.debug(f'Top of {table_name}.db_get_all() for tenant.site: {tenant}.{site}')
 
-        # Create statement
-        primary_key = inspect(cls).primary_key[0].name
-        stmt = select(cls).where(eval(f"cls.{primary_key}.in_([pk_id])"))
+        # Reuse the object if it was already loaded during this request.
+        result = cls.request_object(pk_id, tenant, site)
+        if result is not None:
+            return result
 
         # Run command
-        result = store.run("scalar", stmt)
+        result = store.run("scalar", cls.pk_statement(), fn_params={"params": {"pk_id": pk_id}})
+        if result is not None:
+            result.remember_for_request(tenant, site)
 
         return result
 
     @classmethod
-    def db_get_all(cls, tenant, site):
+    async def adb_get_with_pk(cls, pk_id, tenant, site):
         """
-        Gets the row with given primary key from the specified table.
+        Async db_get_with_pk for the API's async handlers.
+        RETURNS CLASS
+        """
+        site, tenant, store = cls.get_site_tenant_async_session(tenant=tenant, site=site)
+        table_name = cls.table_name()
+        logger.debug(f'Top of {table_name}.adb_get_with_pk() for tenant.site: {tenant}.{site}')
+
+        # Reuse the object if it was already loaded during this request.
+        result = cls.request_object(pk_id, tenant, site)
+        if result is not None:
+            return result
+
+        # Run command
+        result = await store.run("scalar", cls.pk_statement(), fn_params={"params": {"pk_id": pk_id}})
+        if result is not None:
+            result.remember_for_request(tenant, site)
+
+        return result
+
+    @classmethod
+    def db_get_many_with_pk(cls, pk_ids: List, tenant, site):
+        """
+        Gets the rows with given primary keys from the specified table in one query.
+        RETURNS {pk_id: CLASS}, missing pk_ids aren't included.
         """
         site, tenant, store = cls.get_site_tenant_session(tenant=tenant, site=site)
         table_name = cls.table_name()
-        logger.debug(f'Top of {table_name}.db_get_all() for tenant.site: {tenant}.{site}')
+        logger.debug(f'Top of {table_name}.db_get_many_with_pk() for tenant.site: {tenant}.{site}')
 
         # Create statement
-        stmt = select(cls)
+        primary_key = cls.primary_key_name()
+        stmt = select(cls).where(getattr(cls, primary_key).in_(pk_ids))
 
         # Run command
         results = store.run("execute", stmt, scalars=True, all=True)
 
+        return {getattr(result, primary_key): result for result in results}
+
+    @classmethod
+    async def adb_get_many_with_pk(cls, pk_ids: List, tenant, site):
+        """
+        Async db_get_many_with_pk for the API's async handlers.
+        RETURNS {pk_id: CLASS}, missing pk_ids aren't included.
+        """
+        site, tenant, store = cls.get_site_tenant_async_session(tenant=tenant, site=site)
+        table_name = cls.table_name()
+        logger.debug(f'Top of {table_name}.adb_get_many_with_pk() for tenant.site: {tenant}.{site}')
+
+        # Create statement
+        primary_key = cls.primary_key_name()
+        stmt = select(cls).where(getattr(cls, primary_key).in_(pk_ids))
+
+        # Run command
+        results = await store.run("execute", stmt, scalars=True, all=True)
+
+        return {getattr(result, primary_key): result for result in results}
+
+    @classmethod
+    def db_get_all(cls, tenant, site, columns: List[str] | None = None):
+        """
+        Gets all rows from the specified table.
+        With columns, only those columns are loaded and lightweight records (rows with attribute access) are returned.
+        """
+        site, tenant, store = cls.get_site_tenant_session(tenant=tenant, site=site)
+        table_name = cls.table_name()
+        logger.debug(f'Top of {table_name}.db_get_all() for tenant.site: {tenant}.{site}')
+
+        # Create statement
+        if columns:
+            stmt = select_columns(*cls.project(columns))
+        else:
+            stmt = select(cls)
+
+        # Run command
+        results = store.run("execute", stmt, scalars=not columns, all=True)
+
         logger.info(f"Got rows from table {tenant}.{table_name}.")
 
         return results
+
+    @classmethod
+    async def adb_get_all_with_permission(cls, user, level, tenant, site):
+        """
+        Async db_get_all_with_permission for the API's async handlers. Works for any table with permissions.
+        """
+        site, tenant, store = cls.get_site_tenant_async_session(tenant=tenant, site=site)
+        table_name = cls.table_name()
+        logger.info(f'Top of {table_name}.adb_get_all_with_permission() for tenant.site: {tenant}.{site}')
+
+        # Create statement, permissions are looked up in object_permission by user.
+        stmt = select(cls).where(cls.permission_filter(user, level))
+
+        # Run command
+        results = await store.run("execute", stmt, scalars=True, all=True)
+
+        logger.info(f"Got rows from table {tenant}.{table_name}.")
+        return results
+
+    @classmethod
+    def compile_sort(cls, sort: str | None):
+        """
+        "field" or "-field" (descending) to (field, descending). Defaults to the primary key.
+        Only str, int, and datetime fields are sortable.
+        """
+        sort = sort or cls.primary_key_name()
+        descending = sort.startswith("-")
+        field = sort.lstrip("-")
+        sortable = [name for name, model_field in cls.__fields__.items() if model_field.outer_type_ in [str, int, datetime]]
+        if field not in sortable:
+            raise QueryParameterError(f"sort: {sort} is not sortable. Sort by one of: {sortable}, prefix with '-' for descending.", 400)
+        return field, descending
+
+    @classmethod
+    def _sort_expression(cls, field):
+        column = getattr(cls, field)
+        if cls.__fields__[field].outer_type_ is datetime:
+            return func.coalesce(column, literal(NULL_SORT_TS))
+        return column
+
+    @classmethod
+    def encode_cursor(cls, sort: str | None, row):
+        """Opaque keyset cursor pointing after row for the given sort."""
+        field, _ = cls.compile_sort(sort)
+        value = getattr(row, field)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        payload = {"s": sort or "", "v": value, "k": getattr(row, cls.primary_key_name())}
+        return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+    @classmethod
+    def decode_cursor(cls, cursor: str, sort: str | None):
+        """Returns (sort value, primary key) from a cursor made by encode_cursor with the same sort."""
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            value, pk_id = payload["v"], payload["k"]
+            cursor_sort = payload["s"]
+        except Exception:
+            raise QueryParameterError(f"cursor is invalid, use metadata.next_cursor from the previous page.", 400)
+        if cursor_sort != (sort or ""):
+            raise QueryParameterError(f"cursor was made with sort: '{cursor_sort}', can't be used with sort: '{sort or ''}'.", 400)
+        field, _ = cls.compile_sort(sort)
+        if cls.__fields__[field].outer_type_ is datetime:
+            value = datetime.fromisoformat(value) if value else NULL_SORT_TS
+        return value, pk_id
+
+    @classmethod
+    async def adb_list_with_permission(cls, user, level, tenant, site, where_params: List[List] = None, sort: str | None = None, limit: int | None = None, cursor: str | None = None, columns: List[str] | None = None):
+        """
+        adb_get_all_with_permission plus filtering, sorting, keyset pagination, and projections, all in SQL.
+        where_params are [[key, oper, val], ...] (see compile_where), sort is "field" or "-field".
+        With columns only those (plus the primary key and sort field) are loaded, as lightweight records.
+        RETURNS (CLASS or record list, next_cursor). next_cursor is None on the last page or without a limit.
+        """
+        site, tenant, store = cls.get_site_tenant_async_session(tenant=tenant, site=site)
+        table_name = cls.table_name()
+        logger.info(f'Top of {table_name}.adb_list_with_permission() for tenant.site: {tenant}.{site}')
+
+        field, descending = cls.compile_sort(sort)
+        sort_column = cls._sort_expression(field)
+        pk_column = getattr(cls, cls.primary_key_name())
+
+        # Create statement
+        if columns:
+            stmt = select_columns(*cls.project([cls.primary_key_name(), field] + columns))
+        else:
+            stmt = select(cls)
+        stmt = stmt.where(cls.permission_filter(user, level), *cls.compile_where(where_params or []))
+        if cursor:
+            # Keyset pagination, continue after the last row of the previous page. (sort value, pk) is unique.
+            value, pk_id = cls.decode_cursor(cursor, sort)
+            if descending:
+                stmt = stmt.where(tuple_(sort_column, pk_column) < tuple_(value, pk_id))
+            else:
+                stmt = stmt.where(tuple_(sort_column, pk_column) > tuple_(value, pk_id))
+        if descending:
+            stmt = stmt.order_by(sort_column.desc(), pk_column.desc())
+        else:
+            stmt = stmt.order_by(sort_column, pk_column)
+        if limit:
+            # One extra row tells us if there's a next page.
+            stmt = stmt.limit(limit + 1)
+
+        # Run command
+        results = await store.run("execute", stmt, scalars=not columns, all=True)
+
+        next_cursor = None
+        if limit and len(results) > limit:
+            results = results[:limit]
+            next_cursor = cls.encode_cursor(sort, results[-1])
+
+        logger.info(f"Got {len(results)} rows from table {tenant}.{table_name}.")
+        return results, next_cursor
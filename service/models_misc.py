@@ -54,6 +54,11 @@ class LogsModel(TapisApiModel):
     action_logs: List[str] = Field([], description = "Log of actions taken on this pod.", sa_column=Column(ARRAY(String, dimensions=1)))
 
 
+class TimelineModel(TapisApiModel):
+    trace_id: str = Field("", description = "Trace id of the pod's current lifecycle.")
+    timeline: List[Dict] = Field([], description = "Status transitions of this pod. Each has status, ts, component, trace_id, span_id, and duration (sec) spent in that status.")
+
+
 class CredentialsModel(TapisApiModel):
     user_username: str
     user_password: str
@@ -0,0 +1,61 @@
+from codes import PERMISSION_LEVELS
+from tapisservice.logs import get_logger
+logger = get_logger(__name__)
+
+from sqlalchemy import Index
+from sqlmodel import Field, select
+from models_base import TapisModel
+
+
+class ObjectPermission(TapisModel, table=True, validate=True):
+    """
+    One row per user per pod, volume, or snapshot, normalized from their `permissions` arrays.
+
+    Rows are maintained in the database by the sync_object_permission trigger (migration init9) on every
+    write to the arrays, by the permission endpoints, creates, and deletes alike, in the same transaction.
+    The arrays remain what the API returns and what single object checks read from the already loaded
+    object, see utils.check_permissions. This table makes "what can this user see" an index lookup, see
+    TapisModel.permission_filter, and bulk checks one query, see adb_get_levels.
+    A user listed more than once in an array gets the last entry's level, same as get_permissions() (migration init10).
+    """
+    __tablename__ = "object_permission"
+    __table_args__ = (Index("ix_object_permission_username", "username", "object_type", "level"),)
+
+    object_type: str = Field(..., description = "Table of the object, pod, volume, or snapshot.", primary_key = True)
+    object_id: str = Field(..., description = "Primary key of the object.", primary_key = True)
+    username: str = Field(..., description = "User the permission is granted to.", primary_key = True)
+    level: str = Field(..., description = f"Permission level, one of {PERMISSION_LEVELS}.")
+
+    @classmethod
+    def db_get_for_object(cls, object_type, object_id, tenant, site):
+        """
+        Returns {username: level} for the object, an index lookup on the primary key.
+        """
+        site, tenant, store = cls.get_site_tenant_session(tenant=tenant, site=site)
+        logger.debug(f'Top of object_permission.db_get_for_object() for tenant.site: {tenant}.{site}')
+
+        # Create statement
+        stmt = select(cls).where(cls.object_type == object_type, cls.object_id == object_id)
+
+        # Run command
+        results = store.run("execute", stmt, scalars=True, all=True)
+
+        return {result.username: result.level for result in results}
+
+    @classmethod
+    async def adb_get_levels(cls, object_type, object_ids, username, tenant, site):
+        """
+        Returns {object_id: level} of username on each of object_ids in one query, objects without a permission aren't included.
+        """
+        site, tenant, store = cls.get_site_tenant_async_session(tenant=tenant, site=site)
+        logger.debug(f'Top of object_permission.adb_get_levels() for tenant.site: {tenant}.{site}')
+
+        # Create statement
+        stmt = select(cls.object_id, cls.level).where(cls.object_type == object_type,
+                                                      cls.object_id.in_(object_ids),
+                                                      cls.username == username)
+
+        # Run command
+        results = await store.run("execute", stmt, all=True)
+
+        return {object_id: level for object_id, level in results}
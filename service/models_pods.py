@@ -1,14 +1,16 @@
 from asyncio import protocols
 import http
 import re
+import time
 from sre_constants import ANY
 from string import ascii_letters, digits
 from secrets import choice
-from datetime import datetime
-from typing import List, Dict, Literal, Any, Set, Optional
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import List, Dict, Literal, Any, Set, Optional, ClassVar
 from wsgiref import validate
 from pydantic import BaseModel, Field, validator, root_validator, create_model
-from codes import PERMISSION_LEVELS, PermissionLevel
+from codes import PERMISSION_LEVELS
 
 from stores import pg_store
 from tapisservice.tapisfastapi.utils import g
@@ -18,13 +20,14 @@ logger = get_logger(__name__)
 
 from __init__ import t
 
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, func
 from sqlalchemy.inspection import inspect
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlmodel import Field, Session, SQLModel, select, JSON, Column, String
-from models_admin import Template
+from models_admin import template_allowlist
 from models_base import TapisModel, TapisApiModel
-from models_misc import PermissionsModel, CredentialsModel, LogsModel
+from tracing import new_trace_id
+from models_misc import PermissionsModel, CredentialsModel, LogsModel, TimelineModel
 from models_volumes import Volume
 from models_snapshots import Snapshot
 
@@ -64,6 +67,45 @@ class Password(TapisModel, table=True, validate=True):
         return values
 
 
+class TenantBaseUrls(object):
+    """
+    {tenant_id: base_url} built from the tenant cache, so Pod validators don't look the tenant up every run.
+    Rebuilt after conf.tenant_base_urls_ttl seconds, so base_url changes in the tenant cache are picked up
+    even when it's updated in place, and on unknown tenants (the tenant cache reloads on a miss).
+    """
+    def __init__(self):
+        self._built_at = None
+        self._urls = {}
+
+    def _rebuild(self):
+        tenants = t.tenant_cache.tenants
+        self._urls = {tenant.tenant_id: tenant.base_url for tenant in tenants.values()}
+        self._built_at = time.monotonic()
+
+    def get(self, tenant_id):
+        if self._built_at is None or time.monotonic() - self._built_at >= conf.get('tenant_base_urls_ttl', 60):
+            self._rebuild()
+        base_url = self._urls.get(tenant_id)
+        if base_url is None:
+            base_url = t.tenant_cache.get_tenant_config(tenant_id=tenant_id).base_url
+            self._rebuild()
+        return base_url
+
+
+tenant_base_urls = TenantBaseUrls()
+
+
+@lru_cache(maxsize=4096)
+def networking_url(base_url, pod_id, net_name):
+    """
+    url: podname-networking_name.pods.tacc.develop.tapis.io from base_url https://tacc.develop.tapis.io.
+    'default' networking doesn't get the name, i.e. "podname" instead of "podname-networkname".
+    """
+    if net_name == 'default':
+        return base_url.replace("https://", f"{pod_id}.pods.")
+    return base_url.replace("https://", f"{pod_id}-{net_name}.pods.")
+
+
 class Networking(TapisModel):
     protocol: str =  Field("http", description = "Which network protocol to use. `http`, `tcp`, `postgres`, or `local_only`. `local_only` is only accessible from within the cluster.")
     port: int = Field(5000, description = "Pod port to expose via networking.url in this networking object.")
@@ -212,15 +254,20 @@ class PodBaseFull(PodBaseRead):
     k8_name: str = Field("", description = "Name to use for Kubernetes name.")
     logs: str = Field("", description = "Logs from kubernetes pods, useful for debugging and reading results.")
     permissions: List[str] = Field([], description = "Pod permissions for each user.", sa_column=Column(ARRAY(String, dimensions=1)))
+    trace_id: str = Field("", description = "Trace id of the pod's current lifecycle. New trace each time the pod is requested.")
+    timeline: List[Dict] = Field([], description = "Status transitions of this pod with timestamp, component, and trace ids.", sa_column=Column(JSON))
 
 TapisPodBaseFull = create_model("TapisPodBaseFull", __base__= type("_ComboModel", (PodBaseFull, TapisModel), {}))
 
 
 class Pod(TapisPodBaseFull, table=True, validate=True):
+    # Internal fields left out of display() and list projections.
+    DISPLAY_EXCLUDE: ClassVar[Set[str]] = {'logs', 'k8_name', 'tenant_id', 'permissions', 'site_id', 'data_attached', 'roles_inherited', 'trace_id', 'timeline'}
+
     @validator('pod_id')
     def check_pod_id(cls, v):
         # In case we want to add reserved keywords.
-        reserved_pod_ids = ["catalog", "snapshots", "volumes", "admin", "catalogs", "snapshot", "volume"]
+        reserved_pod_ids = ["catalog", "snapshots", "volumes", "admin", "catalogs", "snapshot", "volume", "bulk"]
         if v in reserved_pod_ids:
             raise ValueError(f"pod_id overlaps with reserved pod ids: {reserved_pod_ids}")
         # Regex match full pod_id to ensure a-z0-9.
@@ -312,20 +359,13 @@ class Pod(TapisPodBaseFull, table=True, validate=True):
         # config -> health -> update service db
         # api -> special role -> update "tenant" db
 
-        # We search the siteadmintable schema for the templates that our tenant is allowed to use.
-        all_templates = Template.db_get_all(tenant="siteadmintable", site=g.site_id)
-        custom_allow_list = []
-        for template in all_templates:
-            if g.tenant_id in template.tenants or "*" in template.tenants:
-                custom_allow_list.append(template.object_name)
-        # Then we add templates from the conf.image_allow_list
-        custom_allow_list += conf.image_allow_list or []
-
-        custom_allow_list += templates
-
         if v.startswith("templates/") and v not in templates:
             raise ValueError(f"pod_template must be one of the following: {templates}.")
-        elif v not in custom_allow_list:
+        # Allowed if it's a template, in conf.image_allow_list, or our tenant is allowed by the
+        # siteadmintable schema's Template rows (cached, see models_admin.TemplateAllowList).
+        if v in templates or v in (conf.image_allow_list or []):
+            return v
+        if not template_allowlist.is_allowed(v, g.tenant_id, g.site_id):
             raise ValueError(f"Custom pod_template images must be in allowlist. Speak to admin")
 
         return v
@@ -391,44 +431,75 @@ class Pod(TapisPodBaseFull, table=True, validate=True):
         pod_id = values.get('pod_id')
         ### k8_name: pods-<site>-<tenant>-<pod_id>
         values['k8_name'] = f"pods-{site_id}-{tenant_id}-{pod_id}"
-        ### url: podname-networking_name.pods.tacc.develop.tapis.io
-        # base_url in the form of https://tacc.develop.tapis.io.
-        logger.debug("Fetching base_url for k8_name Pod root_validator from tenant_cache")
-        base_url = t.tenant_cache.get_tenant_config(tenant_id=tenant_id).base_url
-
+        ### url: podname-networking_name.pods.tacc.develop.tapis.io, see networking_url.
         # Ensure the object already exists, this function loops a lot before value is set.
-        if values.get('networking'):
+        if values.get('networking') and pod_id:
+            base_url = tenant_base_urls.get(tenant_id)
             for net_name, net_info in values['networking'].items():
+                url = networking_url(base_url, pod_id, net_name)
+                # Already built on an earlier run, nothing to redo.
+                if isinstance(net_info, Networking) and net_info.url == url:
+                    continue
                 # The Networking model needs to be transformed to a dict if it's being used. When we get with alchemy
                 # the entire object is already a dict though. So we always expect a dict.
                 if not isinstance(net_info, dict):
                     net_info = net_info.dict()
 
-                # if networking.name is specified we add it to the pod_name of our url after a hyphen. 'default' does not do this.
-                # i.e. "podname-networkname" instead of just "podname" when networking.name == 'default'
-                if net_name == 'default':
-                    url = base_url.replace("https://", f"{pod_id}.pods.")
-                else:
-                    url = base_url.replace("https://", f"{pod_id}-{net_name}.pods.")
-
                 # Set value to Networking object.
                 values['networking'][net_name] = Networking(protocol=net_info['protocol'],
                                                             port=net_info['port'],
                                                             url=url)
         return values
 
+    def set_time_to_stop_ts(self):
+        """
+        Sets time_to_stop_ts from start_instance_ts and time_to_stop_instance, or time_to_stop_default
+        when time_to_stop_instance isn't set. -1 means no ttl, so time_to_stop_ts is left alone.
+        """
+        if not self.start_instance_ts:
+            return
+        if isinstance(self.time_to_stop_instance, int):
+            # If set to -1, we don't do ttl.
+            if not self.time_to_stop_instance == -1:
+                self.time_to_stop_ts = self.start_instance_ts + timedelta(seconds=self.time_to_stop_instance)
+        else:
+            # If set to -1, we don't do ttl.
+            if not self.time_to_stop_default == -1:
+                self.time_to_stop_ts = self.start_instance_ts + timedelta(seconds=self.time_to_stop_default)
+
+    def start_trace(self):
+        """Start a new lifecycle trace, run whenever the pod is set to REQUESTED."""
+        self.trace_id = new_trace_id()
+        return self.trace_id
+
+    def get_timeline(self):
+        """
+        Timeline with the duration (sec) each status lasted. The current status has no end, so its
+        duration is time since it was entered.
+        """
+        timeline = []
+        for idx, transition in enumerate(self.timeline):
+            start = datetime.fromisoformat(transition['ts'])
+            if idx + 1 < len(self.timeline):
+                end = datetime.fromisoformat(self.timeline[idx + 1]['ts'])
+            else:
+                end = datetime.utcnow()
+            timeline.append({**transition, "duration": round((end - start).total_seconds(), 3)})
+        return timeline
+
     def display(self):
-        display = self.dict()
-        display.pop('logs')
-        display.pop('k8_name')
-        display.pop('tenant_id')
-        display.pop('permissions')
-        display.pop('site_id')
-        display.pop('data_attached')
-        display.pop('roles_inherited')
+        display = self.dict(exclude=self.DISPLAY_EXCLUDE)
         display['action_logs'] = display['action_logs'][-10:]
         return display
 
+    @classmethod
+    def column_expression(cls, name):
+        # Only the last 10 action_logs are displayed, so only those are loaded in projections.
+        if name == "action_logs":
+            length = func.cardinality(cls.action_logs)
+            return cls.action_logs[func.greatest(length - 9, 1):length]
+        return super().column_expression(name)
+
     @classmethod
     def db_get_all_with_permission(cls, user, level, tenant, site):
         """
@@ -438,17 +509,8 @@ class Pod(TapisPodBaseFull, table=True, validate=True):
         table_name = cls.table_name()
         logger.info(f'Top of {table_name}.db_get_all_with_permissions() for tenant.site: {tenant}.{site}')
 
-        # Get list of level specified + levels above.
-        authorized_levels = PermissionLevel(level).authorized_levels()
-
-        # Create list of permissions user needs to access this resource
-        # In the case of level=USER, USER and ADMIN work, so: ["cgarcia:ADMIN", "cgarcia:USER"]
-        permission_list = []
-        for authed_level in authorized_levels:
-            permission_list.append(f"{user}:{authed_level}")
-
-        # Create statement
-        stmt = select(Pod).where(Pod.permissions.overlap(permission_list))
+        # Create statement, permissions are looked up in object_permission by user.
+        stmt = select(Pod).where(Pod.permission_filter(user, level))
 
         # Run command
         results = store.run("execute", stmt, scalars=True, all=True)
@@ -482,6 +544,21 @@ class UpdatePod(TapisApiModel):
     resources: Optional[Resources] = Field({}, description = 'Pod resource management {"cpu_limit": 3000, "mem_limit": 3000, "cpu_request": 500, "mem_limit": 500, "gpu": 0}', sa_column=Column(JSON))
 
 
+class BulkPodAction(TapisApiModel):
+    """
+    Object with fields that users are allowed to specify for bulk pod actions.
+    """
+    # Required
+    pod_ids: List[str] = Field(..., description = "pod_ids to run the action on.", min_items=1, max_items=1000)
+    action: Literal["start", "stop", "restart"] = Field(..., description = "Action to run on every pod, `start`, `stop`, or `restart`.")
+
+
+class BulkPodResultModel(TapisApiModel):
+    pod_id: str = Field(..., description = "Name of this pod.")
+    success: bool = Field(..., description = "Whether the action was applied to this pod.")
+    message: str = Field("", description = "Result or reason the action wasn't applied.")
+
+
 class PodResponseModel(PodBaseRead):
     """
     Response object for Pod class.
@@ -505,6 +582,14 @@ class PodsResponse(TapisApiModel):
     version: str
 
 
+class BulkPodsResponse(TapisApiModel):
+    message: str
+    metadata: Dict
+    result: List[BulkPodResultModel]
+    status: str
+    version: str
+
+
 class DeletePodResponse(TapisApiModel):
     message: str
     metadata: Dict
@@ -529,6 +614,14 @@ class PodLogsResponse(TapisApiModel):
     version: str
 
 
+class PodTimelineResponse(TapisApiModel):
+    message: str
+    metadata: Dict
+    result: TimelineModel
+    status: str
+    version: str
+
+
 class PodCredentialsResponse(TapisApiModel):
     message: str
     metadata: Dict
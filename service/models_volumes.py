@@ -5,10 +5,10 @@ from sre_constants import ANY
 from string import ascii_letters, digits
 from secrets import choice
 from datetime import datetime
-from typing import List, Dict, Literal, Any, Set, Optional
+from typing import List, Dict, Literal, Any, Set, Optional, ClassVar
 from wsgiref import validate
 from pydantic import BaseModel, Field, validator, root_validator, create_model
-from codes import PERMISSION_LEVELS, PermissionLevel
+from codes import PERMISSION_LEVELS
 
 from stores import pg_store
 from tapisservice.tapisfastapi.utils import g
@@ -54,6 +54,9 @@ TapisVolumeBaseFull = create_model("TapisVolumeBaseFull", __base__= type("_Combo
 
 
 class Volume(TapisVolumeBaseFull, table=True, validate=True):
+    # Internal fields left out of display() and list projections.
+    DISPLAY_EXCLUDE: ClassVar[Set[str]] = {'logs', 'k8_name', 'tenant_id', 'permissions', 'site_id'}
+
     @validator('volume_id')
     def check_volume_id(cls, v):
         # In case we want to add reserved keywords.
@@ -115,12 +118,7 @@ class Volume(TapisVolumeBaseFull, table=True, validate=True):
         return values
 
     def display(self):
-        display = self.dict()
-        display.pop('logs')
-        display.pop('k8_name')
-        display.pop('tenant_id')
-        display.pop('permissions')
-        display.pop('site_id')
+        display = self.dict(exclude=self.DISPLAY_EXCLUDE)
         return display
 
     @classmethod
@@ -132,17 +130,8 @@ class Volume(TapisVolumeBaseFull, table=True, validate=True):
         table_name = cls.table_name()
         logger.info(f'Top of {table_name}.db_get_all_with_permissions() for tenant.site: {tenant}.{site}')
 
-        # Get list of level specified + levels above.
-        authorized_levels = PermissionLevel(level).authorized_levels()
-
-        # Create list of permissions user needs to access this resource
-        # In the case of level=USER, USER and ADMIN work, so: ["cgarcia:ADMIN", "cgarcia:USER"]
-        permission_list = []
-        for authed_level in authorized_levels:
-            permission_list.append(f"{user}:{authed_level}")
-
-        # Create statement
-        stmt = select(Volume).where(Volume.permissions.overlap(permission_list))   
+        # Create statement, permissions are looked up in object_permission by user.
+        stmt = select(Volume).where(Volume.permission_filter(user, level))
 
         # Run command
         results = store.run("execute", stmt, scalars=True, all=True)
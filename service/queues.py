@@ -1,4 +1,8 @@
+import asyncio
+import atexit
 import cloudpickle
+import heapq
+import itertools
 import json
 import rabbitpy
 import threading
@@ -20,31 +24,154 @@ class ChannelClosedException(Exception):
     pass
 
 
-class RabbitConnection(object):
-    def __init__(self, retries=100):
-        RABBIT_URI = get_site_rabbitmq_uri(site())
-        self._uri = RABBIT_URI
+# Errors that mean the connection or channel went away, operations reconnect and retry once on these.
+RECONNECT_ERRORS = (rabbitpy.exceptions.ConnectionException,
+                    rabbitpy.exceptions.ConnectionResetException,
+                    rabbitpy.exceptions.ChannelClosedException,
+                    rabbitpy.exceptions.AMQPConnectionForced)
+
+
+class ConnectionManager(object):
+    """
+    One RabbitMQ connection per uri (site vhost) per process, shared by every TaskQueue.
+
+    rabbitpy channels shouldn't be shared between threads, so each thread gets its own channel on
+    the shared connection. A thread's channel is closed once the thread has finished, the next time
+    any thread opens a channel. The connection stays open for the life of the process, so queue
+    operations don't pay connection setup and no TaskQueue.close() closes it for everyone else;
+    it's closed at process exit. That's also why it isn't reference counted, closing it when the last
+    TaskQueue lets go would only reopen it on the next request. Heartbeats are set on the uri and a
+    dropped connection is reopened the next time a channel is needed.
+    """
+    _managers = {}
+    _managers_lock = threading.Lock()
+
+    def __init__(self, uri, retries=100):
+        self._uri = self._with_heartbeat(uri)
+        self._retries = retries
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._conn = None
+        # Bumped on every reconnect so threads know their channel belongs to an old connection.
+        self._generation = 0
+        # {thread: channel}, so channels of finished threads can be closed.
+        self._channels = {}
+
+    @classmethod
+    def get(cls, uri, retries=100):
+        """Get the process's manager for this uri."""
+        with cls._managers_lock:
+            if uri not in cls._managers:
+                cls._managers[uri] = cls(uri, retries)
+            return cls._managers[uri]
+
+    @classmethod
+    def close_all(cls):
+        with cls._managers_lock:
+            for manager in cls._managers.values():
+                manager.close()
+
+    @staticmethod
+    def _with_heartbeat(uri):
+        if "heartbeat=" in uri:
+            return uri
+        separator = "&" if "?" in uri else "?"
+        return f"{uri}{separator}heartbeat={conf.get('rabbitmq_heartbeat', 30)}"
+
+    def connection(self):
+        """Shared connection, (re)connecting if it's not open."""
+        with self._lock:
+            if self._conn is None or self._conn.closed:
+                self._conn = self._connect()
+                self._generation += 1
+            return self._conn
+
+    def _connect(self):
         tries = 0
-        connected = False
-        while tries < retries and not connected:
+        while tries < self._retries:
             try:
-                self._conn = rabbitpy.Connection(self._uri)
-                connected = True
+                return rabbitpy.Connection(self._uri)
             except RuntimeError:
-                time.sleep(0.1)
+                # Backoff, RabbitMQ is usually just not up yet.
+                time.sleep(min(0.1 * 2 ** tries, 2))
+                tries += 1
             except Exception as e:
                 logger.debug(f"SERIOUS ISSUE IN CHANNELS. e: {e} ")
                 raise
-        if not connected:
-            raise RuntimeError("Could not connect to RabbitMQ.")
-        self._ch = self._conn.channel()
-        self._ch.prefetch_count(value=1, all_channels=True)
+        raise RuntimeError("Could not connect to RabbitMQ.")
+
+    def channel(self):
+        """The calling thread's channel on the shared connection."""
+        ch = getattr(self._local, 'channel', None)
+        if ch is None or ch.closed or not getattr(self._local, 'generation', None) == self._generation:
+            ch = self.new_channel()
+            self._local.channel = ch
+            self._local.generation = self._generation
+            with self._lock:
+                self._close_finished_thread_channels()
+                self._channels[threading.current_thread()] = ch
+        return ch
+
+    def _close_finished_thread_channels(self):
+        """Close the channels of threads that have finished, nothing can use them anymore."""
+        for thread, ch in list(self._channels.items()):
+            if thread.is_alive():
+                continue
+            del self._channels[thread]
+            try:
+                if not ch.closed:
+                    ch.close()
+            except Exception as e:
+                logger.debug(f"Error closing channel of finished thread: {thread.name}. e: {e}")
+
+    def new_channel(self):
+        """A new channel on the shared connection, caller owns and closes it."""
+        ch = self.connection().channel()
+        ch.prefetch_count(value=1)
+        return ch
+
+    def reset(self):
+        """Drop the current connection, the next channel() reconnects."""
+        with self._lock:
+            try:
+                if self._conn is not None and not self._conn.closed:
+                    self._conn.close()
+            except Exception as e:
+                logger.debug(f"Error closing RabbitMQ connection during reset. e: {e}")
+            self._conn = None
+            # Closing the connection closed its channels.
+            self._channels = {}
 
     def close(self):
-        """Close this instance of the connection. """
+        self.reset()
+
+atexit.register(ConnectionManager.close_all)
+
+
+class RabbitConnection(object):
+    """
+    Handle on the process's shared connection for a site. close() leaves the shared connection open
+    for other users.
+    """
+    def __init__(self, retries=100, site_id=None):
+        # Each site has its own vhost, site_id picks it. Defaults to request/config site.
+        self._manager = ConnectionManager.get(get_site_rabbitmq_uri(site_id or site()), retries)
+        self._manager.connection()
+
+    @property
+    def _ch(self):
+        """The calling thread's channel."""
+        return self._manager.channel()
+
+    def new_channel(self):
+        return self._manager.new_channel()
+
+    def reset(self):
+        self._manager.reset()
 
-        self._ch.close()
-        self._conn.close()
+    def close(self):
+        """Nothing to release, the shared connection stays open for the process's other users."""
+        pass
 
     def __enter__(self):
         return self
@@ -53,35 +180,197 @@ class RabbitConnection(object):
         del exc_type, exc_val, exc_tb
         self.close()
 
-# rconn = RabbitConnection()
+class RabbitMQBackend(object):
+    """
+    Queue backend using RabbitMQ, through the process's shared connection for the site.
+    Channels are per thread, so a TaskQueue made in one thread can be used from another (spawner consumers).
+    """
+    def __init__(self, site_id=None):
+        self.conn = RabbitConnection(site_id=site_id)
+        self._local = threading.local()
+
+    def _queue(self, name):
+        """rabbitpy.Queue on the calling thread's channel."""
+        ch = self.conn._ch
+        queues = getattr(self._local, 'queues', None)
+        if queues is None or not self._local.channel is ch:
+            queues = self._local.queues = {}
+            self._local.channel = ch
+        if name not in queues:
+            queues[name] = rabbitpy.Queue(ch, name=name, durable=True)
+        return queues[name]
+
+    def _with_reconnect(self, name, fn):
+        """Run fn, if the connection dropped reconnect and run it once more."""
+        try:
+            return fn()
+        except RECONNECT_ERRORS as e:
+            logger.warning(f"RabbitMQ connection lost on queue {name}, reconnecting. e: {e}")
+            self.conn.reset()
+            return fn()
 
-class LegacyQueue(object):
+    def declare(self, name, arguments=None):
+        rabbitpy.Queue(self.conn._ch, name=name, durable=True, arguments=arguments).declare()
+
+    def publish(self, name, body, properties):
+        self._with_reconnect(name, lambda: rabbitpy.Message(self.conn._ch, body, properties).publish('', name))
+
+    def publish_many(self, name, bodies, properties):
+        self._with_reconnect(name, lambda: self._publish_tx(name, bodies, properties))
+
+    def _publish_tx(self, name, bodies, properties):
+        # Transactions stick to a channel, so use a separate one and leave the thread's channel alone.
+        ch = self.conn.new_channel()
+        try:
+            tx = rabbitpy.Tx(ch)
+            tx.select()
+            try:
+                for body in bodies:
+                    rabbitpy.Message(ch, body, dict(properties)).publish('', name)
+                tx.commit()
+            except Exception:
+                tx.rollback()
+                raise
+        finally:
+            ch.close()
+
+    def get(self, name):
+        """Blocks until a message is available. Returns rabbitpy.Message, caller acks."""
+        def _get():
+            for msg in self._queue(name).consume(prefetch=1):
+                return msg
+        return self._with_reconnect(name, _get)
+
+    def delete(self, name):
+        self._queue(name).delete()
+
+    def close(self):
+        self.conn.close()
+
+
+class InProcessMessage(object):
+    """Message from the in-process backend, same body/properties/ack() interface as rabbitpy.Message."""
+    def __init__(self, broker, queue_name, body, properties):
+        self._broker = broker
+        self._queue_name = queue_name
+        self.body = body
+        self.properties = properties
+
+    def ack(self):
+        pass
+
+    def nack(self, requeue=True):
+        if requeue:
+            self._broker.publish(self._queue_name, self.body, self.properties)
+
+
+class InProcessBroker(object):
     """
-    This class is here to support existing code that expects an _queue object on the Various channel objects (e.g.,
-    ActorMsgChannel object). Client code that makes use of the _queue._queue
+    Thread-safe in-memory broker shared by everything in the process. Supports the RabbitMQ
+    features TaskQueue uses: x-max-priority ordering, and x-message-ttl with dead-letter routing
+    (delay queues). Publishing never blocks on consumers, so it's safe from asyncio handlers.
+    Messages are lost when the process exits.
     """
-    pass
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queues = {} # {name: {"arguments": {}, "heap": [(-priority, seq, msg)]}}
+        self._seq = itertools.count()
+
+    def declare(self, name, arguments=None):
+        with self._cond:
+            self._queues.setdefault(name, {"arguments": arguments or {}, "heap": []})
+
+    def publish(self, name, body, properties):
+        self.publish_many(name, [body], properties)
+
+    def publish_many(self, name, bodies, properties):
+        with self._cond:
+            self.declare(name)
+            queue = self._queues[name]
+            arguments = queue["arguments"]
+            for body in bodies:
+                msg = InProcessMessage(self, name, body, dict(properties))
+                if arguments.get('x-message-ttl'):
+                    # Delay queue, nobody consumes it. Move the message to its dead-letter queue on expiry.
+                    timer = threading.Timer(arguments['x-message-ttl'] / 1000, self.publish,
+                                            args=(arguments['x-dead-letter-routing-key'], body, msg.properties))
+                    timer.daemon = True
+                    timer.start()
+                    continue
+                priority = (msg.properties.get('priority') or 0) if arguments.get('x-max-priority') else 0
+                heapq.heappush(queue["heap"], (-priority, next(self._seq), msg))
+            self._cond.notify_all()
+
+    def get(self, name, timeout=None):
+        """Blocks until a message is available or timeout. Returns InProcessMessage or None on timeout."""
+        with self._cond:
+            self.declare(name)
+            heap = self._queues[name]["heap"]
+            if not self._cond.wait_for(lambda: heap, timeout=timeout):
+                return None
+            return heapq.heappop(heap)[2]
+
+    def delete(self, name):
+        with self._cond:
+            self._queues.pop(name, None)
+
+    def qsize(self, name):
+        with self._cond:
+            return len(self._queues.get(name, {}).get("heap", []))
+
+
+class InProcessBackend(object):
+    """
+    Queue backend for single-node deployments and benchmarks without a broker. Producers and
+    consumers must be in the same process, see conf.in_process_components to run the spawner
+    and health in the api process.
+    """
+    broker = InProcessBroker()
+
+    def __init__(self, site_id=None):
+        # Queue names are already unique per site.
+        pass
+
+    def declare(self, name, arguments=None):
+        self.broker.declare(name, arguments)
+
+    def publish(self, name, body, properties):
+        self.broker.publish(name, body, properties)
+
+    def publish_many(self, name, bodies, properties):
+        self.broker.publish_many(name, bodies, properties)
+
+    def get(self, name):
+        return self.broker.get(name)
+
+    def delete(self, name):
+        self.broker.delete(name)
+
+    def close(self):
+        pass
+
+
+QUEUE_BACKENDS = {"rabbitmq": RabbitMQBackend,
+                  "inprocess": InProcessBackend}
+
+def get_queue_backend(site_id=None):
+    """Queue backend from conf.queue_backend, `rabbitmq` (default) or `inprocess`."""
+    backend_name = conf.get('queue_backend', 'rabbitmq')
+    if backend_name not in QUEUE_BACKENDS:
+        raise KeyError(f"queue_backend must be one of {list(QUEUE_BACKENDS)}, got: {backend_name}")
+    return QUEUE_BACKENDS[backend_name](site_id=site_id)
 
 
 class TaskQueue(object):
-    def __init__(self, name=None):
-        # reuse the singleton rconn
-        # self.conn = rconn
-        # NOTE -
-        # reusing the singleton creates the issue that, once closed, it cannot be used further. in order for the
-        # singleton pattern to work, we would need fof individual functions to not call close() directly, but rather
-        # have an automated way at the end of each process/thread execution to close the connection.
-
-        # create a new RabbitConnection for this instance of the task queue.
-        self.conn = RabbitConnection()
-        self._ch = self.conn._ch
+    def __init__(self, name=None, max_priority=None, site_id=None):
+        # conf.queue_backend picks RabbitMQ or the in-process broker.
+        self.backend = get_queue_backend(site_id=site_id)
         self.name = name
-        self.queue = rabbitpy.Queue(self._ch, name=name, durable=True)
-        self.queue.declare()
-        # the following added for backwards compatibility so that client code using the ch._queue._queue attribute
-        # will continue to work.
-        self._queue = LegacyQueue()
-        self._queue._queue = self.queue
+        # Priority queues must be declared with x-max-priority, messages then use the priority property.
+        # Note: RabbitMQ won't redeclare an existing queue with different arguments.
+        arguments = {'x-max-priority': max_priority} if max_priority else None
+        self.backend.declare(name, arguments)
+        self._closed = False
 
     @staticmethod
     def _pre_process(msg):
@@ -99,29 +388,49 @@ class TaskQueue(object):
         """
         return msg
 
-    def put(self, m):
-        msg = rabbitpy.Message(self.conn._ch, self._pre_process(m), {})
-        msg.publish('', self.name)
+    @staticmethod
+    def _properties(priority=None, content_type=None):
+        properties = {}
+        if priority is not None:
+            properties['priority'] = priority
+        if content_type:
+            properties['content_type'] = content_type
+        return properties
 
-    # def close(self):
-    #     self.conn.close()
+    def put(self, m, priority=None, content_type=None, routing_key=None):
+        """Publish m to this queue, or to routing_key (another queue name) if given."""
+        self.backend.publish(routing_key or self.name, self._pre_process(m), self._properties(priority, content_type))
 
-    def close(self):
-        def _close(this):
-            this.conn.close()
+    def put_many(self, ms, priority=None, content_type=None):
+        """
+        Publish every message in ms as one batch. With RabbitMQ it's one transaction, so the batch is
+        confirmed with one round trip and either all messages are queued or none are.
+        """
+        bodies = [self._pre_process(m) for m in ms]
+        self.backend.publish_many(self.name, bodies, self._properties(priority, content_type))
+
+    def declare(self, name, arguments=None):
+        """Declare another queue (delay/dead-letter queues) on this queue's backend."""
+        self.backend.declare(name, arguments)
 
-        t = threading.Thread(target=_close, args=(self,))
-        t.start()
+    def close(self):
+        # Only releases our handle on the shared connection, so it's cheap.
+        self._closed = True
+        self.backend.close()
 
     def delete(self):
-        self.queue.delete()
+        self.backend.delete(self.name)
 
     def get_one(self):
         """Blocking method to get a single message without polling."""
-        if self._queue is None:
+        if self._closed:
             raise ChannelClosedException()
-        for msg in self.queue.consume(prefetch=1):
-            return self._post_process(msg), msg
+        msg = self.backend.get(self.name)
+        return self._post_process(msg), msg
+
+    async def get_one_async(self):
+        """get_one for asyncio code, blocks a worker thread instead of the event loop."""
+        return await asyncio.to_thread(self.get_one)
 
 
 class JsonTaskQueue(TaskQueue):
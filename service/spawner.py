@@ -1,16 +1,27 @@
+import heapq
+import itertools
 import json
 import os
+import threading
 import time
 
 import rabbitpy
+import socket
+import urllib3
 from concurrent.futures import ThreadPoolExecutor
-from codes import ERROR, SPAWNER_SETUP, CREATING, REQUESTED, DELETING, ON
-from health import graceful_rm_pod, graceful_rm_volume
+from datetime import datetime
+from codes import ERROR, SPAWNER_SETUP, CREATING, REQUESTED, DELETING, ON, AVAILABLE, PRIORITY_CREATE
+from health import graceful_rm_pod, graceful_rm_volume, rm_pod
 from models_pods import Pod, Password
 from models_volumes import Volume
-from channels import CommandChannel
+from channels import CommandChannel, get_host_queues, queue_site
 from kubernetes_templates import start_generic_pod, start_neo4j_pod, start_postgres_pod
-from kubernetes_utils import create_pvc
+from kubernetes import client
+from kubernetes_utils import create_pvc, wait_for_container_ready, KubernetesStartContainerError
+from volume_utils import NFSDiscoveryError
+from metrics import metrics
+from stores import start_warmup
+from tracing import parse_traceparent
 from tapisservice.config import conf
 from tapisservice.logs import get_logger
 from tapisservice.errors import BaseTapisError
@@ -21,21 +32,153 @@ class SpawnerException(BaseTapisError):
     """Error with spawner."""
     pass
 
+# Kubernetes API statuses worth retrying. 409 isn't one, see is_already_exists_error.
+TRANSIENT_K8_STATUSES = [429, 500, 502, 503, 504]
+
+def is_already_exists_error(e: Exception) -> bool:
+    """
+    409 Conflict from the k8 API, the pod is already there. Either another command for this pod got there
+    first or the previous instance is still terminating. Walks the exception chain like is_transient_spawn_error.
+    """
+    while e is not None:
+        if isinstance(e, client.ApiException):
+            return e.status == 409
+        e = e.__cause__ or e.__context__
+    return False
+
+def is_transient_spawn_error(e: Exception) -> bool:
+    """
+    Classify an error from starting a pod. Transient errors (k8 API throttling or 5xx, connection
+    problems, nfs discovery timeouts) are retried with backoff, anything else is permanent.
+    Walks the exception chain since kubernetes_utils wraps k8 errors in KubernetesError.
+    """
+    while e is not None:
+        if isinstance(e, KubernetesStartContainerError):
+            return False
+        if isinstance(e, client.ApiException):
+            return e.status in TRANSIENT_K8_STATUSES
+        if isinstance(e, (NFSDiscoveryError, urllib3.exceptions.HTTPError, ConnectionError, TimeoutError, socket.timeout)):
+            return True
+        e = e.__cause__ or e.__context__
+    return False
+
+def retry_delay(attempt: int) -> int:
+    """Exponential backoff, seconds to wait before retry number `attempt` (1 based)."""
+    return min(conf.spawner_retry_base_delay * 2 ** (attempt - 1), conf.spawner_retry_max_delay)
+
+# Watches on newly created pods. Threads mostly sit on a k8 watch stream, so this is sized separately from spawner_workers.
+readiness_executor = ThreadPoolExecutor(conf.spawner_readiness_workers)
+
+class FairShareScheduler(object):
+    """
+    Local buffer between the command channel and the spawner worker threads.
+
+    Commands are dispatched by priority first (codes.PRIORITY_X). Within a priority level tenants are
+    served by weighted fair queueing: each tenant has a virtual time that grows by 1/weight per
+    dispatched command and the tenant with the lowest virtual time goes next. One tenant creating
+    hundreds of pods then only gets its share of workers instead of blocking everyone else.
+
+    The buffer is bounded so commands we can't work on yet stay in RabbitMQ, where the priority
+    queue keeps ordering them.
+    """
+    def __init__(self, weights: dict | None = None, max_buffered: int = 12):
+        self.weights = weights or {}
+        self.max_buffered = max_buffered
+        self._tenant_queues = {} # {tenant_id: heap of (-priority, seq, cmd)}
+        self._virtual_time = {} # {tenant_id: float}
+        self._seq = itertools.count()
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def wait_for_capacity(self):
+        """Blocks until there is room in the buffer."""
+        with self._cond:
+            while self._size >= self.max_buffered:
+                self._cond.wait()
+
+    def put(self, cmd):
+        tenant_id = cmd.get('tenant_id')
+        priority = cmd.get('priority', PRIORITY_CREATE)
+        with self._cond:
+            queue = self._tenant_queues.setdefault(tenant_id, [])
+            if not queue:
+                # A tenant becoming active starts at the lowest active virtual time, idle time isn't banked as credit.
+                active_times = [self._virtual_time[tenant] for tenant, q in self._tenant_queues.items() if q]
+                self._virtual_time[tenant_id] = max(self._virtual_time.get(tenant_id, 0.0), min(active_times, default=0.0))
+            heapq.heappush(queue, (-priority, next(self._seq), cmd))
+            self._size += 1
+            self._cond.notify_all()
+
+    def get(self):
+        """Blocks until a command is available, returns the next command to process."""
+        with self._cond:
+            while not self._size:
+                self._cond.wait()
+            top_priority = min(q[0][0] for q in self._tenant_queues.values() if q)
+            candidates = [tenant for tenant, q in self._tenant_queues.items() if q and q[0][0] == top_priority]
+            tenant_id = min(candidates, key=lambda tenant: self._virtual_time[tenant])
+            _, _, cmd = heapq.heappop(self._tenant_queues[tenant_id])
+            self._virtual_time[tenant_id] += 1 / self.weights.get(tenant_id, 1)
+            self._size -= 1
+            self._cond.notify_all()
+
+        # Time between the API/health putting the command and a worker picking it up.
+        enqueue_ts = cmd.get('enqueue_ts')
+        if enqueue_ts:
+            metrics.histogram("spawner_queue_wait_seconds", tenant=tenant_id).observe(time.time() - enqueue_ts)
+        return cmd
+
+
 class Spawner(object):
     def __init__(self):
-        self.queue = os.environ.get('queue', 'tacc') # Which site is being worked on by this spawner.
-        self.cmd_ch = CommandChannel(name=self.queue)
+        # Which queues are worked on by this spawner. Comma separated `queues` env var, else the legacy `queue`
+        # env var, else every queue for this site in conf.spawner_host_queues.
+        # Several spawner replicas can consume the same queue, RabbitMQ hands each command to one of them.
+        queues = os.environ.get('queues') or os.environ.get('queue')
+        if queues:
+            self.queues = [queue.strip() for queue in queues.split(',') if queue.strip()]
+        else:
+            self.queues = [queue for queue in get_host_queues() if queue_site(queue) == conf.site_id]
+        # Channels are created here so connection errors surface in main()'s retry loop.
+        self.cmd_chs = {queue: CommandChannel(name=queue) for queue in self.queues}
         self.host_id = conf.spawner_host_id
+        self.scheduler = FairShareScheduler(weights=conf.spawner_tenant_weights,
+                                            max_buffered=conf.spawner_buffer_size)
 
     def run(self):
-        executor = ThreadPoolExecutor(6) # 6 threads, meaning 6 spawning processes at once.
+        # spawner_workers threads, meaning that many spawning processes at once.
+        for idx in range(conf.spawner_workers):
+            threading.Thread(target=self.work, name=f"spawner-worker-{idx}", daemon=True).start()
+        # One consumer thread per queue, all feeding the same scheduler.
+        consumers = []
+        for queue, cmd_ch in self.cmd_chs.items():
+            consumer = threading.Thread(target=self.consume, args=(cmd_ch,), name=f"spawner-consumer-{queue}", daemon=True)
+            consumer.start()
+            consumers.append(consumer)
+        logger.info(f"Spawner consuming from queues: {self.queues}")
+        while all(consumer.is_alive() for consumer in consumers):
+            time.sleep(5)
+            metrics.log_summary()
+        raise RuntimeError("Spawner consumer thread exited, lost connection to a command channel.")
+
+    def consume(self, cmd_ch):
+        """Consumer thread loop. Moves commands from a command channel to the scheduler."""
         while True:
-            cmd, msg_obj = self.cmd_ch.get_one()
+            # Only take commands off the channel when we have room, the rest wait in the priority queue.
+            self.scheduler.wait_for_capacity()
+            cmd, msg_obj = cmd_ch.get_one()
             # directly ack the messages from the command channel; problems generated from starting pods are
             # handled downstream; e.g., by setting the pod to an ERROR state; command messages should not be re-queued
             msg_obj.ack()
+            metrics.counter("spawner_commands_received", queue=cmd_ch.name).inc()
+            self.scheduler.put(cmd)
+
+    def work(self):
+        """Worker thread loop. Takes the next command from the scheduler and processes it."""
+        while True:
+            cmd = self.scheduler.get()
             try:
-                executor.submit(self.process, cmd)
+                self.process(cmd)
             except Exception as e:
                 logger.error(f"Spawner got an exception trying to process cmd: {cmd}. "
                              f"Exception type: {type(e).__name__}. Exception: {e}")
@@ -47,16 +190,18 @@ class Spawner(object):
         object_type = cmd["object_type"]
         tenant_id = cmd["tenant_id"]
         site_id = cmd["site_id"]
+        trace_id, parent_span_id = parse_traceparent(cmd.get("traceparent"))
+        logger.info(f"spawner processing {object_type} {object_id}; trace_id: {trace_id}; parent_span_id: {parent_span_id}")
 
         match object_type:
             case "pod":
-                spawn_pod(object_id, tenant_id, site_id)
+                spawn_pod(object_id, tenant_id, site_id, requested_ts=cmd.get("enqueue_ts"), trace_id=trace_id, cmd=cmd)
             case "volume":
                 spawn_pvc(object_id, tenant_id, site_id)
             case _:
                 logger.critical(f"Got spawner message with object_type not in 'pod' or 'volume'. Got: {object_type}")
 
-def spawn_pod(pod_id, tenant_id, site_id):
+def spawn_pod(pod_id, tenant_id, site_id, requested_ts=None, trace_id=None, cmd=None):
     # Get pod while in spawner. Expect REQUESTED. If status_requested = OFF then request was started while waiting
     # for command to startup in queue. In that case, we simply abort and wait for health to delete pod.
     try:
@@ -76,6 +221,16 @@ def spawn_pod(pod_id, tenant_id, site_id):
         logger.debug(f"Spawner found pod not requesting ON as expected. status_requested: {status_requested}. Returning and ignoring command.")
         return
 
+    # Commands from before tracing don't have a trace_id. Otherwise it should match the pod's current lifecycle.
+    if trace_id and not trace_id == pod.trace_id:
+        # A delayed retry from an earlier lifecycle, the pod was requested again since (e.g. health restarted it).
+        # The new lifecycle's own command starts it, running this one too could delete that command's pod.
+        if (cmd or {}).get('attempt'):
+            logger.warning(f"Spawner got retry with trace_id: {trace_id} but pod_id: {pod_id} is on trace_id: {pod.trace_id}. Ignoring stale retry.")
+            metrics.counter("spawner_stale_retries").inc()
+            return
+        logger.warning(f"Spawner got command with trace_id: {trace_id} but pod_id: {pod_id} is on trace_id: {pod.trace_id}. Continuing.")
+
     # Pod status was REQUESTED and status_requested was ON; moving on to SPAWNER_SETUP ----
     pod.status = SPAWNER_SETUP
     pod.db_update() # f"spawner set status to SPAWNER_SETUP", doesn't need to be said with CREATING so soon.
@@ -93,15 +248,91 @@ def spawn_pod(pod_id, tenant_id, site_id):
             graceful_rm_pod(pod, f"spawner found no matching pod template, set status to DELETING")
             return
     except Exception as e:
-        logger.critical(f"Got error when creating pod. Running graceful_rm_pod. e: {e}")
-        graceful_rm_pod(pod, f"spawner got error when creating pod, set status to DELETING")
-        return
+        if not is_already_exists_error(e):
+            handle_spawn_error(pod, e, cmd or {})
+            return
+        # Never delete on a conflict, the existing k8 pod may be another command's live pod. Track it like one
+        # we created, if it was a terminating instance it never gets ready and health restarts the pod.
+        logger.warning(f"Pod already exists in kubernetes for pod_id: {pod_id}, tracking it instead of recreating. e: {e}")
+        metrics.counter("spawner_spawn_errors", kind="already_exists").inc()
 
     # If we get to this point we can update pod status
     pod.status = CREATING
     pod.db_update(f"spawner set status to CREATING")
     logger.debug(f"spawner has updated pod status to CREATING")
 
+    # Watch the new pod so it goes AVAILABLE as soon as it's running instead of waiting for the next health cycle.
+    readiness_executor.submit(track_readiness, pod_id, tenant_id, site_id, pod.k8_name, requested_ts)
+
+def handle_spawn_error(pod, e, cmd):
+    """
+    Transient errors put the command on a delay queue to retry with backoff, pod goes back to REQUESTED.
+    Permanent errors, or running out of retries, put the command on the dead-letter queue and set the
+    pod to ERROR with the error in status_container.
+    """
+    attempt = cmd.get('attempt', 0) + 1
+    transient = is_transient_spawn_error(e)
+    metrics.counter("spawner_spawn_errors", kind="transient" if transient else "permanent").inc()
+
+    # Clean up anything that was partially created (pod without service, etc.).
+    rm_pod(pod.k8_name)
+
+    ch = CommandChannel.for_object(site_id=pod.site_id, object_type="pod")
+    try:
+        if transient and attempt <= conf.spawner_max_retries:
+            delay = retry_delay(attempt)
+            logger.warning(f"Transient error creating pod_id: {pod.pod_id}. Retry {attempt} of {conf.spawner_max_retries} in {delay}s. e: {e}")
+            # Health gives REQUESTED pods a grace period based on this log, so it has to mention REQUESTED.
+            pod.status = REQUESTED
+            pod.db_update(f"spawner got transient error, retry {attempt} of {conf.spawner_max_retries} in {delay}s, set status to REQUESTED")
+            ch.put_retry({**cmd, 'attempt': attempt}, delay)
+            metrics.counter("spawner_spawn_retries", attempt=attempt).inc()
+            return
+
+        reason = f"retries exhausted after {attempt - 1} retries" if transient else "permanent error"
+        logger.critical(f"Got error when creating pod_id: {pod.pod_id}, {reason}. Setting ERROR. e: {e}")
+        pod.status = ERROR
+        pod.status_container = {"message": f"Error creating pod, {reason}: {e}"}
+        pod.db_update(f"spawner got error when creating pod ({reason}), set status to ERROR")
+        ch.put_dead(cmd, str(e))
+        metrics.counter("spawner_spawn_dead_lettered", reason="retries_exhausted" if transient else "permanent").inc()
+    finally:
+        ch.close()
+
+def track_readiness(pod_id, tenant_id, site_id, k8_name, requested_ts=None):
+    """
+    Watch a pod the spawner just created until it's running or fails. When running, write AVAILABLE,
+    start_instance_ts and time_to_stop_ts directly. Failures and timeouts are left to health, which
+    remains the backstop for everything here.
+    """
+    try:
+        result, k8_pod = wait_for_container_ready(k8_name, timeout=conf.spawner_readiness_timeout)
+    except Exception as e:
+        logger.warning(f"Spawner readiness watch failed for pod_id: {pod_id}. Leaving it to health. e: {e}")
+        return
+    metrics.counter("spawner_readiness_results", result=result).inc()
+    if not result == "running":
+        logger.debug(f"Spawner readiness watch for pod_id: {pod_id} ended with {result}. Leaving it to health.")
+        return
+
+    # Pod could have been changed while we watched (stopped, or already marked by health), so get it fresh.
+    pod = Pod.db_get_with_pk(pod_id, tenant=tenant_id, site=site_id)
+    if not pod or not pod.status == CREATING or not pod.status_requested == ON:
+        return
+
+    # Same status_container health writes, so health doesn't see a change afterwards.
+    pod.status_container = {"phase": k8_pod.status.phase,
+                            "start_time": k8_pod.status.start_time.isoformat().replace('+00:00', '.000000'),
+                            "message": "Pod is running."}
+    pod.start_instance_ts = datetime.utcnow()
+    pod.status = AVAILABLE
+    pod.set_time_to_stop_ts()
+    pod.db_update(f"spawner found pod running, set status to AVAILABLE")
+    logger.debug(f"spawner has updated pod status to AVAILABLE")
+
+    if requested_ts:
+        metrics.histogram("pod_requested_to_available_seconds", tenant=tenant_id).observe(time.time() - requested_ts)
+
 def spawn_pvc(volume_id, tenant_id, site_id):
     # Get spawn_pvc while in spawner. Expect REQUESTED. If status_requested = OFF then request was started while waiting
     # for command to startup in queue. In that case, we simply abort and wait for health to delete pod.
@@ -156,4 +387,5 @@ def main():
     logger.critical("spawner could not connect to rabbitMQ. Shutting down!")
 
 if __name__ == '__main__':
+    start_warmup()
     main()
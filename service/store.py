@@ -8,9 +8,13 @@ from typing import Literal, Any, Dict, List
 from enum import Enum
 from psycopg2.errors import UniqueViolation, DatabaseError
 
+import contextvars
+import copy
+import inspect
 import re
 import json
 import os
+import time
 import urllib.parse
 
 import pprint
@@ -18,12 +22,15 @@ import pprint
 from tapisservice.errors import DAOError
 from tapisservice.config import conf
 from tapisservice.logs import get_logger
+from metrics import metrics
 logger = get_logger(__name__)
 
 from fastapi.encoders import jsonable_encoder
 
 from sqlmodel import create_engine, Session, select
+from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 
 def custom_serializer(d):
     """https://github.com/tiangolo/sqlmodel/issues/63
@@ -38,9 +45,42 @@ def custom_serializer(d):
     # changed from github issue's `v.json()` to `v.dict()` for dicts to work properly.
     return json.dumps(d, default=lambda v: v.dict())
 
+# Set per request by ReadReplicaMiddleware, only read-only api requests (GET/HEAD) may read from a replica.
+# Spawner and health never set it, they always read from the primary.
+replica_reads = contextvars.ContextVar("replica_reads", default=False)
+
+# Set per api request by RequestObjectsMiddleware, {(table, tenant, site, pk_id): object}. Objects loaded by
+# primary key (auth.py's permission checks) are reused by the request's handler instead of read again.
+# None outside of api requests, spawner and health always read from the db.
+request_objects = contextvars.ContextVar("request_objects", default=None)
+
+# {(dbname, schema): time.monotonic() of this process' last write}. Shared by all stores for read-your-writes.
+LAST_WRITES = {}
+
+# Seconds the replica is behind, 0 when it has replayed everything it received.
+REPLICA_LAG_QUERY = text("SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                         "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END")
+
+
+def pool_kwargs():
+    return {"pool_size": conf.get('postgres_pool_size', 5),
+            "max_overflow": conf.get('postgres_max_overflow', 10),
+            "pool_recycle": conf.get('postgres_pool_recycle', 1800),
+            "pool_pre_ping": conf.get('postgres_pool_pre_ping', True)}
+
+
 class PostgresStore():
     """
     Postgres Store object
+
+    One store (engine and connection pool) per database. Tenants are schemas in their site's
+    database, use for_schema() to get a view of the store that runs everything in a tenant's schema
+    through schema_translate_map. Views share the engine, so connections don't grow with tenants.
+
+    With replica_host, read-only statements from read-only api requests go to the replica unless this
+    process wrote to the schema within postgres_read_your_writes_window seconds or the replica is more
+    than postgres_replica_max_lag seconds behind. Routing decisions are counted in the
+    `postgres_statements` metric by route and reason.
     """
     @validate_arguments
     def __init__(self,
@@ -50,6 +90,7 @@ class PostgresStore():
                  dbname: str | None = None,
                  dbschema: str | None = None,
                  port: int | None = None, # not currently used
+                 replica_host: str | None = None,
                  kwargs: dict[str, str] = {}):
         
         logger.info(f"Top of PostgresStore.__init__().")
@@ -73,10 +114,105 @@ class PostgresStore():
         logger.info(f"Using conninfo: {conninfo}, with kwargs: {kwargs}")
 
         # We create SQLAlchemy objects using future=True to get ready for SA:2.0 (we follow that style)
-        self.engine = create_engine(conninfo, future=True, json_serializer=custom_serializer)
+        self.engine = create_engine(conninfo,
+                                    future=True,
+                                    json_serializer=custom_serializer,
+                                    **pool_kwargs())
         # expire_on_commit is more of a opinion than something bad according to docs.
         # I believe it's good to keep information. Session.begin flushes.
         self.session = sessionmaker(self.engine, future=True, expire_on_commit=False)
+        # Schema unqualified tables are rendered in, set on views from for_schema().
+        self.schema = None
+
+        self.dbname = dbname
+        self.replica_engine = None
+        self.replica_session = None
+        if replica_host:
+            logger.info(f"Routing read-only statements for db: {dbname} to replica: {replica_host}")
+            self.replica_engine = create_engine(conninfo.replace(f"@{host}", f"@{replica_host}", 1),
+                                                future=True,
+                                                json_serializer=custom_serializer,
+                                                **pool_kwargs())
+            self.replica_session = sessionmaker(self.replica_engine, future=True, expire_on_commit=False)
+        # Last replica lag check, shared with views.
+        self._replica_lag = {"checked_at": float('-inf'), "lag": None}
+
+    def for_schema(self, schema: str):
+        """View of this store (same engine and pool) that runs statements in schema."""
+        view = copy.copy(self)
+        view.schema = schema
+        return view
+
+    @staticmethod
+    def _is_read(fn_name, fn_input):
+        return (fn_name in ["execute", "scalar", "scalars"]
+                and getattr(fn_input, "is_select", False)
+                and getattr(fn_input, "_for_update_arg", None) is None)
+
+    def _primary_reason(self, fn_name, fn_input):
+        """
+        Why this statement has to go to the primary, None if it can go to the replica (lag permitting).
+        """
+        if not self._is_read(fn_name, fn_input):
+            return "write"
+        if not replica_reads.get():
+            return "read_write_request"
+        last_write = LAST_WRITES.get((self.dbname, self.schema), float('-inf'))
+        if time.monotonic() - last_write < conf.get('postgres_read_your_writes_window', 10):
+            return "read_your_writes"
+        return None
+
+    def _lag_check_due(self):
+        return time.monotonic() - self._replica_lag["checked_at"] >= conf.get('postgres_replica_lag_check_interval', 5)
+
+    def _set_replica_lag(self, lag):
+        self._replica_lag.update(checked_at=time.monotonic(), lag=lag)
+        if lag is not None:
+            metrics.histogram("postgres_replica_lag_seconds", db=self.dbname).observe(lag)
+
+    def _lag_reason(self):
+        lag = self._replica_lag["lag"]
+        if lag is None or lag > conf.get('postgres_replica_max_lag', 5):
+            return "replica_lag"
+        return None
+
+    def _count_route(self, reason):
+        route = "primary" if reason else "replica"
+        metrics.counter("postgres_statements", route=route, reason=reason or "read").inc()
+        return route
+
+    def _record_write(self, fn_name, fn_input):
+        if self.replica_engine and not self._is_read(fn_name, fn_input):
+            LAST_WRITES[(self.dbname, self.schema)] = time.monotonic()
+
+    def _check_replica_lag(self):
+        try:
+            with self.replica_engine.connect() as conn:
+                return float(conn.execute(REPLICA_LAG_QUERY).scalar())
+        except Exception as e:
+            logger.warning(f"Replica lag check failed for db: {self.dbname}, reading from primary. e: {repr(e)}")
+            return None
+
+    def _route(self, fn_name, fn_input):
+        """
+        Returns "replica" or "primary" for the statement.
+        """
+        if not self.replica_engine:
+            return "primary"
+        reason = self._primary_reason(fn_name, fn_input)
+        if not reason:
+            if self._lag_check_due():
+                self._set_replica_lag(self._check_replica_lag())
+            reason = self._lag_reason()
+        return self._count_route(reason)
+
+    def _execution_options(self, autocommit: bool = False):
+        execution_options = {}
+        if autocommit:
+            execution_options["isolation_level"] = "AUTOCOMMIT"
+        if self.schema:
+            execution_options["schema_translate_map"] = {None: self.schema}
+        return execution_options
 
     @validate_arguments
     def run(self,
@@ -90,9 +226,13 @@ class PostgresStore():
             scalar_one: bool = False,
             autocommit: bool = False):
 
-        with self.session.begin() as session:
-            if autocommit:
-                session.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+        route = self._route(fn_name, fn_input)
+        session_maker = self.replica_session if route == "replica" else self.session
+        with session_maker.begin() as session:
+            # Has to be set before anything else runs in the session's transaction.
+            execution_options = self._execution_options(autocommit)
+            if execution_options:
+                session.connection(execution_options=execution_options)
             try:
                 # Following line creates a lot of logs.
                 #logger.info(f"PostgresStore.fn; Command: {fn_name} - Statement/Instance: {fn_input}")
@@ -139,4 +279,166 @@ class PostgresStore():
                 e.args = [msg]
                 raise e
 
+        self._record_write(fn_name, fn_input)
+        return output
+
+    def run_many(self,
+                 fn_name: str,
+                 fn_inputs: List):
+        """
+        Runs session function fn_name on each of fn_inputs in one session and transaction.
+        All or nothing, if one fails the transaction is rolled back.
+        """
+        with self.session.begin() as session:
+            execution_options = self._execution_options()
+            if execution_options:
+                session.connection(execution_options=execution_options)
+            try:
+                fn_to_run = getattr(session, fn_name)
+                output = [fn_to_run(fn_input) for fn_input in fn_inputs]
+            except DatabaseError as e:
+                msg = f"Error accessing database: e: {repr(e)}"
+                logger.error(msg)
+                e.args = [msg]
+                raise e
+            except Exception as e:
+                msg = f"Error executing command: {fn_name} on {len(fn_inputs)} inputs - e: {repr(e)}"
+                logger.error(msg)
+                e.args = [msg]
+                raise e
+
+        if self.replica_engine:
+            LAST_WRITES[(self.dbname, self.schema)] = time.monotonic()
+        return output
+
+
+class AsyncPostgresStore(PostgresStore):
+    """
+    Async version of PostgresStore for the API's async handlers, SQLAlchemy AsyncEngine on asyncpg.
+    Queries await the database instead of blocking the event loop. Same for_schema() tenant views.
+    """
+    @validate_arguments
+    def __init__(self,
+                 username: str,
+                 password: str,
+                 host: str,
+                 dbname: str | None = None,
+                 replica_host: str | None = None):
+
+        logger.info(f"Top of AsyncPostgresStore.__init__().")
+        username = urllib.parse.quote_plus(username)
+        password = urllib.parse.quote_plus(password)
+
+        conninfo = f"postgresql+asyncpg://{username}:{password}@{host}"
+        if dbname:
+            conninfo += f"/{dbname}"
+
+        self.engine = create_async_engine(conninfo,
+                                          json_serializer=custom_serializer,
+                                          **pool_kwargs())
+        self.session = sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        self.schema = None
+
+        self.dbname = dbname
+        self.replica_engine = None
+        self.replica_session = None
+        if replica_host:
+            self.replica_engine = create_async_engine(conninfo.replace(f"@{host}", f"@{replica_host}", 1),
+                                                      json_serializer=custom_serializer,
+                                                      **pool_kwargs())
+            self.replica_session = sessionmaker(self.replica_engine, class_=AsyncSession, expire_on_commit=False)
+        self._replica_lag = {"checked_at": float('-inf'), "lag": None}
+
+    async def _check_replica_lag(self):
+        try:
+            async with self.replica_engine.connect() as conn:
+                return float((await conn.execute(REPLICA_LAG_QUERY)).scalar())
+        except Exception as e:
+            logger.warning(f"Replica lag check failed for db: {self.dbname}, reading from primary. e: {repr(e)}")
+            return None
+
+    async def _route(self, fn_name, fn_input):
+        if not self.replica_engine:
+            return "primary"
+        reason = self._primary_reason(fn_name, fn_input)
+        if not reason:
+            if self._lag_check_due():
+                self._set_replica_lag(await self._check_replica_lag())
+            reason = self._lag_reason()
+        return self._count_route(reason)
+
+    async def run(self,
+                  fn_name: str,
+                  fn_input,
+                  fn_params: Dict = {},
+                  scalars: bool = False,
+                  all: bool = False,
+                  first: bool = False,
+                  unique: bool = False,
+                  scalar_one: bool = False,
+                  autocommit: bool = False):
+
+        route = await self._route(fn_name, fn_input)
+        session_maker = self.replica_session if route == "replica" else self.session
+        async with session_maker.begin() as session:
+            # Has to be set before anything else runs in the session's transaction.
+            execution_options = self._execution_options(autocommit)
+            if execution_options:
+                await session.connection(execution_options=execution_options)
+            try:
+                # AsyncSession.add is sync, everything else we use is awaitable.
+                output = getattr(session, fn_name)(fn_input, **fn_params)
+                if inspect.isawaitable(output):
+                    output = await output
+
+                # Results from AsyncSession.execute are already buffered.
+                if unique:
+                    output = output.unique()
+                if first:
+                    output = output.first()
+                if scalars:
+                    output = output.scalars()
+                if all:
+                    output = output.all()
+                if scalar_one:
+                    output = output.scalar_one()
+
+            except AttributeError as e:
+                msg = f"Session doesn't have specified attribute. e: {e}"
+                logger.error(msg)
+                e.args = [msg]
+                raise e
+            except Exception as e:
+                msg = f"Error executing command: {fn_name} - e: {repr(e)}"
+                logger.error(msg)
+                e.args = [msg]
+                raise e
+
+        self._record_write(fn_name, fn_input)
+        return output
+
+    async def run_many(self,
+                       fn_name: str,
+                       fn_inputs: List):
+        """
+        Runs session function fn_name on each of fn_inputs in one session and transaction.
+        """
+        async with self.session.begin() as session:
+            execution_options = self._execution_options()
+            if execution_options:
+                await session.connection(execution_options=execution_options)
+            try:
+                fn_to_run = getattr(session, fn_name)
+                output = []
+                for fn_input in fn_inputs:
+                    result = fn_to_run(fn_input)
+                    output.append(await result if inspect.isawaitable(result) else result)
+            except Exception as e:
+                msg = f"Error executing command: {fn_name} on {len(fn_inputs)} inputs - e: {repr(e)}"
+                logger.error(msg)
+                e.args = [msg]
+                raise e
+
+        if self.replica_engine:
+            LAST_WRITES[(self.dbname, self.schema)] = time.monotonic()
         return output
@@ -1,7 +1,12 @@
 import os
 import time
+import threading
 import subprocess
-from store import PostgresStore
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from store import PostgresStore, AsyncPostgresStore
+from metrics import metrics
 from __init__ import t
 from tapisservice.config import conf
 from tapisservice.logs import get_logger
@@ -176,6 +181,49 @@ def role_init():
     #     t.sk.grantRole(tenant=tenant, roleName='abaco_admin', user='streams', _tapis_set_x_headers_from_service=True)
 
 
+class SiteStores(Mapping):
+    """
+    {tenant: store} for one site database, built on first access. The site's store (engine and pool)
+    is created when a tenant first asks for it and each tenant's view of it when that tenant is used,
+    so components only pay for the sites and tenants they touch.
+    Tenants are the site's tenants plus siteadmintable and defaulttables, others raise KeyError.
+    """
+    def __init__(self, site, tenants, store_cls):
+        self.site = site
+        self.tenants = tenants + ["siteadmintable", "defaulttables"]
+        self.store_cls = store_cls
+        self._site_store = None
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def site_store(self):
+        if self._site_store is None:
+            with self._lock:
+                if self._site_store is None:
+                    start = time.time()
+                    self._site_store = self.store_cls(username=conf.postgres_user,
+                                                      password=conf.postgres_pass,
+                                                      host=conf.postgres_host,
+                                                      dbname=self.site,
+                                                      replica_host=conf.get('postgres_replica_host') or None)
+                    metrics.histogram("store_init_seconds", store=self.store_cls.__name__, site=self.site).observe(time.time() - start)
+        return self._site_store
+
+    def __getitem__(self, tenant):
+        view = self._views.get(tenant)
+        if view is None:
+            if tenant not in self.tenants:
+                raise KeyError(tenant)
+            view = self._views.setdefault(tenant, self.site_store().for_schema(tenant))
+        return view
+
+    def __iter__(self):
+        return iter(self.tenants)
+
+    def __len__(self):
+        return len(self.tenants)
+
+
 def create_pg_objects():
     admin_postgres_user = conf.postgres_user
     admin_postgres_pass = conf.postgres_pass
@@ -186,27 +234,60 @@ def create_pg_objects():
                                host=conf.postgres_host,
                                dbname="postgres")
 
-    pg_store = {}
-    
-    # Now add in all of the sites and tenant pg engines.
-    for site, tenants in SITE_TENANT_DICT.items():
-        tenant_copy = tenants.copy() + ["siteadmintable", "defaulttables"]
-        for tenant in tenant_copy:
-            pg = PostgresStore(username=admin_postgres_user,
-                               password=admin_postgres_pass,
-                               host=conf.postgres_host,
-                               dbname=site,
-                               dbschema=tenant)
-            if not pg_store.get(site):
-                pg_store[site] = {}
-            pg_store[site][tenant] = pg
+    # One engine (and pool) per site database, each tenant gets a view of it routed to the tenant's schema.
+    # Both are only built when first used, see SiteStores.
+    pg_store = {site: SiteStores(site, tenants.copy(), PostgresStore) for site, tenants in SITE_TENANT_DICT.items()}
     return pg_store, pg_default
 
+
+def create_async_pg_objects():
+    """
+    Same layout as pg_store, {site: {tenant: store}}, but AsyncPostgresStores for the API's async handlers.
+    Engines connect lazily, so components that never await the db don't open connections.
+    """
+    return {site: SiteStores(site, tenants.copy(), AsyncPostgresStore) for site, tenants in SITE_TENANT_DICT.items()}
+
+
+def warmup(stores, hot_tenants):
+    """
+    Builds the stores of hot_tenants ({site: [tenant, ...]}) and opens a connection to each of their
+    site databases concurrently, so first requests don't pay for it. Failures are logged, not raised,
+    an unreachable site shouldn't stop a component that may never use it.
+    """
+    def warm_site(site, tenants):
+        start = time.time()
+        try:
+            for tenant in tenants:
+                stores[site][tenant]
+            with stores[site].site_store().engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            logger.info(f"Warmed up stores for site: {site}, tenants: {tenants} in {time.time() - start:.3f}s.")
+        except Exception as e:
+            logger.warning(f"Could not warm up stores for site: {site}. e: {repr(e)}")
+
+    with ThreadPoolExecutor(max_workers=max(len(hot_tenants), 1), thread_name_prefix="store-warmup") as executor:
+        for site, tenants in hot_tenants.items():
+            executor.submit(warm_site, site, tenants)
+
+
+def start_warmup():
+    """
+    Background warmup of conf.postgres_warmup_tenants for this site, "*" for all of them.
+    Called by the api and spawner at startup, importing stores (tests, alembic, scripts) doesn't connect.
+    """
+    site_tenants = SITE_TENANT_DICT.get(conf.site_id, [])
+    wanted = conf.get('postgres_warmup_tenants') or []
+    tenants = site_tenants if "*" in wanted else [tenant for tenant in wanted if tenant in site_tenants]
+    if not tenants:
+        return
+    threading.Thread(target=warmup, args=(pg_store, {conf.site_id: tenants}), name="store-warmup", daemon=True).start()
+
 # We do this outside of a function because the 'store' objects need to be imported
 # by other scripts. Functionalizing it would create more code and make it harder
 # to read in my opinion.
 try:
     pg_store, pg_default = create_pg_objects()
+    apg_store = create_async_pg_objects()
 except Exception as e:
     logger.critical(e)
     raise
@@ -0,0 +1,43 @@
+"""
+Lifecycle trace context for pods, in the W3C traceparent / OpenTelemetry id format.
+
+Each time a pod is requested (create_pod, start_pod, health restarts) it gets a new trace_id.
+The trace_id is stored on the pod and sent with the command as a `traceparent` so api, spawner,
+and health all record status transitions against the same trace (see Pod.timeline). Ids are
+OpenTelemetry compatible so they can be passed to a real exporter later.
+"""
+import os
+import re
+import secrets
+
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+def component():
+    """Which Pods Service component is running, api, spawner, health, etc."""
+    return os.environ.get("PODS_COMPONENT", "api")
+
+
+def new_trace_id():
+    """128 bit trace id as 32 lowercase hex chars."""
+    return secrets.token_hex(16)
+
+
+def new_span_id():
+    """64 bit span id as 16 lowercase hex chars."""
+    return secrets.token_hex(8)
+
+
+def make_traceparent(trace_id, span_id=None):
+    """W3C traceparent header value, `00-<trace_id>-<span_id>-01`."""
+    return f"00-{trace_id}-{span_id or new_span_id()}-01"
+
+
+def parse_traceparent(traceparent):
+    """
+    Returns (trace_id, span_id) from a traceparent, or (None, None) if it's missing or malformed.
+    """
+    match = TRACEPARENT_RE.match(traceparent or "")
+    if not match:
+        return None, None
+    return match.group(1), match.group(2)
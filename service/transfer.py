@@ -0,0 +1,257 @@
+"""
+Bulk export and import of a tenant's pods, passwords, volumes, and snapshots with Postgres COPY.
+
+For moving tenants between sites or restoring after incidents without recreating objects one API call
+at a time. An export is a directory with one csv file per table plus manifest.json:
+    {"format_version": 1, "site_id", "tenant_id", "schema_revision", "exported_at",
+     "tables": {"pod": {"file": "pod.csv", "columns": [...], "rows": int, "sha256": str}, ...}}
+
+Import checks the manifest, files, and columns against the target schema up front, COPYs each table
+into a staging table, and runs the per-object checks once per table in SQL instead of running the
+model validators on every row. Everything is written in one transaction, a failed check imports nothing.
+tenant_id and site_id are rewritten to the target so exports can be loaded into another site or tenant. When
+those differ from the export's, k8_names and pod networking urls are rebuilt for the target too, so health and
+the spawner never act on the source tenant's Kubernetes objects. Imported pods always start out STOPPED with no
+container status; health sets them AVAILABLE again if their containers are running.
+
+Usage:
+    python3 transfer.py export --tenant dev --dir /tmp/dev-export [--site tacc]
+    python3 transfer.py import --tenant dev --dir /tmp/dev-export [--site tacc] [--replace]
+
+Exports hold pod passwords in plain text, files are only readable by the exporting user.
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+from datetime import datetime
+from stores import pg_store
+from models_pods import Pod, Password, tenant_base_urls, networking_url
+from models_volumes import Volume
+from models_snapshots import Snapshot
+from codes import STOPPED
+from tapisservice.config import conf
+from tapisservice.logs import get_logger
+logger = get_logger(__name__)
+
+FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+TRANSFER_MODELS = [Pod, Password, Volume, Snapshot]
+# Same rules as the Pod/Volume/Snapshot id validators, checked in bulk on import. {table: id regex}
+OBJECT_ID_REGEX = {"pod": "^[a-z][a-z0-9]{2,63}$",
+                   "password": "^[a-z][a-z0-9]{2,63}$",
+                   "volume": "^[a-z][a-z0-9]{2,127}$",
+                   "snapshot": "^[a-z][a-z0-9]{2,127}$"}
+# k8_name prefix of each table's objects, k8_names are "<prefix>-<site>-<tenant>-...". {table: prefix}
+K8_NAME_PREFIX = {"pod": "pods",
+                  "volume": "podvol",
+                  "snapshot": "podvol"}
+
+
+def table_columns(model):
+    return [column.name for column in model.__table__.columns]
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def schema_revision(cursor, tenant):
+    """Alembic revision of the tenant's schema. Each tenant schema has its own alembic_version table."""
+    cursor.execute(f'SELECT version_num FROM "{tenant}".alembic_version')
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def export_tenant(tenant, path, site=None):
+    """
+    COPY every transfer table of tenant to csv files in path and write the manifest.
+    All tables are read in one repeatable read transaction so the export is a consistent snapshot.
+    """
+    site = site or conf.site_id
+    store = pg_store[site][tenant]
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    manifest = {"format_version": FORMAT_VERSION,
+                "site_id": site,
+                "tenant_id": tenant,
+                "exported_at": datetime.utcnow().isoformat(),
+                "tables": {}}
+
+    start = time.time()
+    conn = store.engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        # Set on the transaction, not the session, so the pooled connection goes back unchanged.
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        manifest["schema_revision"] = schema_revision(cursor, tenant)
+        for model in TRANSFER_MODELS:
+            table = model.table_name()
+            columns = table_columns(model)
+            file_name = f"{table}.csv"
+            file_path = os.path.join(path, file_name)
+            with open(os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as file:
+                cursor.copy_expert(f'COPY "{tenant}".{table} ({", ".join(columns)}) TO STDOUT WITH (FORMAT csv, HEADER true)', file)
+            manifest["tables"][table] = {"file": file_name,
+                                         "columns": columns,
+                                         "rows": cursor.rowcount,
+                                         "sha256": file_sha256(file_path)}
+        conn.rollback()
+    finally:
+        conn.close()
+
+    with open(os.path.join(path, MANIFEST_FILE), "w") as file:
+        json.dump(manifest, file, indent=2)
+    total = sum(table["rows"] for table in manifest["tables"].values())
+    logger.info(f"Exported {total} rows from {site}.{tenant} to {path} in {time.time() - start:.2f}s.")
+    return manifest
+
+
+def read_manifest(path, tenant, cursor):
+    """
+    Bulk schema check of an export before anything is written. Raises ValueError on any mismatch.
+    """
+    with open(os.path.join(path, MANIFEST_FILE)) as file:
+        manifest = json.load(file)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Export format_version: {manifest.get('format_version')} not supported. Expected: {FORMAT_VERSION}.")
+    target_revision = schema_revision(cursor, tenant)
+    if manifest.get("schema_revision") != target_revision:
+        raise ValueError(f"Export was made at schema revision: {manifest.get('schema_revision')}, "
+                         f"tenant: {tenant} is at: {target_revision}. Migrate one of them first.")
+    for model in TRANSFER_MODELS:
+        table = model.table_name()
+        table_info = manifest["tables"].get(table)
+        if not table_info:
+            raise ValueError(f"Export is missing table: {table}.")
+        unknown = set(table_info["columns"]) - set(table_columns(model))
+        if unknown:
+            raise ValueError(f"Export table: {table} has columns: {sorted(unknown)} not found in the target schema.")
+        file_path = os.path.join(path, table_info["file"])
+        if file_sha256(file_path) != table_info["sha256"]:
+            raise ValueError(f"Export file: {file_path} does not match its manifest checksum.")
+    return manifest
+
+
+def check_staging(cursor, tenant, table, primary_key, rows, replace):
+    """
+    Per-object checks done once per table on the staged rows. Raises ValueError with offending ids.
+    """
+    staging = f"staging_{table}"
+    cursor.execute(f"SELECT count(*) FROM {staging}")
+    staged = cursor.fetchone()[0]
+    if staged != rows:
+        raise ValueError(f"Table: {table} staged {staged} rows, manifest says {rows}.")
+    cursor.execute(f"SELECT {primary_key} FROM {staging} WHERE {primary_key} IS NULL OR {primary_key} !~ %s LIMIT 10",
+                   (OBJECT_ID_REGEX[table],))
+    invalid = [row[0] for row in cursor.fetchall()]
+    if invalid:
+        raise ValueError(f"Table: {table} has invalid {primary_key}s: {invalid}.")
+    if not replace:
+        cursor.execute(f'SELECT {primary_key} FROM {staging} JOIN "{tenant}".{table} USING ({primary_key}) LIMIT 10')
+        existing = [row[0] for row in cursor.fetchall()]
+        if existing:
+            raise ValueError(f"Table: {table} already has {primary_key}s: {existing}. Use replace to overwrite them.")
+
+
+def retarget_k8_names(cursor, table, source, target):
+    """
+    Swap the source site and tenant in the staged k8_names for the target's. source and target are (site, tenant).
+    Raises ValueError if a k8_name isn't in the source tenant's form, it would be left pointing at unknown objects.
+    """
+    staging = f"staging_{table}"
+    source_prefix = "-".join([K8_NAME_PREFIX[table], *source]) + "-"
+    target_prefix = "-".join([K8_NAME_PREFIX[table], *target]) + "-"
+    cursor.execute(f"SELECT k8_name FROM {staging} WHERE left(k8_name, length(%(source)s)) != %(source)s LIMIT 10",
+                   {"source": source_prefix})
+    unexpected = [row[0] for row in cursor.fetchall()]
+    if unexpected:
+        raise ValueError(f"Table: {table} has k8_names not starting with {source_prefix}: {unexpected}.")
+    cursor.execute(f"UPDATE {staging} SET k8_name = %(target)s || substr(k8_name, length(%(source)s) + 1)",
+                   {"source": source_prefix, "target": target_prefix})
+
+
+def retarget_networking_urls(cursor, tenant):
+    """Rebuild the staged pods' networking urls from the target tenant's base_url."""
+    base_url = tenant_base_urls.get(tenant)
+    cursor.execute("SELECT pod_id, networking FROM staging_pod")
+    updates = []
+    for pod_id, networking in cursor.fetchall():
+        networking = networking or {}
+        for net_name, net_info in networking.items():
+            net_info["url"] = networking_url(base_url, pod_id, net_name)
+        updates.append((json.dumps(networking), pod_id))
+    cursor.executemany("UPDATE staging_pod SET networking = %s WHERE pod_id = %s", updates)
+
+
+def reset_live_pod_fields(cursor):
+    """Imported pods have no containers yet, health fills these back in for pods it finds running."""
+    cursor.execute("UPDATE staging_pod SET status = %s, status_container = '{}', start_instance_ts = NULL, time_to_stop_ts = NULL",
+                   (STOPPED,))
+
+
+def import_tenant(tenant, path, site=None, replace=False):
+    """
+    Load an export made by export_tenant into tenant, in one transaction.
+    With replace, existing objects with the same ids are overwritten, otherwise any overlap aborts the import.
+    """
+    site = site or conf.site_id
+    store = pg_store[site][tenant]
+
+    start = time.time()
+    conn = store.engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        manifest = read_manifest(path, tenant, cursor)
+        source = (manifest["site_id"], manifest["tenant_id"])
+        target = (site, tenant)
+        for model in TRANSFER_MODELS:
+            table = model.table_name()
+            table_info = manifest["tables"][table]
+            primary_key = model.primary_key_name()
+            staging = f"staging_{table}"
+            cursor.execute(f'CREATE TEMP TABLE {staging} (LIKE "{tenant}".{table} INCLUDING DEFAULTS) ON COMMIT DROP')
+            with open(os.path.join(path, table_info["file"]), encoding="utf-8") as file:
+                cursor.copy_expert(f'COPY {staging} ({", ".join(table_info["columns"])}) FROM STDIN WITH (FORMAT csv, HEADER true)', file)
+            check_staging(cursor, tenant, table, primary_key, table_info["rows"], replace)
+
+            cursor.execute(f"UPDATE {staging} SET tenant_id = %s, site_id = %s", (tenant, site))
+            if source != target and table in K8_NAME_PREFIX:
+                retarget_k8_names(cursor, table, source, target)
+            if table == "pod":
+                if source[1] != tenant:
+                    retarget_networking_urls(cursor, tenant)
+                reset_live_pod_fields(cursor)
+            if replace:
+                cursor.execute(f'DELETE FROM "{tenant}".{table} WHERE {primary_key} IN (SELECT {primary_key} FROM {staging})')
+            cursor.execute(f'INSERT INTO "{tenant}".{table} SELECT * FROM {staging}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    total = sum(table["rows"] for table in manifest["tables"].values())
+    logger.info(f"Imported {total} rows from {path} into {site}.{tenant} in {time.time() - start:.2f}s.")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk export/import of a tenant's pods, passwords, volumes, and snapshots.")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("--tenant", required=True)
+    parser.add_argument("--dir", required=True, help="Export directory, written by export and read by import.")
+    parser.add_argument("--site", default=None, help="Defaults to this deployment's site.")
+    parser.add_argument("--replace", action="store_true", help="import: overwrite objects that already exist.")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        manifest = export_tenant(args.tenant, args.dir, site=args.site)
+    else:
+        manifest = import_tenant(args.tenant, args.dir, site=args.site, replace=args.replace)
+    print(json.dumps({table: info["rows"] for table, info in manifest["tables"].items()}))
@@ -1,11 +1,13 @@
 import traceback
+from functools import lru_cache
+from operator import attrgetter
 from typing import List, Dict
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.exceptions import RequestValidationError
 from pydantic import ValidationError
 
-from tapisservice.tapisfastapi.utils import error
+from tapisservice.tapisfastapi.utils import error, ok
 from tapisservice.config import conf
 from tapisservice.errors import BaseTapisError
 from tapisservice.logs import get_logger
@@ -68,6 +70,7 @@ import re
 from starlette.datastructures import URL
 from starlette.responses import RedirectResponse
 from starlette.types import ASGIApp, Receive, Scope, Send
+from store import replica_reads, request_objects
 
 repeated_quotes = re.compile(r'//+')
 
@@ -91,36 +94,129 @@ class HttpUrlRedirectMiddleware:
     else:
       await self.app(scope, receive, send)
 
+class ReadReplicaMiddleware:
+  """
+  Marks GET and HEAD requests as read-only so store.PostgresStore can route their reads to the replica.
+  Reads in other requests go to the primary, they're usually read-modify-write.
+  """
+
+  def __init__(self, app: ASGIApp) -> None:
+    self.app = app
+
+  async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] == "http" and scope["method"] in ["GET", "HEAD"]:
+      token = replica_reads.set(True)
+      try:
+        await self.app(scope, receive, send)
+      finally:
+        replica_reads.reset(token)
+    else:
+      await self.app(scope, receive, send)
+
+class RequestObjectsMiddleware:
+  """
+  Gives each request an empty identity map (store.request_objects), so an object loaded by primary key
+  during authorization is reused by the handler instead of read from the database twice.
+  """
+
+  def __init__(self, app: ASGIApp) -> None:
+    self.app = app
+
+  async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] == "http":
+      token = request_objects.set({})
+      try:
+        await self.app(scope, receive, send)
+      finally:
+        request_objects.reset(token)
+    else:
+      await self.app(scope, receive, send)
+
 import codes
+from errors import QueryParameterError
+
+def list_where_params(**filters):
+    """
+    List endpoint query parameters to where_params for TapisModel.compile_where. None values are skipped,
+    comma separated values match any of the values, created_after/created_before filter creation_ts.
+    """
+    where_params = []
+    for key, val in filters.items():
+        if val is None:
+            continue
+        if key == "created_after":
+            where_params.append(["creation_ts", ".gte", val])
+        elif key == "created_before":
+            where_params.append(["creation_ts", ".lt", val])
+        elif "," in val:
+            where_params.append([key, ".in", val.split(",")])
+        else:
+            where_params.append([key, ".eq", val])
+    return where_params
+
+@lru_cache(maxsize=None)
+def display_columns(model, response_model) -> List[str]:
+    """response_model's fields that model displays, computed once per model."""
+    return [name for name in response_model.__fields__ if name not in model.DISPLAY_EXCLUDE]
+
+def list_columns(fields: str | None, model, response_model) -> List[str]:
+    """
+    Columns list endpoints load and return. All displayed fields, or only the comma separated fields plus
+    response_model's required fields so responses still validate. Routes using this need response_model_exclude_unset=True.
+    """
+    available = display_columns(model, response_model)
+    if not fields:
+        return list(available)
+    wanted = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = wanted - set(available)
+    if unknown:
+        raise QueryParameterError(f"fields: {sorted(unknown)} not found. Available fields: {available}", 400)
+    wanted |= {name for name, model_field in response_model.__fields__.items() if model_field.required}
+    return [name for name in available if name in wanted]
+
+def display_rows(rows, columns: List[str]) -> List[Dict]:
+    """Projected rows (see TapisModel.project) to display dicts holding only columns."""
+    getter = attrgetter(*columns)
+    if len(columns) == 1:
+        return [{columns[0]: getter(row)} for row in rows]
+    return [dict(zip(columns, getter(row))) for row in rows]
+
+def list_response(result: List[Dict], msg: str, metadata: Dict):
+    """
+    ok() response for list endpoints, serialized straight to orjson. Skips the route's response_model
+    validation and jsonable_encoder, result rows must already be only the exposed fields (see list_columns).
+    """
+    return ORJSONResponse(ok(result=result, msg=msg, metadata=metadata))
 
 def check_permissions(user, level, object, object_type, roles=None):
-    """Check the appropriate permissions store for user and level.
-    object: a pod, volume, or snapshot object. Also can be result of models_base.parse_permissions().
+    """Check the user's level on object against level.
+    object: a pod, volume, or snapshot object, already loaded by the caller.
     """
+    object_id = getattr(object, f'{object_type}_id')
     # Running something like: Checking pod_id: {pod.pod_id} permissions for user {user}
-    logger.debug(f"Checking {object_type}_id: {eval(f'object.{object_type}_id')} permissions for user {user}")
+    logger.debug(f"Checking {object_type}_id: {object_id} permissions for user {user}")
 
     # first, if roles were passed, check for admin role
     if roles:
         if codes.ADMIN_ROLE in roles:
             return True
 
-    # Get all permissions for this object_type
-    # Running something like: volumes.get_permissions()
-    permissions = object.get_permissions()
-    
-    # Attempt to get permission level for particular user.
-    user_level = permissions.get(user)
+    # The loaded object's permissions array, object_permission mirrors it (last entry wins) for listings.
+    user_level = object.get_permissions().get(user)
+    return check_permission_level(user, level, user_level, object_type, object_id)
+
+def check_permission_level(user, level, user_level, object_type, object_id):
+    """Compare user_level, the user's level on the object or None, to level."""
     if not user_level:
-        logger.info(f"Found no permissions for user {user} on {object_type}: {eval(f'object.{object_type}_id')}. Permissions: {permissions}")
+        logger.info(f"Found no permissions for user {user} on {object_type}: {object_id}.")
         return False
 
     # Get user pem and compare to level.
     user_pem = codes.PermissionLevel(user_level)
     if user_pem >= level:
-        logger.info(f"Allowing request - user has appropriate permission for {object_type}: {eval(f'object.{object_type}_id')}.")
+        logger.info(f"Allowing request - user has appropriate permission for {object_type}: {object_id}.")
         return True
     else:
         # we found the permission for the user but it was insufficient; return False right away
-        logger.info(f"Found permission {level} for  {object_type}: {eval(f'object.{object_type}_id')}, insufficient permission, rejecting request.")
+        logger.info(f"Found permission {user_level} for {object_type}: {object_id}, insufficient permission, rejecting request.")
         return False
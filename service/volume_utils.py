@@ -32,6 +32,11 @@ class VolumesError(Exception):
         Exception.__init__(self, message)
         self.message = message
 
+class NFSDiscoveryError(RuntimeError):
+    """Couldn't find the pods-nfs service, usually transient while nfs is (re)starting."""
+    pass
+
+
 def get_nfs_ip() -> str:
     # We need to get the nfs ip from k8 services
     nfs_nfs_ip = ""
@@ -67,7 +72,7 @@ def get_nfs_ip() -> str:
     else:
         msg = f"Couldn't find service matching pods-nfs. Required, breaking."
         logger.info(msg)
-        raise RuntimeError(msg)
+        raise NFSDiscoveryError(msg)
 
     return nfs_nfs_ip
 
@@ -0,0 +1,32 @@
+import sys
+import time
+import cloudpickle
+
+# Allows us to import pods's modules.
+sys.path.append('/home/tapis/service')
+from tapisservice.config import conf
+from codes import PRIORITY_CREATE
+from channels import CommandChannel, encode_cmd, decode_cmd
+
+
+##### Benchmarks
+# Timings print with `make benchmark` (pytest -s). Asserts only hold with margins far above run to run noise.
+
+def test_command_encoding_benchmark():
+    # Encode/decode cost and size of a command, compact versioned json against the cloudpickle it replaced.
+    cmd = CommandChannel._build_cmd("testspodsbench", "pod", "dev", conf.site_id, priority=PRIORITY_CREATE,
+                                    trace_id="4bf92f3577b34da6a3ce929d0e0e4736")
+    count = 100000
+    results = {}
+    for name, encode, decode in [("json", encode_cmd, decode_cmd), ("cloudpickle", cloudpickle.dumps, cloudpickle.loads)]:
+        start = time.perf_counter()
+        for _ in range(count):
+            body = encode(cmd)
+        encode_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(count):
+            decode(body)
+        decode_seconds = time.perf_counter() - start
+        results[name] = len(body)
+        print(f"{name}: encode {encode_seconds / count * 1e6:.2f}us, decode {decode_seconds / count * 1e6:.2f}us, {len(body)} bytes")
+    assert results["json"] < results["cloudpickle"]
@@ -0,0 +1,112 @@
+import sys
+import time
+import asyncio
+import pytest
+from tests.test_utils import headers, basic_response_checks
+
+# Allows us to import pods's modules.
+sys.path.append('/home/tapis/service')
+from api import api
+
+# Set up client for testing
+from fastapi.testclient import TestClient
+
+# base_url: The base URL to use for requests, must be valid Tapis URL.
+# raise_server_exceptions: If True, the client will raise exceptions from the server rather the normal client errors.
+client = TestClient(api, base_url="https://dev.develop.tapis.io", raise_server_exceptions=False)
+
+
+##### Benchmarks
+# Timings print with `make benchmark` (pytest -s). Asserts only hold with margins far above run to run noise.
+
+def test_concurrent_get_pod_latency(headers):
+    # Handlers await the db instead of blocking the event loop, so concurrent requests overlap
+    # and N of them finish in well under N times a single request.
+    import httpx
+    pods = basic_response_checks(client.get("/pods", headers=headers))
+    if not pods:
+        pytest.skip("needs at least one pod")
+    pod_id = pods[0]["pod_id"]
+    concurrency = 50
+
+    async def timed_get(http):
+        start = time.perf_counter()
+        rsp = await http.get(f'/pods/{pod_id}', headers=headers)
+        assert rsp.status_code == 200
+        return time.perf_counter() - start
+
+    async def run_load(concurrency):
+        async with httpx.AsyncClient(app=api, base_url="https://dev.develop.tapis.io") as http:
+            await timed_get(http)
+            single = min([await timed_get(http) for _ in range(5)])
+            start = time.perf_counter()
+            latencies = await asyncio.gather(*[timed_get(http) for _ in range(concurrency)])
+            return single, time.perf_counter() - start, sorted(latencies)
+
+    single, elapsed, latencies = asyncio.run(run_load(concurrency))
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"GET /pods/{pod_id}: single {single * 1000:.1f}ms, x{concurrency} concurrent {elapsed * 1000:.1f}ms, "
+          f"p50={p50 * 1000:.1f}ms p99={p99 * 1000:.1f}ms")
+    assert elapsed < concurrency * single / 2
+
+def test_pod_construction_benchmark():
+    # Pod(**new_pod.dict()) with the tenant's base_url from the memoized map and Networking objects built once.
+    from models_pods import Pod, NewPod
+    new_pod = NewPod(pod_id="testspodsbench", pod_template="template/neo4j",
+                     networking={"default": {"protocol": "http", "port": 5000}, "second": {"protocol": "http", "port": 5001}})
+    Pod(**new_pod.dict())
+
+    count = 500
+    start = time.perf_counter()
+    for _ in range(count):
+        Pod(**new_pod.dict())
+    per_pod = (time.perf_counter() - start) / count
+    print(f"Pod(**new_pod.dict()): {per_pod * 1e6:.1f}us per construction")
+
+def test_from_trusted_benchmark():
+    # Rehydrating validated data, Pod(**data) runs every validator, from_trusted none.
+    from models_pods import Pod, NewPod
+    new_pod = NewPod(pod_id="testspodsbench", pod_template="template/neo4j",
+                     networking={"default": {"protocol": "http", "port": 5000}})
+    data = Pod(**new_pod.dict()).dict()
+
+    count = 500
+    start = time.perf_counter()
+    for _ in range(count):
+        Pod(**data)
+    validated_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(count):
+        Pod.from_trusted(**data)
+    trusted_seconds = time.perf_counter() - start
+
+    print(f"Pod x{count}: Pod(**data) {validated_seconds * 1000:.1f}ms, from_trusted {trusted_seconds * 1000:.1f}ms")
+    assert trusted_seconds < validated_seconds
+
+def test_list_response_benchmark_5000_pods(headers):
+    # GET /pods responses for 5000 pods, the old path (response_model validation, jsonable_encoder, json)
+    # against list_response (orjson straight from the projected rows).
+    import gzip
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from tapisservice.tapisfastapi.utils import ok
+    from models_pods import PodsResponse
+    from utils import list_response
+
+    pods = basic_response_checks(client.get("/pods", headers=headers))
+    if not pods:
+        pytest.skip("needs at least one pod")
+    rows = [dict(pods[0], pod_id=f"testspodsbench{idx}") for idx in range(5000)]
+    content = ok(result=rows, msg="Pods retrieved successfully.", metadata={"count": len(rows)})
+
+    start = time.perf_counter()
+    JSONResponse(jsonable_encoder(PodsResponse(**content), exclude_unset=True))
+    old_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    new_body = list_response(result=rows, msg="Pods retrieved successfully.", metadata={"count": len(rows)}).body
+    new_seconds = time.perf_counter() - start
+
+    print(f"5000 pod listing: json+validation {old_seconds * 1000:.1f}ms, orjson {new_seconds * 1000:.1f}ms, "
+          f"{len(new_body)} bytes, {len(gzip.compress(new_body))} bytes gzipped")
+    assert new_seconds < old_seconds
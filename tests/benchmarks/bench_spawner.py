@@ -0,0 +1,50 @@
+import sys
+import time
+import threading
+
+# Allows us to import pods's modules.
+sys.path.append('/home/tapis/service')
+from tapisservice.config import conf
+from channels import CommandChannel
+from spawner import Spawner
+
+
+##### Benchmarks
+# Timings print with `make benchmark` (pytest -s). Asserts only hold with margins far above run to run noise.
+
+def run_spawners(replicas, queue, command_count, workers, spawn_seconds):
+    """
+    Spawn throughput of `replicas` spawners competing on one queue, each with `workers` worker threads.
+    Spawning is a sleep, what's measured is how the command channel spreads work across replicas.
+    """
+    done = threading.Semaphore(0)
+    def process(cmd):
+        time.sleep(spawn_seconds)
+        done.release()
+
+    spawners = [Spawner() for _ in range(replicas)]
+    CommandChannel(name=queue).put_cmds([{"object_id": f"testspodsbench{idx}", "object_type": "pod", "tenant_id": "dev",
+                                          "site_id": conf.site_id} for idx in range(command_count)])
+    start = time.perf_counter()
+    for spawner in spawners:
+        spawner.process = process
+        for _ in range(workers):
+            threading.Thread(target=spawner.work, daemon=True).start()
+        for cmd_ch in spawner.cmd_chs.values():
+            threading.Thread(target=spawner.consume, args=(cmd_ch,), daemon=True).start()
+    for _ in range(command_count):
+        done.acquire()
+    return command_count / (time.perf_counter() - start)
+
+
+def test_spawn_throughput_with_competing_spawners(monkeypatch):
+    # Several spawner replicas on one queue, each command is handled by exactly one of them.
+    queues = ["testsbench-1", "testsbench-4"]
+    monkeypatch.setitem(conf, "queue_backend", "inprocess")
+    monkeypatch.setitem(conf, "spawner_host_queues", queues)
+    throughput = {}
+    for queue, replicas in zip(queues, [1, 4]):
+        monkeypatch.setenv("queues", queue)
+        throughput[replicas] = run_spawners(replicas, queue, command_count=400, workers=2, spawn_seconds=0.01)
+        print(f"{replicas} spawner replicas x 2 workers: {throughput[replicas]:.0f} spawns/s")
+    assert throughput[4] > 2 * throughput[1]
@@ -0,0 +1,142 @@
+import sys
+import time
+import pytest
+
+# Allows us to import pods's modules.
+sys.path.append('/home/tapis/service')
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+from tapisservice.config import conf
+from store import PostgresStore
+from stores import pg_store, SiteStores, SITE_TENANT_DICT
+from models_pods import Pod
+from transfer import export_tenant, import_tenant, table_columns, TRANSFER_MODELS
+
+
+##### Benchmarks
+# Timings print with `make benchmark` (pytest -s). Asserts only hold with margins far above run to run noise.
+
+def test_lazy_startup_benchmark():
+    # Startup cost of building every site's store and tenant views up front vs on first use, for 100 tenants.
+    tenants = [f"benchtenant{idx}" for idx in range(100)]
+    start = time.perf_counter()
+    eager = SiteStores(conf.site_id, tenants.copy(), PostgresStore)
+    for tenant in eager:
+        eager[tenant]
+    eager_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lazy = SiteStores(conf.site_id, tenants.copy(), PostgresStore)
+    lazy_seconds = time.perf_counter() - start
+
+    print(f"store startup for 100 tenants: eager {eager_seconds * 1000:.2f}ms, lazy {lazy_seconds * 1000:.2f}ms")
+    assert lazy_seconds < eager_seconds
+    assert lazy._site_store is None
+    eager.site_store().engine.dispose()
+
+
+@pytest.mark.parametrize("row_count", [100000])
+def test_object_permission_filter_benchmark(row_count):
+    # Pod listing for one user through permission_filter's object_permission index lookup, with row_count
+    # object_permission rows for other users. Rolled back afterwards.
+    site_stores = pg_store[conf.site_id]
+    tenant = next(tenant for tenant in site_stores if tenant not in ["siteadmintable", "defaulttables"])
+    stmt = select(Pod).where(Pod.permission_filter("benchuser", "READ"))
+    sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    with site_stores[tenant].engine.connect() as conn:
+        conn.execute(text(f'SET LOCAL search_path TO "{tenant}"'))
+        conn.execute(text("""
+            INSERT INTO object_permission (object_type, object_id, username, level)
+            SELECT 'pod', 'benchpod' || (idx / 10), 'benchuser' || (idx % 10), 'READ' FROM generate_series(1, :row_count) AS idx
+        """), {"row_count": row_count})
+        conn.execute(text("ANALYZE object_permission"))
+        plan = conn.execute(text(f"EXPLAIN ANALYZE {sql}")).scalars().all()
+        conn.rollback()
+
+    print(f"pod listing with {row_count} object_permission rows: {plan[-1]}")
+    assert any("object_permission_pkey" in line or "ix_object_permission_username" in line for line in plan)
+
+
+def eval_where(cls, where_params):
+    """The eval-built filters compile_where replaced, kept here to benchmark against."""
+    oper_aliases = {'.neq': '!=', '.eq': '==', '.lte': '<=', '.lt': '<', '.gte': '>=', '.gt': '>'}
+    stmt = select(cls)
+    for key, oper, val in where_params:
+        if oper == '.in':
+            stmt = stmt.where(eval(f"cls.{key}.in_({val})"))
+        elif oper == '.nin':
+            stmt = stmt.where(eval(f"cls.{key}.not_in({val})"))
+        elif isinstance(val, str):
+            stmt = stmt.where(eval(f"cls.{key} {oper_aliases[oper]} '{val}'"))
+        else:
+            stmt = stmt.where(eval(f"cls.{key} {oper_aliases[oper]} {val}"))
+    return stmt
+
+
+@pytest.mark.parametrize("name, where_params", [("pk lookup", [["pod_id", ".eq", "testspodsbench"]]),
+                                                ("two clauses", [["status", ".eq", "AVAILABLE"], ["pod_id", ".in", ["a", "b"]]])])
+def test_compile_where_benchmark(name, where_params):
+    # Statement build plus SQLAlchemy cache key, what every query pays before it reaches the db.
+    # Primary key lookups use the reused pk_statement, whose cache key is memoized.
+    count = 20000
+    builders = {"eval": lambda: eval_where(Pod, where_params)}
+    if name == "pk lookup":
+        builders["builder"] = Pod.pk_statement
+    else:
+        builders["builder"] = lambda: select(Pod).where(*Pod.compile_where(where_params))
+
+    seconds = {}
+    for builder_name, build in builders.items():
+        start = time.perf_counter()
+        for _ in range(count):
+            build()._generate_cache_key()
+        seconds[builder_name] = time.perf_counter() - start
+    print(f"{name}: eval {seconds['eval'] / count * 1e6:.1f}us, builder {seconds['builder'] / count * 1e6:.1f}us per statement")
+    # Built where clauses are only somewhat faster than eval, too close to assert on.
+    if name == "pk lookup":
+        assert seconds["builder"] * 10 < seconds["eval"]
+
+
+@pytest.mark.parametrize("pod_count", [100000])
+def test_transfer_benchmark(tmp_path, pod_count):
+    # Export dev with pod_count extra pods copied from one of its pods, then import it into another tenant.
+    other_tenants = [tenant for tenant in SITE_TENANT_DICT[conf.site_id] if tenant != "dev"]
+    if not other_tenants:
+        pytest.skip("Needs a second tenant on this site.")
+    target = other_tenants[0]
+    store = pg_store[conf.site_id]["dev"]
+    def ids(tenant, model):
+        primary_key = model.primary_key_name()
+        return set(store.run("execute", text(f'SELECT {primary_key} FROM "{tenant}".{model.table_name()}'), scalars=True, all=True))
+    template_pods = store.run("execute", text("SELECT pod_id FROM pod LIMIT 1"), scalars=True, all=True)
+    if not template_pods:
+        pytest.skip("Needs a pod in tenant dev.")
+
+    columns = table_columns(Pod)
+    copied = {"pod_id": "'testsxfer' || idx", "k8_name": f"'pods-{conf.site_id}-dev-testsxfer' || idx"}
+    store.run("execute", text(f"INSERT INTO pod ({', '.join(columns)}) SELECT {', '.join(copied.get(column, column) for column in columns)} "
+                              f"FROM pod, generate_series(1, :pod_count) AS idx WHERE pod_id = :template_pod"),
+              fn_params={"params": {"pod_count": pod_count, "template_pod": template_pods[0]}})
+    exported = {}
+    try:
+        exported = {model: ids("dev", model) for model in TRANSFER_MODELS}
+        if any(exported[model] & ids(target, model) for model in TRANSFER_MODELS):
+            exported = {}
+            pytest.skip(f"Tenant: {target} already has objects with dev's ids.")
+
+        start = time.perf_counter()
+        manifest = export_tenant("dev", str(tmp_path))
+        export_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        import_tenant(target, str(tmp_path))
+        import_seconds = time.perf_counter() - start
+
+        rows = sum(table["rows"] for table in manifest["tables"].values())
+        print(f"transfer of {rows} rows: export {export_seconds:.2f}s, import into another tenant {import_seconds:.2f}s")
+        assert all(exported[model] <= ids(target, model) for model in TRANSFER_MODELS)
+    finally:
+        store.run("execute", text("DELETE FROM pod WHERE pod_id LIKE :prefix"), fn_params={"params": {"prefix": "testsxfer%"}})
+        for model in reversed(TRANSFER_MODELS):
+            if exported.get(model):
+                store.run("execute", text(f'DELETE FROM "{target}".{model.table_name()} WHERE {model.primary_key_name()} = ANY(:ids)'),
+                          fn_params={"params": {"ids": list(exported[model])}})
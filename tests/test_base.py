@@ -3,11 +3,15 @@ import sys
 import json
 import time
 import pytest
+import threading
 from tests.test_utils import headers, response_format, basic_response_checks, delete_pods
 
 # Allows us to import pods's modules.
 sys.path.append('/home/tapis/service')
 from api import api
+from auth import SKRoleCache
+from codes import ADMIN_ROLE
+from tapisservice.config import conf
 
 # Set up client for testing
 from fastapi.testclient import TestClient
@@ -120,3 +124,56 @@ def test_volume_startup(headers):
     # Check the pod object
     assert result['status'] == "AVAILABLE"
     assert result['volume_id'] == test_volume_1
+
+
+def test_sk_role_cache():
+    calls = []
+    def fetch(tenant, user):
+        calls.append((tenant, user))
+        time.sleep(0.2)
+        if user == "missinguser":
+            raise ValueError("user not found")
+        return ["role1"]
+    cache = SKRoleCache(fetch)
+
+    # Concurrent misses share one SK call.
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("dev", "testuser"))) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [["role1"]] * 10
+    assert calls == [("dev", "testuser")]
+
+    # Fresh entries are hits.
+    assert cache.get("dev", "testuser") == ["role1"]
+    assert len(calls) == 1
+
+    # Failures are cached too.
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache.get("dev", "missinguser")
+    assert calls.count(("dev", "missinguser")) == 1
+
+    # Past the ttl the stale roles are returned right away and refreshed in the background.
+    fetched_at, roles, error = cache._entries[("dev", "testuser")]
+    cache._entries[("dev", "testuser")] = (fetched_at - 60, roles, error)
+    assert cache.get("dev", "testuser") == ["role1"]
+    time.sleep(0.5)
+    assert calls.count(("dev", "testuser")) == 2
+    assert time.monotonic() - cache._entries[("dev", "testuser")][0] < 1
+
+    cache.invalidate(user="testuser")
+    assert ("dev", "testuser") not in cache._entries
+
+def test_sk_role_cache_admin_stale_window():
+    # A revoked admin role is only served stale for sk_roles_cache_admin_stale, not sk_roles_cache_stale.
+    granted = {"testuser": [ADMIN_ROLE]}
+    cache = SKRoleCache(lambda tenant, user: list(granted[user]))
+    assert cache.get("dev", "testuser") == [ADMIN_ROLE]
+    granted["testuser"] = []
+    fetched_at, roles, error = cache._entries[("dev", "testuser")]
+    age = conf.get('sk_roles_cache_ttl', 30) + conf.get('sk_roles_cache_admin_stale', 5) + 1
+    cache._entries[("dev", "testuser")] = (fetched_at - age, roles, error)
+    assert cache.get("dev", "testuser") == []
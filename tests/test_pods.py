@@ -89,6 +89,41 @@ def test_pod_startup(headers):
     assert result['pod_id'] == test_pod_1
     assert result['pod_template'] == "template/neo4j"
 
+def test_get_pods_filter_sort_paginate(headers):
+    # Full filtered listing to compare pages against.
+    rsp = client.get("/pods", params={"status_requested": "ON,OFF", "sort": "-creation_ts"}, headers=headers)
+    all_pods = basic_response_checks(rsp)
+    assert test_pod_1 in [pod['pod_id'] for pod in all_pods]
+    assert all(pod['status_requested'] in ["ON", "OFF"] for pod in all_pods)
+    assert [pod['creation_ts'] for pod in all_pods] == sorted([pod['creation_ts'] for pod in all_pods], reverse=True)
+
+    # Walk the same listing one pod at a time with keyset cursors and only a couple of fields.
+    paged_ids = []
+    params = {"status_requested": "ON,OFF", "sort": "-creation_ts", "limit": 1, "fields": "pod_id,status"}
+    while True:
+        rsp = client.get("/pods", params=params, headers=headers)
+        page = basic_response_checks(rsp)
+        assert len(page) <= 1
+        for pod in page:
+            assert set(pod.keys()) <= {"pod_id", "pod_template", "status"}
+            paged_ids.append(pod['pod_id'])
+        next_cursor = response_format(rsp)['metadata']['next_cursor']
+        if not next_cursor:
+            break
+        params["cursor"] = next_cursor
+    assert paged_ids == [pod['pod_id'] for pod in all_pods]
+
+    # Filters that match nothing, bad sort, and cursors from another sort are handled.
+    rsp = client.get("/pods", params={"template": "template/doesnotexist"}, headers=headers)
+    assert basic_response_checks(rsp) == []
+    rsp = client.get("/pods", params={"sort": "status_container"}, headers=headers)
+    assert rsp.status_code == 400
+    if len(all_pods) > 1:
+        rsp = client.get("/pods", params={"sort": "-creation_ts", "limit": 1}, headers=headers)
+        cursor = response_format(rsp)['metadata']['next_cursor']
+        rsp = client.get("/pods", params={"sort": "pod_id", "cursor": cursor}, headers=headers)
+        assert rsp.status_code == 400
+
 def test_get_pod(headers):
     rsp = client.get(f"/pods/{test_pod_1}", headers=headers)
     result = basic_response_checks(rsp)
@@ -105,6 +140,134 @@ def test_get_pod_logs(headers):
 
     assert result['logs'] or result['logs'] == ''
 
+def test_get_pod_timeline(headers):
+    rsp = client.get(f"/pods/{test_pod_1}/timeline",
+                     headers=headers)
+    result = basic_response_checks(rsp)
+
+    assert result['trace_id']
+    assert result['timeline'][0]['status'] == "REQUESTED"
+    assert result['timeline'][0]['component'] == "api"
+    for transition in result['timeline']:
+        assert transition['trace_id']
+        assert transition['duration'] >= 0
+
+def test_tenant_base_urls_pick_up_in_place_changes(monkeypatch):
+    # The tenant cache can change a tenant's base_url without replacing its tenants dict.
+    from __init__ import t
+    from tapisservice.config import conf
+    from models_pods import TenantBaseUrls
+    tenant = next(tenant for tenant in t.tenant_cache.tenants.values() if tenant.tenant_id == "dev")
+    urls = TenantBaseUrls()
+    assert urls.get("dev") == tenant.base_url
+
+    monkeypatch.setattr(tenant, "base_url", "https://changed.develop.tapis.io")
+    assert urls.get("dev") != "https://changed.develop.tapis.io"
+    urls._built_at -= conf.get('tenant_base_urls_ttl', 60)
+    assert urls.get("dev") == "https://changed.develop.tapis.io"
+
+def test_pod_construction_uses_memoized_base_urls(monkeypatch):
+    # Pod(**new_pod.dict()) runs the root validators several times, the tenant's base_url comes from the
+    # memoized map instead of the tenant cache and Networking objects are only built once.
+    from __init__ import t
+    from models_pods import Pod, NewPod
+    new_pod = NewPod(pod_id="testspodsbench", pod_template="template/neo4j",
+                     networking={"default": {"protocol": "http", "port": 5000}, "second": {"protocol": "http", "port": 5001}})
+    Pod(**new_pod.dict())
+
+    lookups = []
+    get_tenant_config = t.tenant_cache.get_tenant_config
+    def counting_get_tenant_config(*args, **kwargs):
+        lookups.append(kwargs)
+        return get_tenant_config(*args, **kwargs)
+    monkeypatch.setattr(t.tenant_cache, "get_tenant_config", counting_get_tenant_config)
+
+    for _ in range(5):
+        pod = Pod(**new_pod.dict())
+    assert not lookups
+    assert pod.networking["second"].url.startswith("testspodsbench-second.pods.")
+
+def test_from_trusted_skips_validators(monkeypatch):
+    # Rehydrating validated data with from_trusted runs no validators, user input still goes through Pod(**data).
+    from tapisservice.config import conf
+    from models_pods import Pod
+    from models_volumes import Volume
+    from models_snapshots import Snapshot
+    pod = Pod.db_get_with_pk(test_pod_1, tenant="dev", site=conf.site_id)
+    data = pod.dict()
+
+    calls = []
+    def recorder(name):
+        def record(*args, **kwargs):
+            calls.append(name)
+            return args[1] if len(args) > 1 else None
+        return record
+    monkeypatch.setattr(Pod, "__pre_root_validators__", [recorder("pre_root")])
+    monkeypatch.setattr(Pod, "__post_root_validators__", [(False, recorder("root"))])
+    for name, field in Pod.__fields__.items():
+        monkeypatch.setattr(field, "validators", [recorder(name)])
+
+    trusted = Pod.from_trusted(**data)
+    assert calls == []
+    assert trusted.dict() == data
+    assert trusted.display() == pod.display()
+    # The patched validators are the ones Pod(**data) runs.
+    Pod(**data)
+    assert "root" in calls and "pod_template" in calls
+
+    # Missing fields get defaults.
+    volume = Volume.from_trusted(volume_id="testsvolumetrusted")
+    assert volume.status == Volume.__fields__["status"].default
+    assert Snapshot.from_trusted(snapshot_id="testssnapshottrusted").snapshot_id == "testssnapshottrusted"
+
+def test_list_response_matches_response_model(headers):
+    # list_response (orjson straight from the projected rows) must produce the same json as the old path,
+    # response_model validation, jsonable_encoder, and json.
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from tapisservice.tapisfastapi.utils import ok
+    from models_pods import PodsResponse
+    from utils import list_response
+
+    rsp = client.get("/pods", headers=headers)
+    pod = basic_response_checks(rsp)[0]
+    rows = [dict(pod, pod_id=f"testspodslist{idx}") for idx in range(50)]
+    content = ok(result=rows, msg="Pods retrieved successfully.", metadata={"count": len(rows)})
+
+    old_body = JSONResponse(jsonable_encoder(PodsResponse(**content), exclude_unset=True)).body
+    new_body = list_response(result=rows, msg="Pods retrieved successfully.", metadata={"count": len(rows)}).body
+    assert json.loads(old_body) == json.loads(new_body)
+
+@pytest.mark.parametrize("route", ["", "/logs", "/timeline"])
+def test_pod_loaded_once_per_request(headers, route):
+    # auth.py loads the pod for the permission check, the handler reuses it instead of reading it again.
+    # The check itself reads the loaded pod's permissions, not object_permission.
+    from sqlalchemy import event
+    from tapisservice.config import conf
+    from stores import pg_store, apg_store
+    engines = {pg_store[conf.site_id]["dev"].engine, apg_store[conf.site_id]["dev"].engine.sync_engine}
+    engines |= {store.replica_engine for store in [pg_store[conf.site_id]["dev"]] if store.replica_engine}
+    engines |= {store.replica_engine.sync_engine for store in [apg_store[conf.site_id]["dev"]] if store.replica_engine}
+    pod_reads = []
+    permission_reads = []
+    def count_pod_reads(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith("SELECT"):
+            return
+        if "FROM dev.pod" in statement.replace('"', ''):
+            pod_reads.append(statement)
+        if "object_permission" in statement:
+            permission_reads.append(statement)
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", count_pod_reads)
+    try:
+        rsp = client.get(f"/pods/{test_pod_1}{route}", headers=headers)
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", count_pod_reads)
+    basic_response_checks(rsp)
+    assert len(pod_reads) == 1
+    assert permission_reads == []
+
 def test_get_pod_credentials(headers):
     rsp = client.get(f"/pods/{test_pod_1}/credentials", headers=headers)
     result = basic_response_checks(rsp)
@@ -134,6 +297,22 @@ def test_delete_set_permissions(headers):
     result = basic_response_checks(rsp)
     assert "Pod permission deleted successfully" in rsp.json()['message']
 
+def test_object_permission_follows_permissions(headers):
+    from tapisservice.config import conf
+    from models_permissions import ObjectPermission
+
+    def normalized():
+        return ObjectPermission.db_get_for_object("pod", test_pod_1, tenant="dev", site=conf.site_id)
+
+    rsp = client.post(f"/pods/{test_pod_1}/permissions", data=json.dumps({"user": "testuser", "level": "USER"}), headers=headers)
+    permissions = basic_response_checks(rsp)['permissions']
+    assert normalized() == dict(permission.split(':') for permission in permissions)
+    assert normalized()["testuser"] == "USER"
+
+    rsp = client.delete(f"/pods/{test_pod_1}/permissions/testuser", headers=headers)
+    basic_response_checks(rsp)
+    assert "testuser" not in normalized()
+
 def test_update_pod(headers):
     # Definition
     pod_def = {
@@ -154,6 +333,29 @@ def test_update_pod_no_change(headers):
     result = basic_response_checks(rsp)
     assert rsp.json()['message'] == "Incoming data made no changes to pod. Is incoming data equal to current data?"
 
+def test_bulk_pod_action(headers):
+    # Definition
+    bulk_def = {
+        "pod_ids": [test_pod_1, "testspodsdoesnotexist"],
+        "action": "stop"
+    }
+    rsp = client.post("/pods/bulk", data=json.dumps(bulk_def), headers=headers)
+    result = basic_response_checks(rsp)
+    results = {res['pod_id']: res for res in result}
+    assert results[test_pod_1]['success']
+    assert not results["testspodsdoesnotexist"]['success']
+
+    rsp = client.get(f"/pods/{test_pod_1}", headers=headers)
+    result = basic_response_checks(rsp)
+    assert result['status_requested'] == "OFF"
+
+def test_bulk_pod_other_methods_not_allowed(headers):
+    # Only POST /pods/bulk skips the pod_id check, other methods are treated as a pod named "bulk".
+    for method in ["get", "put", "delete"]:
+        kwargs = {"data": json.dumps({"description": "bulk"})} if method == "put" else {}
+        rsp = getattr(client, method)("/pods/bulk", headers=headers, **kwargs)
+        assert rsp.status_code in [403, 404], f"{method.upper()} /pods/bulk returned {rsp.status_code}"
+
 ### TODO stop, start, restart pod, update pod
 
 ##### Error testing
@@ -185,3 +387,44 @@ def test_description_is_ascii_400(headers):
     # Test error response.
     assert rsp.status_code == 400
     assert any('description field may only contain ASCII characters' in msg for msg in data['message'])
+
+
+def test_custom_image_not_in_allowlist_400(headers):
+    pod_def = {
+        "pod_id": test_pod_error_1,
+        "pod_template": "testspods/notallowed:latest"
+    }
+    rsp = client.post("/pods", data=json.dumps(pod_def), headers=headers)
+    data = response_format(rsp)
+    assert rsp.status_code == 400
+    assert any('Custom pod_template images must be in allowlist' in msg for msg in data['message'])
+
+
+def test_template_allowlist_cache():
+    from datetime import datetime
+    from tapisservice.config import conf
+    from models_admin import Template, template_allowlist
+    from metrics import metrics
+
+    site = conf.site_id
+    hits = metrics.counter("template_allowlist_hits", site=site)
+    misses = metrics.counter("template_allowlist_misses", site=site)
+
+    template_allowlist.invalidate(site)
+    start_hits, start_misses = hits.value, misses.value
+    assert not template_allowlist.is_allowed("testspods/allowed", "dev", site)
+    assert not template_allowlist.is_allowed("testspods/allowed", "dev", site)
+    assert (misses.value, hits.value) == (start_misses + 1, start_hits + 1)
+
+    # Prefix entries match any image under them, the trigger's NOTIFY invalidates the cached index.
+    template = Template(object_name="testspods/*", tenants=["dev"], creation_time=datetime.utcnow(), added_by="testuser")
+    template.db_create()
+    try:
+        for _ in range(50):
+            if template_allowlist.is_allowed("testspods/allowed", "dev", site):
+                break
+            time.sleep(0.1)
+        assert template_allowlist.is_allowed("testspods/allowed", "dev", site)
+        assert not template_allowlist.is_allowed("testspods/allowed", "othertenant", site)
+    finally:
+        template.db_delete()
@@ -0,0 +1,211 @@
+import sys
+import time
+import pytest
+import socket
+import threading
+
+# Allows us to import pods's modules.
+sys.path.append('/home/tapis/service')
+from kubernetes import client
+from tapisservice.config import conf
+import spawner
+from codes import PRIORITY_CREATE, PRIORITY_START, PRIORITY_RESTART, REQUESTED, ERROR
+from channels import CommandChannel
+from kubernetes_utils import KubernetesError, KubernetesStartContainerError
+from volume_utils import NFSDiscoveryError
+from spawner import FairShareScheduler, is_already_exists_error, is_transient_spawn_error, retry_delay, handle_spawn_error
+
+
+def command(tenant_id, object_id, priority=PRIORITY_CREATE):
+    return {"object_id": object_id, "object_type": "pod", "tenant_id": tenant_id, "site_id": "tacc", "priority": priority}
+
+
+def drain(scheduler, count):
+    return [scheduler.get() for _ in range(count)]
+
+
+##### FairShareScheduler
+def test_higher_priority_commands_go_first():
+    scheduler = FairShareScheduler(max_buffered=100)
+    for object_id, priority in [("create", PRIORITY_CREATE), ("start", PRIORITY_START), ("restart", PRIORITY_RESTART)]:
+        scheduler.put(command("dev", object_id, priority))
+    # Another tenant's restart goes ahead of a tenant's creates regardless of fair share.
+    scheduler.put(command("other", "other-restart", PRIORITY_RESTART))
+    order = [cmd["object_id"] for cmd in drain(scheduler, 4)]
+    assert set(order[:2]) == {"restart", "other-restart"}
+    assert order[2:] == ["start", "create"]
+
+
+def test_same_priority_is_first_in_first_out_per_tenant():
+    scheduler = FairShareScheduler(max_buffered=100)
+    for idx in range(5):
+        scheduler.put(command("dev", f"pod{idx}"))
+    assert [cmd["object_id"] for cmd in drain(scheduler, 5)] == [f"pod{idx}" for idx in range(5)]
+
+
+def test_flooding_tenant_does_not_starve_others():
+    scheduler = FairShareScheduler(max_buffered=100)
+    for idx in range(50):
+        scheduler.put(command("flood", f"flood{idx}"))
+    # The flood is already being worked on when the other tenant shows up.
+    drain(scheduler, 10)
+    for idx in range(5):
+        scheduler.put(command("dev", f"dev{idx}"))
+    order = [cmd["tenant_id"] for cmd in drain(scheduler, 10)]
+    # Tenants alternate, dev doesn't wait behind the 40 queued flood commands.
+    assert order == ["flood", "dev"] * 5 or order == ["dev", "flood"] * 5
+
+
+def test_tenant_weights():
+    scheduler = FairShareScheduler(weights={"heavy": 2}, max_buffered=100)
+    for idx in range(30):
+        scheduler.put(command("heavy", f"heavy{idx}"))
+        scheduler.put(command("dev", f"dev{idx}"))
+    order = [cmd["tenant_id"] for cmd in drain(scheduler, 30)]
+    assert order.count("heavy") == 20
+    assert order.count("dev") == 10
+
+
+@pytest.mark.parametrize("max_buffered", [1, 3])
+def test_buffer_is_bounded(max_buffered):
+    scheduler = FairShareScheduler(max_buffered=max_buffered)
+    for idx in range(max_buffered):
+        scheduler.put(command("dev", f"pod{idx}"))
+    waiter = threading.Thread(target=scheduler.wait_for_capacity, daemon=True)
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()
+    scheduler.get()
+    waiter.join(1)
+    assert not waiter.is_alive()
+
+
+##### Spawn errors
+def wrapped(e):
+    """e raised from inside kubernetes_utils, which wraps k8 errors in KubernetesError."""
+    try:
+        try:
+            raise e
+        except Exception:
+            raise KubernetesError("Error creating pod")
+    except KubernetesError as wrapper:
+        return wrapper
+
+
+@pytest.mark.parametrize("error, transient, already_exists", [
+    (client.ApiException(status=409), False, True),
+    (wrapped(client.ApiException(status=409)), False, True),
+    (client.ApiException(status=429), True, False),
+    (wrapped(client.ApiException(status=503)), True, False),
+    (client.ApiException(status=400), False, False),
+    (client.ApiException(status=422), False, False),
+    (NFSDiscoveryError("no nfs"), True, False),
+    (wrapped(socket.timeout()), True, False),
+    (KubernetesStartContainerError("bad spec"), False, False),
+    (ValueError("bad template"), False, False)])
+def test_spawn_error_classification(error, transient, already_exists):
+    assert is_transient_spawn_error(error) == transient
+    assert is_already_exists_error(error) == already_exists
+
+
+def test_retry_delay_backoff(monkeypatch):
+    monkeypatch.setitem(conf, "spawner_retry_base_delay", 5)
+    monkeypatch.setitem(conf, "spawner_retry_max_delay", 60)
+    assert [retry_delay(attempt) for attempt in range(1, 7)] == [5, 10, 20, 40, 60, 60]
+
+
+class FakePod(object):
+    pod_id = "testspodsspawner"
+    site_id = "tacc"
+    k8_name = "pods-tacc-dev-testspodsspawner"
+    status = "SPAWNER_SETUP"
+    status_container = {}
+
+    def __init__(self):
+        self.updates = []
+
+    def db_update(self, log=None):
+        self.updates.append((self.status, log))
+
+
+class FakeChannel(object):
+    def __init__(self):
+        self.retries = []
+        self.dead = []
+
+    def put_retry(self, cmd, delay):
+        self.retries.append((cmd, delay))
+
+    def put_dead(self, cmd, error):
+        self.dead.append((cmd, error))
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def spawn_error_env(monkeypatch):
+    channel = FakeChannel()
+    removed = []
+    monkeypatch.setattr(spawner, "rm_pod", removed.append)
+    monkeypatch.setattr(CommandChannel, "for_object", classmethod(lambda cls, site_id, object_type: channel))
+    monkeypatch.setitem(conf, "spawner_max_retries", 2)
+    monkeypatch.setitem(conf, "spawner_retry_base_delay", 5)
+    monkeypatch.setitem(conf, "spawner_retry_max_delay", 60)
+    return channel, removed
+
+
+def test_transient_error_is_retried(spawn_error_env):
+    channel, removed = spawn_error_env
+    pod = FakePod()
+    cmd = {"object_id": pod.pod_id, "object_type": "pod", "tenant_id": "dev", "site_id": "tacc"}
+    handle_spawn_error(pod, client.ApiException(status=503), cmd)
+    assert removed == [pod.k8_name]
+    assert pod.status == REQUESTED
+    assert channel.retries == [({**cmd, "attempt": 1}, 5)]
+    assert not channel.dead
+
+    # The retry comes back with its attempt, the next delay doubles.
+    handle_spawn_error(pod, client.ApiException(status=503), channel.retries[-1][0])
+    assert channel.retries[-1] == ({**cmd, "attempt": 2}, 10)
+
+
+def test_exhausted_retries_are_dead_lettered(spawn_error_env):
+    channel, removed = spawn_error_env
+    pod = FakePod()
+    cmd = {"object_id": pod.pod_id, "object_type": "pod", "tenant_id": "dev", "site_id": "tacc", "attempt": 2}
+    handle_spawn_error(pod, client.ApiException(status=503), cmd)
+    assert pod.status == ERROR
+    assert "retries exhausted" in pod.status_container["message"]
+    assert not channel.retries
+    assert channel.dead == [(cmd, str(client.ApiException(status=503)))]
+
+
+@pytest.mark.parametrize("error", [client.ApiException(status=400), KubernetesStartContainerError("bad spec")])
+def test_permanent_error_is_dead_lettered(spawn_error_env, error):
+    channel, removed = spawn_error_env
+    pod = FakePod()
+    cmd = {"object_id": pod.pod_id, "object_type": "pod", "tenant_id": "dev", "site_id": "tacc"}
+    handle_spawn_error(pod, error, cmd)
+    assert removed == [pod.k8_name]
+    assert pod.status == ERROR
+    assert "permanent error" in pod.status_container["message"]
+    assert not channel.retries
+    assert channel.dead == [(cmd, str(error))]
+
+
+def test_retry_resets_enqueue_ts(monkeypatch):
+    # Queue wait is measured from when the retry is back on the command channel, not from the first put.
+    published = []
+    monkeypatch.setattr(CommandChannel, "_declare_once", lambda self, name, arguments=None: None)
+    monkeypatch.setattr(CommandChannel, "put", lambda self, m, priority=None, content_type=None, routing_key=None: published.append((m, routing_key)))
+    channel = CommandChannel.__new__(CommandChannel)
+    channel.name = "command_channel_tests"
+    cmd = {"object_id": "testspodsspawner", "object_type": "pod", "tenant_id": "dev", "site_id": "tacc",
+           "enqueue_ts": time.time() - 600, "attempt": 1}
+    before = time.time()
+    channel.put_retry(cmd, 10)
+    (retry, routing_key), = published
+    assert routing_key == "command_channel_tests_retry_10s"
+    assert before + 10 <= retry["enqueue_ts"] <= time.time() + 10
+    assert {**retry, "enqueue_ts": cmd["enqueue_ts"]} == cmd
@@ -0,0 +1,243 @@
+import sys
+import json
+import pytest
+
+# Allows us to import pods's modules.
+sys.path.append('/home/tapis/service')
+from sqlalchemy import literal, select, text
+from sqlalchemy.dialects import postgresql
+from tapisservice.config import conf
+from store import PostgresStore, replica_reads
+from metrics import metrics
+from stores import pg_store, SiteStores, SITE_TENANT_DICT, warmup
+from models_pods import Pod, tenant_base_urls, networking_url
+from models_volumes import Volume
+from models_snapshots import Snapshot
+from transfer import export_tenant, import_tenant, MANIFEST_FILE, TRANSFER_MODELS, K8_NAME_PREFIX
+
+
+def test_one_engine_per_site():
+    # Every tenant (plus siteadmintable and defaulttables) is a view on its site's store.
+    for site, tenant_stores in pg_store.items():
+        engines = {id(store.engine) for store in tenant_stores.values()}
+        assert len(engines) == 1
+        schemas = {store.schema for store in tenant_stores.values()}
+        assert schemas == set(tenant_stores.keys())
+
+
+def test_tenant_views_query_their_schema():
+    site_stores = pg_store[conf.site_id]
+    engine = next(iter(site_stores.values())).engine
+    for tenant, store in site_stores.items():
+        if tenant in ["siteadmintable", "defaulttables"]:
+            continue
+        for pod in store.run("execute", select(Pod), scalars=True, all=True):
+            assert pod.tenant_id == tenant
+    # Queries ran one after another, so they all reused the same pooled connection.
+    assert engine.pool.checkedout() == 0
+    assert engine.pool.checkedin() <= conf.postgres_pool_size
+
+
+@pytest.mark.parametrize("tenant_count", [1, 10, 100])
+def test_connections_flat_as_tenants_grow(tenant_count):
+    site_pg = PostgresStore(username=conf.postgres_user,
+                            password=conf.postgres_pass,
+                            host=conf.postgres_host,
+                            dbname="postgres")
+    views = [site_pg.for_schema(f"testtenant{idx}") for idx in range(tenant_count)]
+    for view in views:
+        assert view.run("execute", select(literal(1)), scalar_one=True) == 1
+
+    # One connection was opened no matter how many tenants used the store.
+    assert site_pg.engine.pool.checkedout() == 0
+    assert site_pg.engine.pool.checkedin() == 1
+    site_pg.engine.dispose()
+
+
+def test_replica_routing():
+    # The primary stands in for the replica, pg_last_wal_receive_lsn() is null there so lag reads as 0.
+    site_pg = PostgresStore(username=conf.postgres_user,
+                            password=conf.postgres_pass,
+                            host=conf.postgres_host,
+                            dbname="postgres",
+                            replica_host=conf.postgres_host)
+    store = site_pg.for_schema("replicatest")
+    stmt = select(literal(1))
+
+    # Outside of a GET/HEAD request everything goes to the primary.
+    assert store._route("execute", stmt) == "primary"
+
+    token = replica_reads.set(True)
+    try:
+        replica_count = metrics.counter("postgres_statements", route="replica", reason="read").value
+        assert store.run("execute", stmt, scalar_one=True) == 1
+        assert metrics.counter("postgres_statements", route="replica", reason="read").value == replica_count + 1
+
+        # Writes always go to the primary, and reads after them stay there for read-your-writes.
+        assert store._route("execute", text("CREATE TEMP TABLE t (i int)")) == "primary"
+        store._record_write("execute", text("CREATE TEMP TABLE t (i int)"))
+        assert store._route("execute", stmt) == "primary"
+        # Other schemas aren't affected.
+        assert site_pg.for_schema("replicatest2")._route("execute", stmt) == "replica"
+    finally:
+        replica_reads.reset(token)
+        site_pg.engine.dispose()
+        site_pg.replica_engine.dispose()
+
+
+def test_compile_where_binds_values():
+    stmt = select(Pod).where(*Pod.compile_where([["status", ".eq", "ON'; DROP TABLE pod; --"],
+                                                 ["pod_id", ".in", ["a", "b"]]]))
+    compiled = stmt.compile()
+    # Values are parameters, nothing user provided ends up in the SQL.
+    assert "DROP TABLE" not in str(compiled)
+    assert "ON'; DROP TABLE pod; --" in compiled.params.values()
+
+
+@pytest.mark.parametrize("key, oper", [("not_a_field", ".eq"),
+                                       ("status; DROP TABLE pod; --", ".eq"),
+                                       ("status == 'ON' or True", ".eq"),
+                                       ("__class__", ".eq"),
+                                       ("metadata", ".eq"),
+                                       ("status", ".like"),
+                                       ("status", "=="),
+                                       ("status", ".eq; DROP TABLE pod; --"),
+                                       ("status", "__eq__")])
+def test_compile_where_rejects_unknown_keys_and_opers(key, oper):
+    # Keys must be model fields and opers must be in WHERE_OPERATORS, neither is ever evaluated.
+    with pytest.raises(KeyError):
+        Pod.compile_where([[key, oper, "ON"]])
+
+
+def test_pk_statement_is_reused():
+    assert Pod.pk_statement() is Pod.pk_statement()
+    assert Pod.primary_key_name() == "pod_id"
+    assert Pod.db_get_with_pk("testsnonexistentpod", tenant="dev", site=conf.site_id) is None
+
+
+@pytest.mark.parametrize("model", [Pod, Volume, Snapshot])
+def test_permission_filter_uses_object_permission_index(model):
+    site_stores = pg_store[conf.site_id]
+    tenant = next(tenant for tenant in site_stores if tenant not in ["siteadmintable", "defaulttables"])
+    stmt = select(model).where(model.permission_filter("testuser", "READ"))
+    sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    with site_stores[tenant].engine.connect() as conn:
+        # Test tables are tiny, so tell the planner not to prefer a sequential scan.
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+        conn.execute(text(f'SET LOCAL search_path TO "{tenant}"'))
+        plan = conn.execute(text(f"EXPLAIN {sql}")).scalars().all()
+    assert any("object_permission_pkey" in line or "ix_object_permission_username" in line for line in plan)
+
+
+def test_object_permission_last_entry_wins():
+    # Same rule as get_permissions() for a user listed twice in the array.
+    site_stores = pg_store[conf.site_id]
+    with site_stores["dev"].engine.connect() as conn:
+        conn.execute(text('SET LOCAL search_path TO "dev"'))
+        pod_id = conn.execute(text("UPDATE pod SET permissions = ARRAY['testsdupuser:READ', 'testsdupuser:ADMIN'] "
+                                   "WHERE pod_id = (SELECT pod_id FROM pod LIMIT 1) RETURNING pod_id")).scalar()
+        if pod_id is None:
+            pytest.skip("Needs a pod in tenant dev.")
+        level = conn.execute(text("SELECT level FROM object_permission WHERE object_type = 'pod' "
+                                  "AND object_id = :pod_id AND username = 'testsdupuser'"), {"pod_id": pod_id}).scalar_one()
+        # Never committed, the pod keeps its permissions.
+        conn.rollback()
+    assert level == "ADMIN"
+
+
+def test_projection_loads_less_than_full_rows():
+    # Compare bytes read for full pod rows vs the health snapshot projection (health.POD_HEALTH_COLUMNS) across every tenant.
+    columns = ["pod_id", "tenant_id", "site_id", "status", "status_requested", "time_to_stop_ts"]
+    full_bytes = projected_bytes = 0
+    for tenant, store in pg_store[conf.site_id].items():
+        if tenant in ["siteadmintable", "defaulttables"]:
+            continue
+        full_bytes += store.run("execute", text("SELECT coalesce(sum(pg_column_size(p.*)), 0) FROM pod AS p"), scalar_one=True)
+        projected_bytes += store.run("execute", text(f"SELECT coalesce(sum(pg_column_size(ROW({', '.join(columns)}))), 0) FROM pod"), scalar_one=True)
+        # Projections return lightweight rows holding only the requested columns.
+        for row in store.run("execute", select(*Pod.project(columns)), all=True):
+            assert list(row._fields) == columns
+
+    assert projected_bytes <= full_bytes
+
+    with pytest.raises(KeyError):
+        Pod.project(["not_a_field"])
+
+
+def test_transfer_export_import_roundtrip(tmp_path):
+    def counts():
+        return {table: pg_store[conf.site_id]["dev"].run("execute", text(f"SELECT count(*) FROM {table}"), scalar_one=True)
+                for table in ["pod", "password", "volume", "snapshot"]}
+    before = counts()
+    manifest = export_tenant("dev", str(tmp_path))
+    assert {table: info["rows"] for table, info in manifest["tables"].items()} == before
+
+    # Importing over existing objects needs replace, the failed import writes nothing.
+    if before["pod"]:
+        with pytest.raises(ValueError):
+            import_tenant("dev", str(tmp_path))
+    import_tenant("dev", str(tmp_path), replace=True)
+    assert counts() == before
+
+    # Unknown format versions are rejected before anything is loaded.
+    manifest_path = tmp_path / MANIFEST_FILE
+    manifest["format_version"] = 999
+    manifest_path.write_text(json.dumps(manifest))
+    with pytest.raises(ValueError):
+        import_tenant("dev", str(tmp_path), replace=True)
+
+
+def test_transfer_import_into_another_tenant(tmp_path):
+    # k8_names and networking urls are rebuilt for the target tenant and live pod fields are reset.
+    other_tenants = [tenant for tenant in SITE_TENANT_DICT[conf.site_id] if tenant != "dev"]
+    if not other_tenants:
+        pytest.skip("Needs a second tenant on this site.")
+    target = other_tenants[0]
+    store = pg_store[conf.site_id]["dev"]
+    def ids(tenant, model):
+        primary_key = model.primary_key_name()
+        return set(store.run("execute", text(f'SELECT {primary_key} FROM "{tenant}".{model.table_name()}'), scalars=True, all=True))
+    exported = {model: ids("dev", model) for model in TRANSFER_MODELS}
+    if any(exported[model] & ids(target, model) for model in TRANSFER_MODELS):
+        pytest.skip(f"Tenant: {target} already has objects with dev's ids.")
+
+    export_tenant("dev", str(tmp_path))
+    import_tenant(target, str(tmp_path))
+    try:
+        assert all(exported[model] <= ids(target, model) for model in TRANSFER_MODELS)
+        for model in [Pod, Volume, Snapshot]:
+            rows = store.run("execute", text(f'SELECT tenant_id, k8_name FROM "{target}".{model.table_name()}'), all=True)
+            for tenant_id, k8_name in rows:
+                assert tenant_id == target
+                assert k8_name.startswith(f"{K8_NAME_PREFIX[model.table_name()]}-{conf.site_id}-{target}-")
+        base_url = tenant_base_urls.get(target)
+        pods = store.run("execute", text(f'SELECT pod_id, status, status_container, start_instance_ts, networking FROM "{target}".pod '
+                                         f'WHERE pod_id = ANY(:ids)'), fn_params={"params": {"ids": list(exported[Pod])}}, all=True)
+        for pod_id, status, status_container, start_instance_ts, networking in pods:
+            assert (status, status_container, start_instance_ts) == ("STOPPED", {}, None)
+            for net_name, net_info in networking.items():
+                assert net_info["url"] == networking_url(base_url, pod_id, net_name)
+    finally:
+        for model in reversed(TRANSFER_MODELS):
+            if exported[model]:
+                store.run("execute", text(f'DELETE FROM "{target}".{model.table_name()} WHERE {model.primary_key_name()} = ANY(:ids)'),
+                          fn_params={"params": {"ids": list(exported[model])}})
+
+
+def test_lazy_site_stores():
+    tenants = SITE_TENANT_DICT[conf.site_id]
+    site_stores = SiteStores(conf.site_id, tenants.copy(), PostgresStore)
+    # Nothing is built until a tenant is used.
+    assert site_stores._site_store is None
+    assert set(site_stores) == set(tenants) | {"siteadmintable", "defaulttables"}
+    with pytest.raises(KeyError):
+        site_stores["notatenant"]
+
+    store = site_stores[tenants[0]]
+    assert store is site_stores[tenants[0]]
+    assert store.schema == tenants[0]
+    assert site_stores[tenants[-1]].engine is store.engine
+
+    warmup({conf.site_id: site_stores}, {conf.site_id: tenants})
+    assert site_stores._site_store.engine.pool.checkedin() >= 1
+    site_stores._site_store.engine.dispose()